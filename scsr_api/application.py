@@ -30,6 +30,33 @@ class ScsrAPP:
         
         # setup db
         db.init_app(self.APP)
+        # background tasks (post-save maintenance)
+        from utils import tasks
+        tasks.init_app(self.APP)
+        # one identity map (DB -> AO conversions) per request
+        from utils import identity_map
+        identity_map.init_app(self.APP)
+        # language lookups cache
+        from sys_app.models.localization import language_cache
+        language_cache.configure(ttl=self.APP.config.get("LANGUAGE_CACHE_TTL"))
+        # genres resolved by id
+        from game.models.genre import genre_cache
+        genre_cache.configure(ttl=self.APP.config.get("GENRE_CACHE_TTL"))
+        # reassigned elements resolved to their canonical ones
+        from scsr.models.elements import canonical_elements
+        canonical_elements.configure(ttl=self.APP.config.get("CANONICAL_ELEMENTS_TTL"))
+        # scsrs per batch of the streaming consolidation
+        from scsr.models.scsr import ScsrDB
+        ScsrDB.CONSOLIDATION_BATCH_SIZE=self.APP.config.get("CONSOLIDATION_BATCH_SIZE",ScsrDB.CONSOLIDATION_BATCH_SIZE)
+        # diffs per page of the lazy histories
+        from utils import lazy
+        lazy.PAGE_SIZE=self.APP.config.get("HISTORY_PAGE_SIZE",lazy.PAGE_SIZE)
+        # diffs between the snapshots of the behaviors
+        from scsr.models.behaviors import BehaviorSnapshotDB
+        BehaviorSnapshotDB.EVERY=self.APP.config.get("SNAPSHOT_EVERY",BehaviorSnapshotDB.EVERY)
+        # refresh of the game x element matrix of the similarity queries
+        from scsr.similarity import game_elements
+        game_elements.configure(ttl=self.APP.config.get("SIMILARITY_REFRESH_TTL"),window=self.APP.config.get("SIMILARITY_REFRESH_WINDOW"))
 
         #setup logger
         the_log = self.APP.logger
@@ -41,6 +68,13 @@ class ScsrAPP:
         from user.views import user_app
         from sys_app.views import app_app
 
+        # signing keys used by requires_auth
+        from sys_app.decorators import key_store
+        key_store.configure(path=self.APP.config.get("AUTH0_JWKS_FILE"), ttl=self.APP.config.get("JWKS_CACHE_TTL"))
+        # autocomplete indexes (registered by the models imported above)
+        from utils import typeahead
+        typeahead.configure(backend=self.APP.config.get("TYPEAHEAD_BACKEND","memory"))
+
         scsrView=ScsrView()
         scsrView.registerBlueprints(self.APP)
 
@@ -2,6 +2,9 @@ from mongoengine import signals
 import json
 from application import db, the_log
 from game.models.genre import GenreDB, GenreAO
+from utils import identity_map
+from utils.indexes import index_registry
+from utils.typeahead import typeahead_index, ANY_LANGUAGE
 from datetime import datetime
 from uuid import uuid4
 
@@ -60,7 +63,7 @@ class GameDB(db.Document):
     updated = db.DateTimeField(db_field="updated", required=True, default=datetime.utcnow) # pylint: disable=no-member
     
     meta = {
-        "indexes": [("external_id", "name", "studio", "publisher", "active")]
+        "indexes": ["external_id", "studio", "publisher", "year"]
     }
 
     def to_obj(self):
@@ -98,7 +101,7 @@ class GameDB(db.Document):
         """
 
         from game.models.user_game_genre import GameGenreQuantificationDB
-        GameGenreQuantificationDB.s_get_genres(self)
+        return GameGenreQuantificationDB.s_get_genres(self)
 
     def __update_data__(self):
         """
@@ -133,9 +136,9 @@ class GameDB(db.Document):
             name {String} -- The text to be searched in the game name   
         
         Returns:
-            GameDB instance -- a GameDB instance with the proper data from the database or None
+            list -- the GameDB instances found (typeahead index), best matches first
         """
-        return GameDB.objects(__raw__={"name."+lang.lower():{'$regex':name,'$options':'i'}}) # pylint: disable=no-member
+        return game_name_typeahead.seek(name,lang)
 
     @staticmethod
     def seek_studio(name):
@@ -157,9 +160,9 @@ class GameDB(db.Document):
             name {String} -- The text part of the studio to be searched   
         
         Returns:
-            GameDB instance -- a GameDB instance with the proper data from the database or None
+            list -- the GameDB instances found (typeahead index), best matches first
         """
-        return GameDB.objects(__raw__={"studio":{'$regex':name,'$options':'i'}}) # pylint: disable=no-member
+        return game_studio_typeahead.seek(name)
 
     @staticmethod
     def seek_publisher(name):
@@ -182,9 +185,9 @@ class GameDB(db.Document):
             name {String} -- The text part of the publisher name to be searched   
         
         Returns:
-            GameDB instance -- a GameDB instance with the proper data from the database or None
+            list -- the GameDB instances found (typeahead index), best matches first
         """
-        return GameDB.objects(__raw__={"publisher":{'$regex':name,'$options':'i'}}) # pylint: disable=no-member
+        return game_publisher_typeahead.seek(name)
 
     @staticmethod
     def seek_year(the_year):
@@ -268,9 +271,39 @@ class GameDB(db.Document):
         the_gamesDB=[el.__get_persisted__() for el in the_gamesAO] # pylint: disable=no-member
         return the_gamesDB
 
+    @staticmethod
+    def seek_by_genres(lang, all_of=(), any_of=(), none_of=()):
+        """ Seeks the games classified in all the genres of all_of, in at least one of any_of and in none of none_of
+            (see GamesGenresAO.s_query). The genres are resolved in one query, the games fetched in another.
+
+        Arguments:
+            lang {String} -- The language code for the genres specified (ex: 'pt')
+
+        Keyword Arguments:
+            all_of {list} -- Genre names (AND) (default: {()})
+            any_of {list} -- Genre names (OR) (default: {()})
+            none_of {list} -- Genre names (NOT) (default: {()})
+
+        Returns:
+            List -- A List of GameDB objects
+        """
+        from game.models.user_game_genre import GamesGenresAO
+        names=list(set(all_of)|set(any_of)|set(none_of))
+        lang=lang.lower()
+        found={genre.genre.get(lang):genre for genre in GenreDB.objects(__raw__={"genre."+lang:{"$in":names}, "active":True})} if names else {} # pylint: disable=no-member
+        if any(name not in found for name in all_of):
+            return []
+        any_found=[found[name] for name in any_of if name in found]
+        if any_of and not any_found:
+            return []
+        the_games=GamesGenresAO.s_query([found[name] for name in all_of], any_found, [found[name] for name in none_of if name in found])
+        if not the_games:
+            return []
+        return list(GameDB.objects(id__in=list(the_games.games))) # pylint: disable=no-member
+
     @staticmethod
     def seek_by_genres_or(lang,genre):
-        """ Seeks the games reported to be classified as the provided genre
+        """ Seeks the games reported to be classified as at least one of the provided genres
         
         Arguments:
             lang {String} -- The language code for the genre specified (ex: 'pt')
@@ -278,14 +311,12 @@ class GameDB(db.Document):
         
         Returns:
             List -- A List of GameDB objects reported to be classified in the specified genres
-
-            TODO: The GamesGenres will provide it!
         """
-        pass
+        return GameDB.seek_by_genres(lang,any_of=genre)
 
     @staticmethod
     def seek_by_genres_and(lang,genre):
-        """ Seeks the games reported to be classified as the provided genre
+        """ Seeks the games reported to be classified as all the provided genres
         
         Arguments:
             lang {String} -- The language code for the genre specified (ex: 'pt')
@@ -293,10 +324,8 @@ class GameDB(db.Document):
         
         Returns:
             List -- A List of GameDB objects reported to be classified in the specified genres
-
-            TODO: The GamesGenres will provide it!
         """
-        pass
+        return GameDB.seek_by_genres(lang,all_of=genre)
 
     @classmethod
     def pre_save(cls, sender, document, **kwargs):
@@ -320,13 +349,9 @@ class GameDB(db.Document):
             document {UserGameGenre} -- The instance of the document
         """
         if hasattr(document,"is_new"):
-            #it is a new game. calls for a new quantification object
-            from game.models.user_game_genre import GameGenreQuantificationDB
-            newQuant=GameGenreQuantificationDB()
-            newQuant.game=document
-            #a new game, no genre assigned yet
-            newQuant.genreCount={}
-            newQuant.save()
+            #it is a new game. calls for a new quantification object (background task)
+            from game.models.user_game_genre import create_quantification
+            create_quantification.enqueue("game_quantification:"+document.external_id,document.external_id)
 
     def __repr__(self):
         the_game=f" External_id: {self.external_id}\n Name: {self.name}\n Studio: {self.studio}\n Publisher: {self.publisher}\n Year: {self.year}\n"
@@ -334,6 +359,22 @@ class GameDB(db.Document):
 
 signals.pre_save.connect(GameDB.pre_save, sender=GameDB)
 signals.post_save.connect(GameDB.post_save, sender=GameDB)
+game_name_typeahead = typeahead_index("game.name", GameDB, lambda game: game.name, fields=["name"])
+game_studio_typeahead = typeahead_index("game.studio", GameDB, lambda game: {ANY_LANGUAGE: game.studio}, fields=["studio"])
+game_publisher_typeahead = typeahead_index("game.publisher", GameDB, lambda game: {ANY_LANGUAGE: game.publisher}, fields=["publisher"])
+index_registry.declare(GameDB,
+    localized=[("name.{lang}", "studio", "year")],
+    probes=[
+        ("seek_exact_name", {"name.{lang}": "probe"}),
+        ("import_games", {"name.{lang}": "probe", "studio": "probe", "year": {"$gte": datetime(2000,1,1), "$lt": datetime(2001,1,1)}}),
+        ("seek_studio", {"studio": "probe"}),
+        ("seek_publisher", {"publisher": "probe"}),
+        ("seek_year", {"year": datetime(2000,1,1)}),
+        ("seek_post_year", {"year": {"$gt": datetime(2000,1,1)}}),
+        ("seek_pre_year", {"year": {"$lt": datetime(2000,1,1)}}),
+        ("seek_until_year", {"year": {"$lte": datetime(2000,1,1)}}),
+        ("__get_persisted__", {"external_id": "probe"})
+    ])
 
 
 class GameAO(object):
@@ -401,23 +442,52 @@ class GameAO(object):
 
 
     @staticmethod
-    def from_GameDB(data):
+    def from_GameDB(data, genre_count=None):
+        """ Builds the GameAO.
+
+            Arguments:
+                data {GameDB} -- The game
+
+            Keyword Arguments:
+                genre_count {list} -- The genre quantification, if already read (see from_GameDB_list) (default: {None}: read)
+        """
         if not isinstance(data,GameDB):
             raise TypeError("Error: Argument is not a valid GameDB object.")
+        retorno = identity_map.cached(data)
+        if retorno is not None:
+            return retorno
         retorno=GameAO()
+        identity_map.register(data,retorno)
         retorno.external_id = data.external_id
         retorno.year = data.year
         retorno.name = data.name
         retorno.studio = data.studio
         retorno.publisher = data.publisher
-        from game.models.user_game_genre import GameGenreQuantificationDB
-        retorno.genreCount = GameGenreQuantificationDB.s_get_genres_ao(data)
+        if genre_count is None:
+            from game.models.user_game_genre import GameGenreQuantificationDB
+            genre_count = GameGenreQuantificationDB.s_get_genres_ao(data)
+        retorno.genreCount = genre_count
         retorno.date_proposed = data.date_proposed
         retorno.date_accepted = data.date_accepted
         retorno.active = data.active
         retorno.updated = data.updated
         return retorno
 
+    @staticmethod
+    def from_GameDB_list(datas):
+        """ Builds the GameAO of many games (listing pages), reading their genre quantifications at once
+
+            Arguments:
+                datas {iterable} -- The GameDB objects
+
+            Returns:
+                list -- The GameAO objects, in the same order
+        """
+        datas=list(datas)
+        from game.models.user_game_genre import GameGenreQuantificationDB
+        genre_counts=GameGenreQuantificationDB.s_get_genres_many([data for data in datas if identity_map.cached(data) is None])
+        return [GameAO.from_GameDB(data,genre_counts.get(data.external_id)) for data in datas]
+
     def to_json(self):
         retorno={
             "external_id" : getattr(self,"external_id",None),
@@ -510,9 +580,9 @@ class GameAO(object):
             name {String} -- The text to be searched in the game name   
         
         Returns:
-            GameAO instance -- a GameAO instance with the proper data from the database or None
+            list -- the GameAO instances found, best matches first
         """
-        return GameDB.seek_partial_name(lang,name).to_obj()
+        return GameAO.from_GameDB_list(GameDB.seek_partial_name(lang,name))
 
     @staticmethod
     def seek_studio(name):
@@ -524,7 +594,7 @@ class GameAO(object):
         Returns:
             GameDB instance -- a GameDB instance with the proper data from the database or None
         """
-        return GameDB. seek_studio(name).to_obj()
+        return GameAO.from_GameDB_list(GameDB.seek_studio(name))
         
     @staticmethod
     def seek_partial_studio(name):
@@ -536,7 +606,7 @@ class GameAO(object):
         Returns:
             GameDB instance -- a GameDB instance with the proper data from the database or None
         """
-        return [data.to_obj() for data in GameDB.seek_partial_studio(name)]
+        return GameAO.from_GameDB_list(GameDB.seek_partial_studio(name))
 
     @staticmethod
     def seek_publisher(name):
@@ -549,7 +619,7 @@ class GameAO(object):
             GameDB instance -- a GameDB instance with the proper data from the database or None
         """
 
-        return [data.to_obj() for data in GameDB.seek_publisher(name)]
+        return GameAO.from_GameDB_list(GameDB.seek_publisher(name))
         
     @staticmethod
     def seek_partial_publisher(name):
@@ -561,7 +631,7 @@ class GameAO(object):
         Returns:
             GameDB instance -- a GameDB instance with the proper data from the database or None
         """
-        return [data.to_obj() for data in GameDB.seek_partial_publisher(name)]
+        return GameAO.from_GameDB_list(GameDB.seek_partial_publisher(name))
 
     @staticmethod
     def seek_year(the_year):
@@ -573,7 +643,7 @@ class GameAO(object):
         Returns:
             List -- A List of GameDB objects with the games published in the specified year
         """
-        return [data.to_obj() for data in GameDB.seek_year(the_year)]
+        return GameAO.from_GameDB_list(GameDB.seek_year(the_year))
 
     @staticmethod
     def seek_post_year(the_year):
@@ -585,7 +655,7 @@ class GameAO(object):
         Returns:
             List -- A List of GameDB objects with the games published after the specified year
         """
-        return [data.to_obj() for data in GameDB.seek_post_year(the_year)]
+        return GameAO.from_GameDB_list(GameDB.seek_post_year(the_year))
 
     @staticmethod
     def seek_pre_year(the_year):
@@ -597,7 +667,7 @@ class GameAO(object):
         Returns:
             List -- A List of GameDB objects with the games published prior to the specified year
         """
-        return [data.to_obj() for data in GameDB.seek_pre_year(the_year)]
+        return GameAO.from_GameDB_list(GameDB.seek_pre_year(the_year))
 
     @staticmethod
     def seek_until_year(the_year):
@@ -609,7 +679,7 @@ class GameAO(object):
         Returns:
             List -- A List of GameDB objects with the games published until the specified year
         """
-        return [data.to_obj() for data in GameDB.seek_until_year(the_year)]
+        return GameAO.from_GameDB_list(GameDB.seek_until_year(the_year))
 
     @staticmethod
     def seek_from_year(the_year):
@@ -621,7 +691,7 @@ class GameAO(object):
         Returns:
             List -- A List of GameDB objects with the games published from the specified year
         """
-        return [data.to_obj() for data in GameDB.seek_from_year(the_year)]
+        return GameAO.from_GameDB_list(GameDB.seek_from_year(the_year))
 
     @staticmethod
     def seek_by_genre(lang,genre):
@@ -639,4 +709,30 @@ class GameAO(object):
         from game.models.user_game_genre import GamesGenresAO
         the_games=GamesGenresAO.seek_genre(the_genre)
         return the_games
+
+    @staticmethod
+    def seek_by_genres_or(lang,genre):
+        """ Seeks the games reported to be classified as at least one of the provided genres
+
+        Arguments:
+            lang {String} -- The language code for the genre specified (ex: 'pt')
+            genre {list} -- The genres to be searched
+
+        Returns:
+            List -- A List of GameAO objects
+        """
+        return GameAO.from_GameDB_list(GameDB.seek_by_genres_or(lang,genre))
+
+    @staticmethod
+    def seek_by_genres_and(lang,genre):
+        """ Seeks the games reported to be classified as all the provided genres
+
+        Arguments:
+            lang {String} -- The language code for the genre specified (ex: 'pt')
+            genre {list} -- The genres to be searched
+
+        Returns:
+            List -- A List of GameAO objects
+        """
+        return GameAO.from_GameDB_list(GameDB.seek_by_genres_and(lang,genre))
         
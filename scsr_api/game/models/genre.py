@@ -6,6 +6,14 @@ from datetime import datetime
 
 from utils import sanitize
 from sys_app.models.localization import TranslationsAO
+from utils import identity_map
+from utils.indexes import index_registry
+from utils.typeahead import typeahead_index
+from utils.cache import TTLCache
+
+#external_id -> GenreDB. The genres are few and rarely change (administrative task).
+#Entries are dropped when the genre is saved/deleted and expire after GENRE_CACHE_TTL seconds (see settings)
+genre_cache = TTLCache(maxsize=1024, ttl=300)
 
 
 class GenreDB(db.Document):
@@ -54,7 +62,7 @@ class GenreDB(db.Document):
     active = db.BooleanField(db_field="active", required=True, default=True) # pylint: disable=no-member
 
     meta = {
-        "indexes": [("external_id", "genre", "active")]
+        "indexes": ["external_id"]
     }
 
 
@@ -76,6 +84,34 @@ class GenreDB(db.Document):
             raise RuntimeError("ERROR: Persistent Data not Found or Mismatched.")
         return dbdata
 
+    @staticmethod
+    def get_genres_by_ids(eids):
+        """ Resolves many genres at once: from the genre cache, the missing ones in one query
+
+            Arguments:
+                eids {iterable} -- The external ids of the genres
+
+            Returns:
+                dict -- {external_id: GenreDB}. Unknown ids are not in it.
+        """
+        retorno={}
+        missing=[]
+        for eid in set(eids):
+            genre=genre_cache.get(eid)
+            if genre is None:
+                missing.append(eid)
+            else:
+                retorno[eid]=genre
+        if missing:
+            for genre in GenreDB.objects.filter(external_id__in=missing): # pylint: disable=no-member
+                retorno[genre.external_id]=genre_cache.set(genre.external_id,genre)
+        return retorno
+
+    @staticmethod
+    def invalidate_genre(sender, document, **kwargs):
+        """ Drops the cached genre when it is saved or deleted """
+        genre_cache.invalidate(document.external_id)
+
 
     @staticmethod #TODO:
     def reassign(old,new):
@@ -152,6 +188,15 @@ class GenreDB(db.Document):
 
 signals.pre_save.connect(GenreDB.pre_save, sender=GenreDB)
 signals.post_save.connect(GenreDB.post_save, sender=GenreDB)
+signals.post_save.connect(GenreDB.invalidate_genre, sender=GenreDB)
+signals.post_delete.connect(GenreDB.invalidate_genre, sender=GenreDB)
+genre_typeahead = typeahead_index("genre", GenreDB, lambda genre: genre.genre if genre.active else None, fields=["genre","active"])
+index_registry.declare(GenreDB,
+    localized=[("genre.{lang}", "active")],
+    probes=[
+        ("GenreAO.get_genre", {"genre.{lang}": "probe", "active": True}),
+        ("GenreDB.get_genre", {"external_id": "probe"})
+    ])
 
 
 class GenreAO(object):
@@ -178,15 +223,19 @@ class GenreAO(object):
 
     @staticmethod
     def from_db(db_obj):
+        retorno = identity_map.cached(db_obj)
+        if retorno is not None:
+            return retorno
         retorno=GenreAO()
         retorno.external_id = db_obj.external_id
         retorno.genre = db_obj.genre
         retorno.active = db_obj.active
         retorno.created = db_obj.created
         retorno.updated = db_obj.updated
+        identity_map.register(db_obj,retorno)
         #reassigned to and reassigned from are not manipulated via GenreAO.
-        retorno.reassigned_to = db_obj.reassigned_to.to_obj()
-        retorno.reassigned_from = [obj.to_obj() for obj in db_obj.reassigned_from]
+        retorno.reassigned_to = identity_map.reference(db_obj,"reassigned_to","GenreDB")
+        retorno.reassigned_from = identity_map.reference_list(db_obj,"reassigned_from","GenreDB")
         #
         return retorno
 
@@ -287,7 +336,7 @@ class GenreAO(object):
 
     @staticmethod
     def suggest_genre(lang,genre):
-        retorno_temp = GenreDB.objects( __raw__ = {"genre."+lang.lower():{'$regex':genre,'$options':'i'}, "active":True}) # pylint: disable=no-member
+        retorno_temp = genre_typeahead.seek(genre,lang)
         retorno=None
         if(retorno_temp):
             retorno=[genre.to_obj() for genre in retorno_temp]
@@ -0,0 +1,91 @@
+import unittest
+import threading
+from mongoengine.connection import _get_db
+from application import ScsrAPP
+from game.models.game import GameDB
+from game.models.genre import GenreDB
+from game.models.user_game_genre import GameGenreQuantificationDB, GamesGenresDB
+from settings import MONGODB_HOST
+
+class GameGenreQuantificationTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print("*"*130)
+        print(" "*40+"Testing Game Genre Quantification")
+        print("*"*130)
+        cls.db_name = 'scsr-api-test-quantification'
+
+        cls.app_factory = ScsrAPP(
+            MONGODB_SETTINGS = {'DB': cls.db_name,
+                'HOST': MONGODB_HOST},
+            TESTING = True,
+            WTF_CSRF_ENABLED = False,
+            SECRET_KEY = 'mySecret!').APP
+        cls.app = cls.app_factory.test_client()
+        from install_system import start_countries, start_language, start_genre, start_games
+        start_countries()
+        start_language()
+        start_genre()
+        start_games()
+
+    @classmethod
+    def tearDownClass(cls):
+        db = _get_db()
+        db.client.drop_database(db)
+
+    @staticmethod
+    def counters(game):
+        return GameGenreQuantificationDB.objects.filter(game=game).first().genreCount # pylint: disable=no-member
+
+    @staticmethod
+    def listed(genre, game):
+        return game.pk in GamesGenresDB.s_games_sets([genre])[genre.pk].games
+
+    def test_01_floor(self):
+        """ Removing a genre never counted keeps it at zero """
+        game=GameDB.objects[0] # pylint: disable=no-member
+        genre=GenreDB.objects[0] # pylint: disable=no-member
+        GameGenreQuantificationDB.s_count_genres(game,removed=[genre,genre])
+        assert self.counters(game).get(genre.external_id,0)==0
+        GameGenreQuantificationDB.s_count_genres(game,added=[genre])
+        GameGenreQuantificationDB.s_count_genres(game,removed=[genre,genre])
+        assert self.counters(game).get(genre.external_id)==0
+        assert not self.listed(genre,game)
+
+    def test_02_parallel(self):
+        """ Many threads tagging the same game: no update is lost """
+        game=GameDB.objects[1] # pylint: disable=no-member
+        kept,dropped=GenreDB.objects[1],GenreDB.objects[2] # pylint: disable=no-member
+        threads_count,rounds=16,25
+        errors=[]
+        def tagger():
+            try:
+                for _ in range(rounds):
+                    GameGenreQuantificationDB.s_count_genres(game,added=[kept,dropped])
+                    GameGenreQuantificationDB.s_count_genres(game,removed=[dropped])
+            except Exception as ex: # pylint: disable=broad-except
+                errors.append(ex)
+        threads=[threading.Thread(target=tagger) for _ in range(threads_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert not errors
+        counters=self.counters(game)
+        assert counters[kept.external_id]==threads_count*rounds
+        assert counters[dropped.external_id]==0
+        assert self.listed(kept,game)
+        assert not self.listed(dropped,game)
+
+    def test_03_genres_many(self):
+        """ The genres of many games are read at once, most cited first """
+        games=list(GameDB.objects[:2]) # pylint: disable=no-member
+        genres=list(GenreDB.objects[3:5]) # pylint: disable=no-member
+        GameGenreQuantificationDB.s_count_genres(games[0],added=[genres[0],genres[1],genres[1]])
+        the_genres=GameGenreQuantificationDB.s_get_genres_many(games)
+        cited=[item["cited"] for item in the_genres[games[0].external_id]]
+        assert cited==sorted(cited,reverse=True)
+        assert the_genres[games[0].external_id][0]["genre"].external_id==genres[1].external_id
+        as_ids=lambda cited_list: [(item["genre"].external_id,item["cited"]) for item in cited_list]
+        assert as_ids(the_genres[games[0].external_id])==as_ids(GameGenreQuantificationDB.s_get_genres_ao(games[0]))
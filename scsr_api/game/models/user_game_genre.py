@@ -4,12 +4,18 @@ from mongoengine import signals
 from mongoengine.queryset.visitor import Q
 from application import db, the_log
 from uuid import uuid4
-from collections import abc
+from collections import abc, Counter
+from pymongo import UpdateOne
+from functools import reduce
+import operator
 
 
 from user.models.user import UserDB
 from game.models.game import GameDB, GameAO 
 from game.models.genre import GenreDB, GenreAO
+from utils.indexes import index_registry
+from utils.tasks import background_task
+from bson import ObjectId
 
 # The UserGameGenre is added only in the scsr creation/update for the game by the user.
 # There, the user can add or remove genres from his own list.
@@ -37,7 +43,7 @@ class UserGameGenreDB(db.Document):
     genre = db.ListField(db.ReferenceField(GenreDB), db_field="genre_list", required=True, unigue=True) # pylint: disable=no-member
 
     meta = {
-        "indexes": [("external_id", "user", "game")]
+        "indexes": ["external_id", ("game", "user")]
     }
 
     def to_obj(self):
@@ -136,7 +142,7 @@ class UserGameGenreDB(db.Document):
             # Get the data...
             #no need, we already are doing it via new_genres
             if(hasattr(document,"new_genres")):
-                for genre in document.new_genres:
+                for genre in list(document.new_genres):
                     # If the genre are not already in the genre list, append
                     if(genre not in document.genre):
                         document.genre.append(genre)
@@ -144,7 +150,7 @@ class UserGameGenreDB(db.Document):
                         # game already has it. Need to remove due to post save
                         document.new_genres.remove(genre)
             if(hasattr(document,"del_genres")):
-                for genre in document.del_genres:
+                for genre in list(document.del_genres):
                     if(genre in document.genre):
                         document.genre.remove(genre)
                     else:
@@ -177,27 +183,25 @@ class UserGameGenreDB(db.Document):
             sender {UserGameGenreDB} -- The sender of the signal
             document {UserGameGenreDB} -- The instance of the document
         """
-        if(hasattr(document,"new_genres")):
-            GameGenreQuantificationDB.s_add_genres(document.game,document.new_genres)
-            """ --- PREVIOUS CODE ---
-            while(len(document.new_genres)>0):
-                the_genre=document.new_genres.pop()
-                document.game.increase_genre(the_genre)
-            """
-        if(hasattr(document,"del_genres")):
-            GameGenreQuantificationDB.s_remove_genres(document.game, document.del_genres)
-            """ --- PREVIOUS CODE ---
-            while(len(document.del_genres)>0):
-                the_genre=document.del_genres.pop()
-                res=document.game.decrease_genre(the_genre)
-                if(res==0):
-                    GamesGenresDB.s_remove_game(the_genre,document.game)
-            """
-        document.game.save()
-        
+        added=getattr(document,"new_genres",())
+        removed=getattr(document,"del_genres",())
+        if(added or removed):
+            # one atomic update of the counters for all the genres (see GameGenreQuantificationDB.s_count_genres), in background.
+            # each save is counted once: its own key
+            count_genres.enqueue("count_genres:"+str(uuid4()),document.game.external_id,
+                [genre.external_id for genre in added],[genre.external_id for genre in removed])
+        # counted: a new save of the same document must not count them again
+        document.new_genres=set()
+        document.del_genres=set()
+
 
 signals.pre_save.connect(UserGameGenreDB.preSave, sender=UserGameGenreDB)
 signals.post_save.connect(UserGameGenreDB.postSave, sender=UserGameGenreDB)
+index_registry.declare(UserGameGenreDB,
+    probes=[
+        ("preSave", {"user": ObjectId(), "game": ObjectId()}),
+        ("get_valid_game", {"game": ObjectId()})
+    ])
 
 class GameGenreQuantificationDB(db.Document):
     """ Class that quantifies the genres in games. Replaces the field in the GamesDB obj, maintaining decoupling of responsibilities.
@@ -227,13 +231,30 @@ class GameGenreQuantificationDB(db.Document):
     genreCount = db.DictField(db_field="genreCount", default={}) # pylint: disable=no-member
 
     def to_obj(self):
-        """ Returns the genres with their respective quantification in a list of dictionaris
+        """ Returns the genres with their respective quantification in a list of dictionaris, most cited first
         
         Returns:
             List(dict) -- The list of dictionaries with the respective genre and quantification in the form (keys) {'genre','cited'}
         """
 
-        retorno=[{'genre':GenreDB.objects.filter(external_id=key).first(),'cited':self.genreCount[key]} for key in self.genreCount.keys()] # pylint: disable=no-member
+        return GameGenreQuantificationDB.__s_cited__(self.genreCount,GenreDB.get_genres_by_ids(self.genreCount.keys()))
+
+    @staticmethod
+    def __s_cited__(genre_count, genres, as_ao=False):
+        """ Builds the {'genre','cited'} list of a genreCount, most cited first
+
+            Arguments:
+                genre_count {dict} -- {genre external_id: count}
+                genres {dict} -- {genre external_id: GenreDB} (GenreDB.get_genres_by_ids)
+
+            Keyword Arguments:
+                as_ao {bool} -- The genres as GenreAO (default: {False}: GenreDB)
+        """
+        retorno=[
+            {"genre": genres[key].to_obj() if as_ao else genres[key], "cited": count}
+            for key,count in genre_count.items() if key in genres
+        ]
+        retorno.sort(key=lambda cited: cited["cited"], reverse=True)
         return retorno
     
     def add_genre(self,genre):
@@ -359,6 +380,87 @@ class GameGenreQuantificationDB(db.Document):
         # No exception raised... returns true!
         return True
 
+    @staticmethod
+    def s_create_quantification(the_game):
+        """ Creates the (empty) quantification of a game, if it does not exist. Idempotent: an upsert that only sets on insert
+
+            Arguments:
+                the_game {GameDB} -- A GameDB Object referring to the game
+
+            Raises:
+                TypeError -- Error if the argument is not a GameDB object
+        """
+        if(not isinstance(the_game,GameDB)):
+            raise TypeError("Argument provided is not a valid GameDB object. Object provided: "+type(the_game))
+        GameGenreQuantificationDB._get_collection().update_one( # pylint: disable=protected-access
+            {"_id":the_game.pk},{"$setOnInsert":{"genreCount":{}}},upsert=True)
+
+    @staticmethod
+    def s_count_genres(the_game, added=(), removed=()):
+        """ Counts the genres assigned to/removed from a game. Data persisted, in one round trip, without reading the counters:
+            the increments are one $inc and each decrement is a $inc conditioned to the counter being positive (floor at zero),
+            so concurrent writers do not lose updates.
+            The games list of the genres (GamesGenresDB) is updated: the game is added to the genres added and
+            removed from the genres whose counter reached zero.
+
+            Arguments:
+                the_game {GameDB} -- A GameDB Object referring to the game
+
+            Keyword Arguments:
+                added {List (GenreDB)} -- The genres assigned (default: {()})
+                removed {List (GenreDB)} -- The genres removed (default: {()})
+
+            Raises:
+                TypeError -- Error if arguments are not of the provided type
+                RuntimeError -- Error if no valid quantification exists
+        """
+        if(not isinstance(the_game,GameDB)):
+            raise TypeError("Argument provided is not a valid GameDB object. Object provided: "+type(the_game))
+        for genre in list(added)+list(removed):
+            if(not isinstance(genre,GenreDB)):
+                raise TypeError("Argument provided in list is not of the class GenreDB. Class provided: "+type(genre))
+        increments=Counter(genre.external_id for genre in added)
+        decrements=Counter(genre.external_id for genre in removed)
+        the_updates=[]
+        if increments:
+            the_updates.append(UpdateOne({"_id":the_game.pk},{"$inc":{"genreCount."+eid:count for eid,count in increments.items()}}))
+        for eid,count in decrements.items():
+            for _ in range(count):
+                the_updates.append(UpdateOne({"_id":the_game.pk,"genreCount."+eid:{"$gt":0}},{"$inc":{"genreCount."+eid:-1}}))
+        if not the_updates:
+            return
+        collection=GameGenreQuantificationDB._get_collection() # pylint: disable=protected-access
+        result=collection.bulk_write(the_updates, ordered=False)
+        # nothing matched: no quantification, unless only decrements of counters already at zero
+        if not result.matched_count and (increments or not collection.count_documents({"_id":the_game.pk},limit=1)):
+            raise RuntimeError("There is no data for the Game provided. There should be. Game: "+the_game.external_id)
+        for genre in {genre.external_id:genre for genre in added}.values():
+            GamesGenresDB.s_append_game(genre,the_game)
+        if removed:
+            GameGenreQuantificationDB.__s_update_genre_lists__(the_game,{genre.external_id:genre for genre in removed})
+
+    @staticmethod
+    def __s_update_genre_lists__(the_game, genres):
+        """ Removes the game from the games list of the genres whose counter is zero.
+            A concurrent assignment may increment the counter after it was read: the counters are read again after the
+            removal and the game is put back where it became positive (the assignment appends the game after incrementing,
+            so one of both always leaves it in the list).
+
+            Arguments:
+                the_game {GameDB} -- The game
+                genres {dict} -- {external_id: GenreDB} of the genres decremented
+        """
+        collection=GameGenreQuantificationDB._get_collection() # pylint: disable=protected-access
+        def zeroed():
+            counters=(collection.find_one({"_id":the_game.pk},{"genreCount."+eid:1 for eid in genres}) or {}).get("genreCount",{})
+            return [eid for eid in genres if counters.get(eid,0)<=0]
+        the_zeroed=zeroed()
+        for eid in the_zeroed:
+            GamesGenresDB.s_remove_game(genres[eid],the_game)
+        if the_zeroed:
+            for eid in set(the_zeroed)-set(zeroed()):
+                GamesGenresDB.s_append_game(genres[eid],the_game)
+
     @staticmethod
     def s_add_genre(the_game,genre):
         """ Static method to add a genre assigned to a game. The quantification is updated. Data persisted.
@@ -373,12 +475,7 @@ class GameGenreQuantificationDB(db.Document):
         """
         if(not isinstance(the_game,GameDB)):
             raise TypeError("Argument provided is not a valid GameDB object. Object provided: "+type(the_game))
-        #seek the game_genre object
-        to_save=GameGenreQuantificationDB.objects.filter(game=the_game).first() # pylint: disable=no-member
-        if(not to_save):
-            raise RuntimeError("There is no data for the Game provided. There should be. Game: "+the_game.external_id)
-        to_save.add_genre(genre)
-        to_save.save()
+        GameGenreQuantificationDB.s_count_genres(the_game,added=[genre])
 
     @staticmethod
     def s_add_genres(the_game,genres):
@@ -394,12 +491,7 @@ class GameGenreQuantificationDB(db.Document):
         """
         if(not isinstance(the_game,GameDB)):
             raise TypeError("Argument provided is not a valid GameDB object. Object provided: "+type(the_game))
-        #seek the game_genre object
-        to_save=GameGenreQuantificationDB.objects.filter(game=the_game).first() # pylint: disable=no-member
-        if(not to_save):
-            raise RuntimeError("There is no data for the Game provided. There should be. Game: "+the_game.external_id)
-        to_save.add_genres(genres)
-        to_save.save()
+        GameGenreQuantificationDB.s_count_genres(the_game,added=genres)
 
     @staticmethod
     def s_remove_genre(the_game,genre):
@@ -415,12 +507,7 @@ class GameGenreQuantificationDB(db.Document):
         """
         if(not isinstance(the_game,GameDB)):
             raise TypeError("Argument provided is not a valid GameDB object. Object provided: "+type(the_game))
-        #seek the game_genre object
-        to_save=GameGenreQuantificationDB.objects.filter(game=the_game).first() # pylint: disable=no-member
-        if(not to_save):
-            raise RuntimeError("There is no data for the Game provided. There should be. Game: "+the_game.external_id)
-        to_save.remove_genre(genre)
-        to_save.save()
+        GameGenreQuantificationDB.s_count_genres(the_game,removed=[genre])
 
     @staticmethod
     def s_remove_genres(the_game,genres):
@@ -437,12 +524,7 @@ class GameGenreQuantificationDB(db.Document):
 
         if(not isinstance(the_game,GameDB)):
             raise TypeError("Argument provided is not a valid GameDB object. Object provided: "+type(the_game))
-        #seek the game_genre object
-        to_save=GameGenreQuantificationDB.objects.filter(game=the_game).first() # pylint: disable=no-member
-        if(not to_save):
-            raise RuntimeError("There is no data for the Game provided. There should be. Game: "+the_game.external_id)
-        to_save.remove_genres(genres)
-        to_save.save()
+        GameGenreQuantificationDB.s_count_genres(the_game,removed=genres)
 
     @staticmethod
     def s_get_genres(the_game):
@@ -453,10 +535,10 @@ class GameGenreQuantificationDB(db.Document):
             
             Raises:
                 TypeError -- If the argument is not a GameDB object
-                RuntimeError -- If a valid GameDB object is provided but no quantification is found
             
             Returns:
-            List -- List of dictionaries containing the Genre object and the number of citations of the genre for the object in the form {genre,cited}
+            List -- List of dictionaries containing the Genre object and the number of citations of the genre for the object in the form {genre,cited}.
+                Empty if the quantification was not created yet
         """
 
         if(not isinstance(the_game,GameDB)):
@@ -464,7 +546,8 @@ class GameGenreQuantificationDB(db.Document):
         #seek the game_genre object
         to_retrieve=GameGenreQuantificationDB.objects.filter(game=the_game).first() # pylint: disable=no-member
         if(not to_retrieve):
-            raise RuntimeError("There is no data for the Game provided. There should be. Game: "+the_game.external_id)
+            # the quantification of a new game is created in background: not counted yet
+            return []
         return to_retrieve.to_obj()
 
     @staticmethod
@@ -476,10 +559,10 @@ class GameGenreQuantificationDB(db.Document):
             
             Raises:
                 TypeError -- If the argument is not a GameDB object
-                RuntimeError -- If a valid GameDB object is provided but no quantification is found
             
             Returns:
-            List -- List of dictionaries containing the Genre object and the number of citations of the genre for the object in the form {genre,cited}
+            List -- List of dictionaries containing the Genre object and the number of citations of the genre for the object in the form {genre,cited}.
+                Empty if the quantification was not created yet
         """
 
         if(not isinstance(the_game,GameDB)):
@@ -487,19 +570,44 @@ class GameGenreQuantificationDB(db.Document):
         #seek the game_genre object
         to_retrieve=GameGenreQuantificationDB.objects.filter(game=the_game).first() # pylint: disable=no-member
         if(not to_retrieve):
-            raise RuntimeError("There is no data for the Game provided. There should be. Game: "+the_game.external_id)
-        return [
-            {
-                "genre": GenreDB.objects.filter(external_id=key).first().to_obj(), # pylint: disable=no-member
-                "cited": to_retrieve.genreCount[key]
-            }
-            for key in to_retrieve.genreCount.keys()
-        ]
+            # the quantification of a new game is created in background: not counted yet
+            return []
+        return GameGenreQuantificationDB.__s_cited__(to_retrieve.genreCount,GenreDB.get_genres_by_ids(to_retrieve.genreCount.keys()),as_ao=True)
+
+    @staticmethod
+    def s_get_genres_many(the_games, as_ao=True):
+        """ Return the genre quantification data of many games (listing pages): one query for the quantifications,
+            the genres resolved at once (GenreDB.get_genres_by_ids).
+
+            Arguments:
+                the_games {list} -- The GameDB objects
+
+            Keyword Arguments:
+                as_ao {bool} -- The genres as GenreAO (default: {True}), else GenreDB
+
+            Raises:
+                TypeError -- If an element is not a GameDB object
+
+            Returns:
+                dict -- {game external_id: list of {genre,cited}, most cited first}. Games without quantification have an empty list.
+        """
+        for the_game in the_games:
+            if(not isinstance(the_game,GameDB)):
+                raise TypeError("Argument provided is not a valid GameDB object. Object provided: "+type(the_game))
+        the_ids={the_game.pk:the_game.external_id for the_game in the_games}
+        if not the_ids:
+            return {}
+        the_counts={doc["_id"]:doc.get("genreCount",{}) for doc in GameGenreQuantificationDB._get_collection().find({"_id":{"$in":list(the_ids)}},{"genreCount":1})} # pylint: disable=protected-access
+        genres=GenreDB.get_genres_by_ids(key for genre_count in the_counts.values() for key in genre_count)
+        return {eid:GameGenreQuantificationDB.__s_cited__(the_counts.get(pk,{}),genres,as_ao=as_ao) for pk,eid in the_ids.items()}
 
 class GamesGenresDB(db.Document):
     """ Collection that lists all games classified with the genre.
         Game that have 0 in the genre count must be removed from the list.
 
+        It is the inverted index genre -> games (posting list): the list is updated in place ($addToSet/$pull)
+        and read as ids, without dereferencing the games, for the genre queries (GamesGenresAO.s_query).
+
         Attributes:
             genre {GenreDB} -- The genre the games are assigned to. It is the primary key
             gamesList {ListField(GameDB)} -- A List of GameDB objects. Not just the references.
@@ -507,11 +615,7 @@ class GamesGenresDB(db.Document):
         Methods:
             s_append_game(the_genre, game): Adds a game to the genre list
             s_remove_game(the_genre, game): Removes a game to the genre list
-
-        TODO:
-            Code the methods to:
-                Get the games that has at least one of the genres in a list assigned to them
-                Get the games that has all genres specified assigned to them.
+            s_games_sets(genres): Returns the ids of the games of each genre
     """
 
     genre = db.ReferenceField(GenreDB, db_field="genre", unique=True, primary_key=True) # pylint: disable=no-member
@@ -568,12 +672,9 @@ class GamesGenresDB(db.Document):
 
         if(not isinstance(game,GameDB)):
             raise TypeError("Error: the argument provided is not a valid GameDB object. Object provided: "+type(game))
-        GameGenresORM=GamesGenresDB.objects.filter(genre=the_genre).first() # pylint: disable=no-member
-        if(not GameGenresORM):
+        result=GamesGenresDB._get_collection().update_one({"_id":the_genre.pk},{"$addToSet":{"gamesList":game.pk}}) # pylint: disable=protected-access
+        if(not result.matched_count):
             raise RuntimeError("Error: Data Element not found for the GenreDB: %s in GamesGenresDB collection.",the_genre.external_id)
-        if(not (game in GameGenresORM.gamesList)):
-            GameGenresORM.gamesList.append(game)
-        GameGenresORM.save()
     
     @staticmethod
     def s_remove_game(the_genre, game):
@@ -591,14 +692,25 @@ class GamesGenresDB(db.Document):
         if(not isinstance(the_genre,GenreDB)):
             raise TypeError("Error: the argument provided is not a valid GenreDB object. Object provided: "+type(the_genre))
 
-        if(not isinstance(game,GenreDB)):
+        if(not isinstance(game,GameDB)):
             raise TypeError("Error: the argument provided is not a valid GameDB object. Object provided: "+type(game))
-        GameGenresORM=GamesGenresDB.objects.filter(genre=the_genre).first() # pylint: disable=no-member
-        if(not GameGenresORM):
+        result=GamesGenresDB._get_collection().update_one({"_id":the_genre.pk},{"$pull":{"gamesList":game.pk}}) # pylint: disable=protected-access
+        if(not result.matched_count):
             raise RuntimeError("Error: Data Element not found for the GenreDB: %s in GamesGenresDB collection.",the_genre.external_id)
-        if(game in GameGenresORM.gamesList):
-            GameGenresORM.gamesList.remove(game)
-        GameGenresORM.save()
+
+    @staticmethod
+    def s_games_sets(genres):
+        """ Returns the posting lists of the genres: the ids of their games, read in one query without dereferencing the games
+
+            Arguments:
+                genres {list} -- The GenreDB objects
+
+            Returns:
+                dict -- {genre id: GamesGenresAO} whose games are the ids (ObjectId) of the games assigned to the genre
+        """
+        the_ids=[genre.pk for genre in genres]
+        found={doc["_id"]:doc.get("gamesList",[]) for doc in GamesGenresDB._get_collection().find({"_id":{"$in":the_ids}},{"gamesList":1})} if the_ids else {} # pylint: disable=protected-access
+        return {genre.pk:GamesGenresAO(found.get(genre.pk,[]),genre=genre) for genre in genres}
 
 """Class GamesGenresAO - Application Object of aggregation of games that are assigned to the specific genre
     Attributes:
@@ -630,6 +742,37 @@ class GamesGenresAO(abc.MutableSet):
         to_return.games=(game.to_obj() for game in dbobj.gamesList)
         return to_return
 
+    @staticmethod
+    def s_query(all_of=(), any_of=(), none_of=()):
+        """ Genre query over the posting lists (GamesGenresDB), with the set operators of the class:
+            the games assigned to all the genres in all_of, and to at least one in any_of, and to none in none_of.
+            The cost depends on the size of the posting lists of the genres, not on the number of games.
+            none_of only restricts the games selected by all_of/any_of: alone, the result is empty.
+
+            Keyword Arguments:
+                all_of {list} -- GenreDB objects (AND) (default: {()})
+                any_of {list} -- GenreDB objects (OR) (default: {()})
+                none_of {list} -- GenreDB objects (NOT) (default: {()})
+
+            Returns:
+                GamesGenresAO -- composite object whose games are the ids (ObjectId) of the games
+        """
+        sets=GamesGenresDB.s_games_sets(list(all_of)+list(any_of)+list(none_of))
+        retorno=None
+        #smallest first: the intersection is never larger than it
+        for the_set in sorted((sets[genre.pk] for genre in all_of),key=len):
+            retorno=the_set if retorno is None else retorno & the_set
+            if not retorno:
+                return retorno
+        if any_of:
+            union=reduce(operator.or_,(sets[genre.pk] for genre in any_of))
+            retorno=union if retorno is None else retorno & union
+        if retorno is None:
+            return GamesGenresAO()
+        for genre in none_of:
+            retorno=retorno - sets[genre.pk]
+        return retorno
+
     @staticmethod
     def seek_genre(gao):
         if not isinstance(gao,GenreAO):
@@ -653,32 +796,32 @@ class GamesGenresAO(abc.MutableSet):
         if not isinstance(other,self.__class__):
             raise TypeError("Operand Type differs. They must be the same")
         retorno=self.__class__(self.games | other.games, genre=self.genre)
-        retorno.composition=["or",(self.composition if self.is_composite else self.genre,
-                            other.composition if other.is_composite else other.genre)]
+        retorno.composition=["or",(self.composition if self.is_composite() else self.genre,
+                            other.composition if other.is_composite() else other.genre)]
         return retorno
 
     def __and__(self, other):
         if not isinstance(other,self.__class__):
             raise TypeError("Operand Type differs. They must be the same")
         retorno = self.__class__(self.games & other.games, genre=self.genre)
-        retorno.composition=["and",(self.composition if self.is_composite else self.genre,
-                            other.composition if other.is_composite else other.genre)]
+        retorno.composition=["and",(self.composition if self.is_composite() else self.genre,
+                            other.composition if other.is_composite() else other.genre)]
         return retorno
 
     def __xor__(self, other):
         if not isinstance(other,self.__class__):
             raise TypeError("Operand Type differs. They must be the same")
         retorno = self.__class__(self.games ^ other.games, genre=self.genre)
-        retorno.composition=["xor",(self.composition if self.is_composite else self.genre,
-                            other.composition if other.is_composite else other.genre)]
+        retorno.composition=["xor",(self.composition if self.is_composite() else self.genre,
+                            other.composition if other.is_composite() else other.genre)]
         return retorno
 
     def __sub__(self,other):
         if not isinstance(other,self.__class__):
             raise TypeError("Operand Type differs. They must be the same")
         retorno = self.__class__(self.games - other.games, genre=self.genre)
-        retorno.composition=["difference",(self.composition if self.is_composite else self.genre,
-                            other.composition if other.is_composite else other.genre)]
+        retorno.composition=["difference",(self.composition if self.is_composite() else self.genre,
+                            other.composition if other.is_composite() else other.genre)]
         return retorno
 
     def add(self, game):
@@ -699,7 +842,7 @@ class GamesGenresAO(abc.MutableSet):
     def __repr__(self):
         base = f"{self.genre}: {self.games}"
         if self.composition:
-            base += self.composition
+            base += f" {self.composition}"
         return base
 
     def save(self):
@@ -725,3 +868,31 @@ class GamesGenresAO(abc.MutableSet):
 
     for method in ['clear', 'copy', 'difference', 'difference_update', 'discard', 'intersection', 'intersection_update', 'isdisjoint', 'issubset', 'issuperset', 'pop', 'remove', 'symmetric_difference', 'symmetric_difference_update', 'union', 'update']:
         locals()[method] = (lambda method:lambda self, other=(): getattr(self.games, method)(*((other,) if other else ()) ) ) (method)
+
+
+@background_task()
+def create_quantification(game_id):
+    """ Task: creates the quantification of a new game (GameDB.post_save) """
+    the_game=GameDB.objects.filter(external_id=game_id).first() # pylint: disable=no-member
+    if not the_game:
+        raise RuntimeError("ERROR: Game not found: "+str(game_id))
+    GameGenreQuantificationDB.s_create_quantification(the_game)
+
+
+@background_task()
+def count_genres(game_id, added, removed):
+    """ Task: counts the genres a user assigned to/removed from a game (UserGameGenreDB.postSave)
+
+        Arguments:
+            game_id {str} -- The game external_id
+            added {list} -- The external_ids of the genres assigned (repeated if assigned more than once)
+            removed {list} -- The external_ids of the genres removed
+    """
+    the_game=GameDB.objects.filter(external_id=game_id).first() # pylint: disable=no-member
+    if not the_game:
+        raise RuntimeError("ERROR: Game not found: "+str(game_id))
+    genres=GenreDB.get_genres_by_ids(list(added)+list(removed))
+    # the quantification of a game just created may still be in the queue
+    GameGenreQuantificationDB.s_create_quantification(the_game)
+    GameGenreQuantificationDB.s_count_genres(the_game,
+        [genres[eid] for eid in added if eid in genres],[genres[eid] for eid in removed if eid in genres])
@@ -0,0 +1,91 @@
+import unittest
+import os
+import json
+import tempfile
+from mongoengine.connection import _get_db
+from application import ScsrAPP
+from settings import MONGODB_HOST
+
+class GameImportTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print("*"*130)
+        print(" "*40+"Testing Game Import")
+        print("*"*130)
+        cls.db_name = 'scsr-api-test-game-import'
+
+        cls.app_factory = ScsrAPP(
+            MONGODB_SETTINGS = {'DB': cls.db_name,
+                'HOST': MONGODB_HOST},
+            TESTING = True,
+            WTF_CSRF_ENABLED = False,
+            SECRET_KEY = 'mySecret!').APP
+        cls.app = cls.app_factory.test_client()
+        from install_system import start_countries, start_language, start_games
+        start_countries()
+        start_language()
+        start_games()
+        cls.folder = tempfile.mkdtemp()
+
+    @classmethod
+    def tearDownClass(cls):
+        db = _get_db()
+        db.client.drop_database(db)
+
+    def write(self, name, lines):
+        path=os.path.join(self.folder,name)
+        with open(path,"w",encoding="utf-8") as the_file:
+            the_file.write("\n".join(lines)+"\n")
+        return path
+
+    def test_01_jsonl(self):
+        """ The games are upserted on name+studio+year, with their quantification and typeahead entries. Invalid rows are rejected """
+        from install_system.game_import import import_games
+        from game.models.game import GameDB
+        from game.models.user_game_genre import GameGenreQuantificationDB
+        before=GameDB.objects.count() # pylint: disable=no-member
+        #the indexes are built before the import: the games imported are added to them
+        GameDB.seek_partial_name("en","invaders")
+        path=self.write("catalog.jsonl",[
+            json.dumps({"name":{"en":"Space Invaders","pt":"Invasores do Espaço"},"studio":"Taito","publisher":"Taito Corporation","year":1978}),
+            json.dumps({"name":{"en":"Double Dragon","pt":"Double Dragon"},"studio":"Technos","publisher":"Taito","year":"1987-06-01"}),
+            json.dumps({"name":"Galaga","studio":"Namco","year":1981}),
+            json.dumps({"name":{"pt":"Sem Nome em Inglês"},"year":1990}),
+            json.dumps({"name":"Numbered Studio","studio":505,"year":1999}),
+            json.dumps({"name":"Listed Studio","studio":["Namco"],"year":1999}),
+            "not json"])
+        stats=import_games(path,batch_size=2,report=None)
+        assert (stats["rows"],stats["inserted"],stats["updated"],stats["rejected"])==(7,3,1,3)
+        assert GameDB.objects.count()==before+3 # pylint: disable=no-member
+        assert GameDB.objects.filter(name__en="Numbered Studio").first().studio=="505" # pylint: disable=no-member
+        invaders=GameDB.objects.filter(studio="Taito",name__en="Space Invaders").first() # pylint: disable=no-member
+        assert invaders.name["pt"]=="Invasores do Espaço"
+        assert invaders.publisher=="Taito Corporation"
+        for game in GameDB.objects.filter(name__en__in=["Double Dragon","Galaga"]): # pylint: disable=no-member
+            assert game.external_id
+            assert GameGenreQuantificationDB.objects.filter(game=game).first() # pylint: disable=no-member
+        assert not os.path.exists(path+".checkpoint")
+        assert invaders in GameDB.seek_partial_name("en","invaders")
+        assert invaders in GameDB.seek_partial_name("pt","invasores")
+        assert [game.name["en"] for game in GameDB.seek_partial_studio("technos")]==["Double Dragon"]
+        assert invaders in GameDB.seek_partial_publisher("taito corp")
+        stats=import_games(path,report=None)
+        assert (stats["inserted"],stats["updated"])==(0,4)
+        assert GameDB.objects.count()==before+3 # pylint: disable=no-member
+
+    def test_02_csv_resume(self):
+        """ An import resumes after its checkpoint """
+        from install_system.game_import import import_games
+        from game.models.game import GameDB
+        lines=["name_en,name_pt,studio,publisher,year"]+[f"Csv Game {i},Jogo Csv {i},Studio,Publisher,2001" for i in range(6)]
+        path=self.write("catalog.csv",lines)
+        with open(path+".checkpoint","w") as the_file:
+            json.dump({"offset":len("\n".join(lines[:4]).encode("utf-8"))+1,"rows":3,"inserted":3,"updated":0,"rejected":0},the_file)
+        stats=import_games(path,batch_size=2,report=None)
+        assert (stats["rows"],stats["inserted"])==(6,6)
+        imported=set(game.name["en"] for game in GameDB.objects.filter(studio="Studio")) # pylint: disable=no-member
+        assert imported=={"Csv Game 3","Csv Game 4","Csv Game 5"}
+        assert set(game.name["en"] for game in GameDB.seek_partial_name("en","csv game"))=={"Csv Game 3","Csv Game 4","Csv Game 5"}
+        stats=import_games(path,restart=True,report=None)
+        assert (stats["rows"],stats["inserted"],stats["updated"])==(6,3,3)
@@ -215,6 +215,17 @@ lang_codes={
     "zu":{"en":["Zulu"]}
 }
 
+#The genres, as provided by Crawford
+genres=[
+    {"pt":"ação", "en":"action"},
+    {"pt":"aventura", "en":"adventure"},
+    {"pt":"simulação", "en":"simulation"},
+    {"pt":"estratégia", "en":"strategy"},
+    {"pt":"rpg", "en":"rpg"},
+    {"pt":"enigma", "en":"puzzle"},
+    {"pt":"casual", "en":"casual"}
+]
+
 countries_codes={
     "AF":{"en":"Afghanistan"},	
     "AX":{"en":"Åland Islands"},	
@@ -521,34 +532,11 @@ def start_user(options={}):
     theAdmin.save()
 
 def start_genre():
-    acao=GenreAO()
-    acao.set_genre("pt","ação")
-    acao.set_genre("en","action")
-    acao.save()
-    aventura=GenreAO()
-    aventura.set_genre("pt","aventura")
-    aventura.set_genre("en","adventure")
-    aventura.save()
-    simulacao=GenreAO()
-    simulacao.set_genre("pt","simulação")
-    simulacao.set_genre("en","simulation")
-    simulacao.save()
-    estrategia=GenreAO()
-    estrategia.set_genre("pt","estratégia")
-    estrategia.set_genre("en","strategy")
-    estrategia.save()
-    rpg=GenreAO()
-    rpg.set_genre("pt","rpg")
-    rpg.set_genre("en","rpg")
-    rpg.save()
-    puzzle=GenreAO()
-    puzzle.set_genre("pt","enigma")
-    puzzle.set_genre("en","puzzle")
-    puzzle.save()
-    casual=GenreAO()
-    casual.set_genre("pt","casual")
-    casual.set_genre("en","casual")
-    casual.save()
+    for names in genres:
+        the_genre=GenreAO()
+        for lang in ("pt","en"):
+            the_genre.set_genre(lang,names[lang])
+        the_genre.save()
 
 def start_games():
     si=GameAO()
@@ -593,13 +581,9 @@ def start_elements_machinations():
     from install_system.machinations import start_machinations
     start_machinations()
 
-#effectively performs the data configuration
-def start_system(options={}):
-    start_language()
-    start_countries()
-    start_admin_groups()
+def ask_admin():
+    """ Asks the data of the first admin (start_user options) """
     options=dict()
-
     print("Inform the admin data: ")
     options["username"]=input("Username:")
     options["password"]=input("password:")
@@ -612,6 +596,14 @@ def start_system(options={}):
         options["birthdate"]=datetime.strptime(input("Birthdate (dd/mm/yyyy):"),"%d/%m/%Y")
     except:
         print("Error converting String to Date. (did you remembered to type the slashes?.. a generic date will be used.")
+    return options
+
+#effectively performs the data configuration
+def start_system(options={}):
+    start_language()
+    start_countries()
+    start_admin_groups()
+    options=ask_admin()
 
     start_user(options)
     start_genre()
@@ -622,3 +614,65 @@ def start_system(options={}):
     start_elements_derived()
     start_elements_machinations()
     #There we go! The system is ready for SCSR's
+
+def start_system_bulk(options=None, report=print):
+    """ Performs the data configuration of start_system in bulk (see install_system.bulk): each collection is written
+        with insert_many, the languages, countries, admin groups, genres and elements already persisted are skipped.
+        The admin and the games are few: they are saved as in start_system, if there is no admin (game) yet.
+        The time of each stage is reported.
+
+        Keyword Arguments:
+            options {dict} -- The first admin data (start_user options) (default: {None}: asked)
+            report {callable} -- Receives the line reporting each stage (default: {print})
+
+        Returns:
+            BulkSeeder -- The seeder, with the timings of the stages
+    """
+    from install_system.bulk import BulkSeeder
+    from install_system.game_ontology import start_ontology
+    from install_system.patterns_game_design import start_pigd
+    from install_system.multiple_sources import start_multiple
+    from install_system.derived import start_derived
+    from install_system.machinations import start_machinations
+    from game.models.game import GameDB
+    from game.models.genre import GenreDB, genre_cache
+    from game.models.user_game_genre import GamesGenresDB
+    from sys_app.models.localization import language_cache
+    from utils import typeahead
+    if options is None:
+        options=ask_admin()
+    seeder=BulkSeeder(report)
+    with seeder.stage("languages"):
+        persisted=set(lang_codeDB._get_collection().distinct("_id")) # pylint: disable=protected-access
+        seeder.insert(lang_codeDB,[lang_codeDB(code=key,lang=lang_codes[key],in_system=key in ['pt','en']) for key in lang_codes if key not in persisted])
+        language_cache.clear()
+    with seeder.stage("countries"):
+        persisted=set(country_codeDB._get_collection().distinct("_id")) # pylint: disable=protected-access
+        seeder.insert(country_codeDB,[country_codeDB(code=key,country=countries_codes[key]) for key in countries_codes if key not in persisted])
+    with seeder.stage("admin groups"):
+        persisted=set(AdminGroupDB._get_collection().distinct("group.en")) # pylint: disable=protected-access
+        seeder.insert(AdminGroupDB,[AdminGroupDB(external_id=str(uuid4()),group=group) for group in [{'en':'GOD','pt':'DEUS'},{"en":"common", "pt":"comum"}] if group["en"] not in persisted])
+    with seeder.stage("admin"):
+        if not AdminDB.objects.first(): # pylint: disable=no-member
+            start_user(options)
+    with seeder.stage("genres"):
+        persisted=set(GenreDB._get_collection().distinct("genre.en")) # pylint: disable=protected-access
+        raw=seeder.insert(GenreDB,[GenreDB(external_id=str(uuid4()),genre=dict(names)) for names in genres if names["en"] not in persisted])
+        seeder.insert(GamesGenresDB,[GamesGenresDB(genre=doc["_id"],gamesList=[]) for doc in raw])
+        genre_cache.clear()
+    with seeder.stage("games"):
+        if not GameDB.objects.first(): # pylint: disable=no-member
+            start_games()
+    with seeder.stage("elements"):
+        with seeder.collecting():
+            start_ontology()
+            start_pigd()
+            start_multiple()
+            start_derived()
+            start_machinations()
+        written=seeder.write_elements()
+    if report:
+        report(f"{written} elements written, {len(seeder.elements)-written} already persisted, {seeder.duplicated} duplicated")
+    with seeder.stage("typeahead"):
+        typeahead.rebuild_all()
+    return seeder
@@ -0,0 +1,125 @@
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from uuid import uuid4
+
+from scsr.models.elements import ElementAO, ElementDB, ElementReferenceAO, ElementReferenceDB
+
+"""Bulk seeding of the installation data (install_system.start_system_bulk).
+
+    The regular installation saves the documents one at a time: every save is a round trip and fires the signals of
+    the document (external_id, the default element reference task, the cache invalidations, the typeahead indexes).
+    The bulk seeder builds the documents in memory, drops the duplicated and the already persisted ones and writes
+    each collection with insert_many, BATCH_SIZE documents at a time. The signals are not fired: the seeder sets the
+    external_ids, writes the element references in one batch and the caller drops the caches and rebuilds the
+    typeahead indexes once, at the end.
+"""
+
+BATCH_SIZE = 1000
+
+# the seeder collecting the elements of create_element (BulkSeeder.collecting), None: the elements are saved one by one
+_collector = None
+
+
+def create_element(enName, ptName, ref):
+    """ Creates an element named in en and pt, with its reference.
+        Within BulkSeeder.collecting() the element is only collected: the seeder writes it with the others.
+
+        Arguments:
+            enName {str} -- The name in english
+            ptName {str} -- The name in portuguese
+            ref {dict} -- The reference (see ElementReferenceDB)
+    """
+    if _collector is not None:
+        _collector.add_element({"en":enName,"pt":ptName},ref)
+        return
+    el=ElementAO()
+    el.add_name('en',enName)
+    el.add_name('pt',ptName)
+    el.save()
+    er=ElementReferenceAO.get_reference(el)
+    er.set_reference(ref)
+    er.save()
+
+
+class BulkSeeder(object):
+    """ Collects the installation documents and writes them in bulk, timing each stage
+
+        Keyword Arguments:
+            report {callable} -- Receives the line reporting each stage (default: {print}, None: silent)
+            batch_size {int} -- The documents of each insert_many (default: {BATCH_SIZE})
+    """
+
+    def __init__(self, report=print, batch_size=None):
+        self.report=report
+        self.batch_size=batch_size or BATCH_SIZE
+        self.elements=OrderedDict()
+        self.duplicated=0
+        self.timings=OrderedDict()
+
+    @contextmanager
+    def stage(self, name):
+        """ Times (and reports) the block as the stage """
+        start=time.perf_counter()
+        yield
+        self.timings[name]=time.perf_counter()-start
+        if self.report:
+            self.report(f"{name}: {self.timings[name]:.2f}s")
+
+    @contextmanager
+    def collecting(self):
+        """ Within the block, create_element collects the elements in the seeder instead of saving them """
+        global _collector # pylint: disable=global-statement
+        former,_collector=_collector,self
+        try:
+            yield self
+        finally:
+            _collector=former
+
+    def add_element(self, names, reference):
+        """ Collects an element. An element with the same names collected before is kept (with its reference)
+
+            Arguments:
+                names {dict} -- The names of the element ({lang: name})
+                reference {dict} -- The reference (validated as in ElementReferenceAO.set_reference)
+        """
+        the_reference=ElementReferenceAO()
+        the_reference.set_reference(reference)
+        key=tuple(sorted(names.items()))
+        if key in self.elements:
+            self.duplicated+=1
+            return
+        self.elements[key]=(dict(names),the_reference.reference)
+
+    def insert(self, model, documents):
+        """ Validates the documents and writes them to the collection of the model with insert_many, without signals
+
+            Arguments:
+                model {Document class} -- The model of the documents
+                documents {list} -- The documents (instances of the model)
+
+            Returns:
+                list -- The raw documents written, with their _id
+        """
+        raw=[]
+        for document in documents:
+            document.validate()
+            raw.append(document.to_mongo().to_dict())
+        collection=model._get_collection() # pylint: disable=protected-access
+        for start in range(0,len(raw),self.batch_size):
+            collection.insert_many(raw[start:start+self.batch_size])
+        return raw
+
+    def write_elements(self):
+        """ Writes the elements collected, but the ones whose names are already persisted, and their references
+
+            Returns:
+                int -- The number of elements written
+        """
+        persisted=set(tuple(sorted(doc.get("element",{}).items())) for doc in ElementDB._get_collection().find({},{"element":1})) # pylint: disable=protected-access
+        now=datetime.utcnow()
+        the_elements=[(names,reference) for key,(names,reference) in self.elements.items() if key not in persisted]
+        raw=self.insert(ElementDB,[ElementDB(external_id=str(uuid4()),element=names,created=now,updated=now) for names,reference in the_elements])
+        self.insert(ElementReferenceDB,[ElementReferenceDB(element=doc["_id"],reference=reference) for doc,(names,reference) in zip(raw,the_elements)])
+        return len(raw)
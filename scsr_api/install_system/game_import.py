@@ -0,0 +1,255 @@
+import csv
+import json
+import os
+import time
+from datetime import datetime
+from uuid import uuid4
+
+from pymongo import UpdateOne
+
+from game.models.game import GameDB, game_name_typeahead, game_studio_typeahead, game_publisher_typeahead
+from game.models.user_game_genre import GameGenreQuantificationDB
+
+"""Streaming import of game catalogs (JSONL or CSV).
+
+    The file is read a row at a time and written BATCH_SIZE rows at a time: the memory does not depend on its size.
+    Each game is upserted on its natural key (the name in the key language, the studio and the year of release) with
+    bulk_write, so importing a catalog again updates the games instead of duplicating them. The quantification
+    (GameGenreQuantificationDB) of the games inserted is created in the same batch and the games written are added to
+    the typeahead indexes of the games (name, studio, publisher): the GameDB signals are not fired.
+    After each batch the offset in the file is checkpointed (path.checkpoint): an interrupted import resumes after the
+    last batch written. The checkpoint is dropped when the import ends.
+
+    The rows:
+        JSONL -- {"name": {lang: name} (or the name in the key language), "studio": str, "publisher": str, "year": ...}
+        CSV -- A header with the columns name (the name in the key language) or name_<lang>, studio, publisher and year
+    The year is a year (1978) or a date (1978-06-01). Rows without the name in the key language or with an invalid
+    year are rejected (counted, not imported).
+"""
+
+BATCH_SIZE = 1000
+KEY_LANG = "en"
+
+# the indexes of the games written, and the fields they read
+GAME_TYPEAHEADS = (game_name_typeahead, game_studio_typeahead, game_publisher_typeahead)
+TYPEAHEAD_FIELDS = {"external_id":1, "name":1, "studio":1, "publisher":1}
+
+
+class RowError(ValueError):
+    """ A row that cannot be imported """
+
+
+def parse_year(value):
+    """ Returns the datetime of a year (1978) or a date (1978-06-01) """
+    if isinstance(value,datetime):
+        return value
+    if isinstance(value,int) and not isinstance(value,bool):
+        return datetime(value,1,1)
+    text=str(value or "").strip()
+    for the_format in ("%Y","%Y-%m-%d","%d/%m/%Y"):
+        try:
+            return datetime.strptime(text,the_format)
+        except ValueError:
+            pass
+    raise RowError("Invalid year: "+repr(value))
+
+
+def parse_text(value, column):
+    """ Returns the stripped text of a value (numbers are written as text), or None if empty """
+    if value is None or isinstance(value,bool):
+        return None
+    if not isinstance(value,(str,int,float)):
+        raise RowError("Invalid "+column+": "+repr(value))
+    return str(value).strip() or None
+
+
+def to_game(row, key_lang=KEY_LANG):
+    """ Returns the game fields of a row ({"name", "studio", "publisher", "year"})
+
+        Raises:
+            RowError -- If the row has no name in the key language, an invalid studio/publisher or an invalid year
+    """
+    if not isinstance(row,dict):
+        raise RowError("Not an object: "+repr(row))
+    name=row.get("name")
+    names=dict(name) if isinstance(name,dict) else ({key_lang:name} if name else {})
+    for column,value in row.items():
+        if column.startswith("name_") and value:
+            names[column[len("name_"):]]=value
+    names={lang:str(value).strip() for lang,value in names.items() if value and str(value).strip()}
+    if key_lang not in names:
+        raise RowError("No name in "+key_lang+": "+repr(row))
+    return {
+        "name":names,
+        "studio":parse_text(row.get("studio"),"studio"),
+        "publisher":parse_text(row.get("publisher"),"publisher"),
+        "year":parse_year(row.get("year"))
+    }
+
+
+def natural_key(game, key_lang=KEY_LANG):
+    """ Returns the raw filter of the game natural key: the name in the key language, the studio and the year """
+    year=game["year"].year
+    return {"name."+key_lang:game["name"][key_lang], "studio":game["studio"],
+        "year":{"$gte":datetime(year,1,1),"$lt":datetime(year+1,1,1)}}
+
+
+def upsert(game, key_lang=KEY_LANG, now=None):
+    """ Returns the UpdateOne upserting the game on its natural key. The names and the publisher are updated """
+    now=now or datetime.utcnow()
+    the_set={"name."+lang:name for lang,name in game["name"].items()}
+    the_set["publisher"]=game["publisher"]
+    return UpdateOne(natural_key(game,key_lang),{
+        "$set":the_set,
+        "$setOnInsert":{"external_id":str(uuid4()), "studio":game["studio"], "year":game["year"],
+            "proposed":now, "accepted":now, "active":True, "updated":now}
+    },upsert=True)
+
+
+def read_lines(the_file, offset=0):
+    """ Yields (line, offset after the line) of a binary file, from the offset """
+    the_file.seek(offset)
+    while True:
+        line=the_file.readline()
+        if not line:
+            return
+        yield line.decode("utf-8-sig" if offset==0 else "utf-8"),the_file.tell()
+        offset=the_file.tell()
+
+
+def read_jsonl(the_file, offset=0):
+    """ Yields (row or RowError, offset after the row) of a JSONL file """
+    for line,position in read_lines(the_file,offset):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line),position
+        except ValueError as error:
+            yield RowError(str(error)),position
+
+
+def read_csv(the_file, offset=0):
+    """ Yields (row, offset after the row) of a CSV file. The header is read from the start of the file """
+    the_file.seek(0)
+    header_line=the_file.readline().decode("utf-8-sig")
+    header=next(csv.reader([header_line]))
+    offset=max(offset,the_file.tell())
+    position=[offset]
+    def lines():
+        for line,after in read_lines(the_file,offset):
+            position[0]=after
+            yield line
+    for values in csv.reader(lines()):
+        if not any(value.strip() for value in values):
+            continue
+        yield dict(zip(header,values)),position[0]
+
+
+class Checkpoint(object):
+    """ The progress of the import of a file, kept in path.checkpoint """
+
+    def __init__(self, path):
+        self.path=path+".checkpoint"
+        self.state={"offset":0, "rows":0, "inserted":0, "updated":0, "rejected":0}
+
+    def load(self, size):
+        """ Loads the saved progress. A checkpoint past the end of the file (replaced meanwhile) is ignored
+
+            Returns:
+                bool -- True if the import resumes
+        """
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path) as the_file:
+            state=json.load(the_file)
+        if state.get("offset",0)>size:
+            return False
+        self.state.update(state)
+        return True
+
+    def save(self):
+        temporary=self.path+".tmp"
+        with open(temporary,"w") as the_file:
+            json.dump(self.state,the_file)
+        os.replace(temporary,self.path)
+
+    def drop(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def import_games(path, file_format=None, batch_size=None, key_lang=KEY_LANG, restart=False, report=print):
+    """ Imports (upserts) the games of a JSONL or CSV catalog, resuming an interrupted import of the same file
+
+        Arguments:
+            path {str} -- The catalog file
+
+        Keyword Arguments:
+            file_format {str} -- "jsonl" or "csv" (default: {None}: from the extension)
+            batch_size {int} -- The rows written at once (default: {BATCH_SIZE})
+            key_lang {str} -- The language of the name in the natural key (default: {KEY_LANG})
+            restart {bool} -- Ignores the checkpoint of a former import (default: {False})
+            report {callable} -- Receives the line reporting the progress of each batch (default: {print}, None: silent)
+
+        Returns:
+            dict -- The rows read, inserted, updated and rejected (the whole import, if resumed), and the rows/s of this run
+    """
+    file_format=(file_format or os.path.splitext(path)[1].lstrip(".")).lower()
+    if file_format not in ("jsonl","csv"):
+        raise ValueError("ERROR: Unknown catalog format: "+str(file_format))
+    batch_size=batch_size or BATCH_SIZE
+    checkpoint=Checkpoint(path)
+    resumed=False if restart else checkpoint.load(os.path.getsize(path))
+    state=checkpoint.state
+    if resumed and report:
+        report(f"resuming after {state['rows']} rows")
+    games=GameDB._get_collection() # pylint: disable=protected-access
+    quantifications=GameGenreQuantificationDB._get_collection() # pylint: disable=protected-access
+    start=time.perf_counter()
+    read=0
+    batch=[]
+
+    def flush(offset):
+        nonlocal resumed
+        if batch:
+            result=games.bulk_write([upsert(game,key_lang) for game in batch],ordered=True)
+            written=[GameDB._from_son(doc) for doc in games.find({"$or":[natural_key(game,key_lang) for game in batch]},TYPEAHEAD_FIELDS)] # pylint: disable=protected-access
+            for index in GAME_TYPEAHEADS:
+                index.on_bulk_save(written)
+            the_ids=list(result.upserted_ids.values())
+            if resumed:
+                #the batch interrupted may have been written without its quantifications
+                the_ids=[game.pk for game in written]
+            if the_ids:
+                quantifications.bulk_write([UpdateOne({"_id":the_id},{"$setOnInsert":{"genreCount":{}}},upsert=True) for the_id in the_ids],ordered=False)
+            state["inserted"]+=result.upserted_count
+            state["updated"]+=result.matched_count
+            batch.clear()
+        resumed=False
+        state["offset"]=offset
+        checkpoint.save()
+        if report:
+            elapsed=time.perf_counter()-start
+            report(f"{state['rows']} rows ({state['inserted']} inserted, {state['updated']} updated, {state['rejected']} rejected) - {read/elapsed if elapsed else 0:.0f} rows/s")
+
+    reader=read_jsonl if file_format=="jsonl" else read_csv
+    offset=state["offset"]
+    with open(path,"rb") as the_file:
+        for row,offset in reader(the_file,state["offset"]):
+            read+=1
+            state["rows"]+=1
+            try:
+                if isinstance(row,RowError):
+                    raise row
+                batch.append(to_game(row,key_lang))
+            except RowError:
+                state["rejected"]+=1
+            if read%batch_size==0:
+                flush(offset)
+    flush(offset)
+    checkpoint.drop()
+    elapsed=time.perf_counter()-start
+    retorno=dict(state)
+    retorno.pop("offset")
+    retorno["rows_per_second"]=read/elapsed if elapsed else 0.0
+    return retorno
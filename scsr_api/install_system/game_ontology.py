@@ -1,13 +1,4 @@
-from scsr.models.elements import ElementAO, ElementReferenceAO
-
-def create_element(enName,ptName,ref):
-    el=ElementAO()
-    el.add_name('en',enName)
-    el.add_name('pt',ptName)
-    el.save()# TODO: Create the ElementReference representation and code the reference adding here.
-    er=ElementReferenceAO.get_reference(el)
-    er.set_reference(ref)
-    er.save()
+from install_system.bulk import create_element
 
 def start_ontology():
     
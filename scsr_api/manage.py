@@ -15,5 +15,93 @@ manager.add_command("runserver", Server(
     port = int(os.getenv('PORT', 5000))
 ))
 
+@manager.option("-e", "--elements", dest="elements", type=int, default=5, help="Elements assigned to each behavior")
+def benchmark_save(elements):
+    """ Counts the round trips to the database spent saving a scsr (function by function vs bulk) """
+    #the round trip counter is only registered for the benchmark: the connection is created again with it
+    from utils.round_trips import reconnect
+    reconnect()
+    from scsr.benchmarks import benchmark_save as the_benchmark
+    for label,result in the_benchmark(elements).items():
+        print(f"{label}: {result['round_trips']} round trips in {result['seconds']:.4f}s - {result['commands']}")
+
+@manager.option("-c", "--create", dest="create", action="store_true", default=False, help="Create the declared indexes before the audit")
+def audit_indexes(create):
+    """ Runs explain() on the queries of the seek_* methods and flags the ones resolved by a collection scan """
+    from utils.indexes import index_registry
+    if create:
+        for model,names in index_registry.ensure_indexes().items():
+            print(f"{model}: {', '.join(names) if names else 'meta indexes only'}")
+    scans=0
+    for result in index_registry.audit_indexes():
+        flag="COLLSCAN" if result["collscan"] else "ok"
+        scans+=1 if result["collscan"] else 0
+        print(f"[{flag}] {result['model']}.{result['probe']} {result['filter']} -> {' > '.join(result['stages'])}")
+    for model,diff in index_registry.compare_indexes().items():
+        if diff["missing"]:
+            print(f"{model}: declared but not created {diff['missing']}")
+        if diff["extra"]:
+            print(f"{model}: not declared (stale) {diff['extra']}")
+    print(f"{scans} queries without index")
+
+@manager.option("-b", "--batch-size", dest="batch_size", type=int, default=None, help="Documents per batch")
+def compact_history(batch_size):
+    """ Drops the empty diffs of the scsr histories and behavior diffdata, and rewrites the behavior snapshots """
+    import time
+    from scsr.models.scsr import ScsrDB
+    from scsr.models.behaviors import BehaviorDB
+    start=time.perf_counter()
+    stats=ScsrDB.compact_history({},batch_size)
+    print(f"scsrs: {stats['scsrs']} compacted, {stats['dropped']} empty diffs dropped, {stats['skipped']} changed meanwhile (skipped)")
+    stats=BehaviorDB.compact_history({},batch_size)
+    print(f"behaviors: {stats['behaviors']} compacted, {stats['dropped']} empty diffs dropped, {stats['snapshots']} snapshots, {stats['skipped']} changed meanwhile (skipped)")
+    print(f"{time.perf_counter()-start:.2f}s")
+
+@manager.command
+def install_bulk():
+    """ Installs the system data (install_system.start_system) in bulk, reporting the time of each stage """
+    from install_system import start_system_bulk
+    seeder=start_system_bulk()
+    print(f"total: {sum(seeder.timings.values()):.2f}s")
+
+@manager.option("path", help="The catalog (.jsonl or .csv)")
+@manager.option("-f", "--format", dest="file_format", default=None, help="jsonl or csv (default: from the extension)")
+@manager.option("-b", "--batch-size", dest="batch_size", type=int, default=None, help="Rows per batch")
+@manager.option("-l", "--key-lang", dest="key_lang", default="en", help="The language of the name identifying the games")
+@manager.option("-r", "--restart", dest="restart", action="store_true", default=False, help="Ignore the checkpoint of an interrupted import")
+def import_games(path, file_format, batch_size, key_lang, restart):
+    """ Imports (upserts on name+studio+year) the games of a catalog, resuming an interrupted import """
+    from install_system.game_import import import_games as the_import
+    stats=the_import(path,file_format,batch_size,key_lang,restart)
+    print(f"{stats['rows']} rows: {stats['inserted']} inserted, {stats['updated']} updated, {stats['rejected']} rejected - {stats['rows_per_second']:.0f} rows/s")
+
+@manager.option("path", help="The file (.csv, .jsonl, .parquet or .arrow)")
+@manager.option("-g", "--genre", dest="genre", default=None, help="The genre (english name) of the games")
+@manager.option("-s", "--from", dest="year_from", type=int, default=None, help="The first year of release of the games")
+@manager.option("-u", "--to", dest="year_to", type=int, default=None, help="The last year of release of the games")
+@manager.option("-f", "--format", dest="file_format", default=None, help="csv, jsonl, parquet or arrow (default: from the extension)")
+def export_scsr(path, genre, year_from, year_to, file_format):
+    """ Exports the scsrs (one row per element of each behavior) for offline analysis """
+    import time
+    from game.models.genre import GenreDB
+    from scsr.export import export_query, export_scsrs
+    the_genre=None
+    if genre:
+        the_genre=GenreDB.objects.filter(genre__en=genre).first() # pylint: disable=no-member
+        if not the_genre:
+            print(f"Genre not found: {genre}")
+            return
+    start=time.perf_counter()
+    rows=export_scsrs(path,export_query(the_genre,year_from,year_to),file_format)
+    print(f"{rows} rows in {time.perf_counter()-start:.2f}s")
+
+@manager.command
+def rebuild_typeahead():
+    """ Rebuilds the autocomplete indexes from the collections (the ones persisted by the mongo backend) """
+    from utils import typeahead
+    typeahead.rebuild_all()
+    for name in typeahead.indexes:
+        print(f"{name}: rebuilt")
+
 if __name__ == "__main__":
     manager.run()
\ No newline at end of file
@@ -0,0 +1,59 @@
+from time import perf_counter
+
+from utils.round_trips import round_trips
+from game.models.game import GameDB
+from user.models.user import UserDB
+from scsr.models.elements import ElementDB
+from scsr.models.scsr import ScsrAO, ScsrDB, SCSR_LAYOUT
+
+
+def _fill(the_scsr, elements, per_behavior):
+    """ Assigns per_behavior elements to every behavior of the scsr, rotating the elements list """
+    position=0
+    for function_key,attribute,behaviors in SCSR_LAYOUT:
+        the_function=getattr(the_scsr,attribute)
+        for behavior in behaviors:
+            the_behavior=getattr(the_function,behavior)
+            for counter in range(per_behavior):
+                the_behavior.add(elements[(position+counter)%len(elements)])
+            position+=per_behavior
+
+
+def _legacy_save(the_scsr):
+    """ The function by function save: each behavior, then each function and the scsr itself """
+    for function_key,attribute,behaviors in SCSR_LAYOUT:
+        getattr(the_scsr,attribute).save()
+    ScsrDB.__persist__(the_scsr)
+
+
+def benchmark_save(per_behavior=5):
+    """ Measures the round trips (and time) spent saving a scsr, comparing the function by function save with the bulk save.
+        Uses the first game and user in the database, creating two scsrs for them.
+
+    Keyword Arguments:
+        per_behavior {int} -- How many elements are assigned to each behavior (default: {5})
+
+    Returns:
+        dict -- {"legacy": {...}, "bulk": {...}} with the round trips (total and per command) and the elapsed seconds
+    """
+    game=GameDB.objects.first() # pylint: disable=no-member
+    user=UserDB.objects.first() # pylint: disable=no-member
+    if not game or not user:
+        raise RuntimeError("ERROR: The benchmark requires at least one game and one user in the database.")
+    elements=[element.to_obj() for element in ElementDB.objects.limit(max(per_behavior*11,1))] # pylint: disable=no-member
+    if not elements:
+        raise RuntimeError("ERROR: The benchmark requires elements in the database.")
+    retorno={}
+    for label,the_save in (("legacy",_legacy_save),("bulk",ScsrAO.save)):
+        the_scsr=ScsrAO.create_scsr(game.to_obj(),user.to_obj())
+        _fill(the_scsr,elements,per_behavior)
+        with round_trips as counted:
+            start=perf_counter()
+            the_save(the_scsr)
+            elapsed=perf_counter()-start
+        retorno[label]={
+            "round_trips":counted.total,
+            "commands":dict(counted.commands),
+            "seconds":elapsed
+        }
+    return retorno
@@ -0,0 +1,208 @@
+import csv
+import json
+from datetime import datetime
+
+from game.models.game import GameDB
+from game.models.genre import GenreDB
+from game.models.user_game_genre import GamesGenresDB
+from scsr.models.elements import ElementDB, canonical_elements
+from scsr.models.scsr import ScsrDB, SCSR_LAYOUT
+from user.models.user import UserDB
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+"""Export of the scsrs in long format, for offline analysis: one row per element assigned to a behavior.
+
+    The scsrs are streamed from a projected cursor (no history, user, game or application objects): each batch resolves
+    its behaviors (ScsrDB.iter_behavior_elements) and the external_ids of its games, users and elements with one query
+    per collection, is written and dropped. The memory depends on the batch size, not on the number of scsrs.
+    The rows are written CHUNK_SIZE at a time: a chunk is a Parquet row group (an Arrow record batch).
+    The Parquet and Arrow files require pyarrow.
+"""
+
+COLUMNS = ("scsr_id", "game", "user", "function", "behavior", "element_id", "timestamp")
+CHUNK_SIZE = 10000
+
+
+def export_query(genre=None, year_from=None, year_to=None):
+    """ Returns the raw query of the scsrs of the games of a genre and/or released in a range of years
+
+        Keyword Arguments:
+            genre {GenreDB} -- The genre of the games (default: {None}: any)
+            year_from {int} -- The first year of release (default: {None}: any)
+            year_to {int} -- The last year of release, included (default: {None}: any)
+    """
+    the_games=None
+    if genre is not None:
+        if not isinstance(genre,GenreDB):
+            raise TypeError("ERROR: Invalid type for the genre data.")
+        the_games=set(GamesGenresDB.s_games_sets([genre])[genre.pk].games)
+    if year_from is not None or year_to is not None:
+        the_year={}
+        if year_from is not None:
+            the_year["$gte"]=datetime(int(year_from),1,1)
+        if year_to is not None:
+            the_year["$lt"]=datetime(int(year_to)+1,1,1)
+        in_years=set(doc["_id"] for doc in GameDB._get_collection().find({"year":the_year},{"_id":1})) # pylint: disable=protected-access
+        the_games=in_years if the_games is None else the_games&in_years
+    return {} if the_games is None else {"game":{"$in":list(the_games)}}
+
+
+def external_ids(model, the_ids):
+    """ Returns {id: external_id} of the documents of the model, read in one query """
+    if not the_ids:
+        return {}
+    return {doc["_id"]:doc.get("external_id") for doc in model._get_collection().find({"_id":{"$in":list(the_ids)}},{"external_id":1})} # pylint: disable=protected-access
+
+
+def iter_rows(query, batch_size=None, canonical=True):
+    """ Streams the rows (tuples in the order of COLUMNS) of the scsrs matching the query, scsr by scsr,
+        in the order of the functions and behaviors of SCSR_LAYOUT
+
+        Arguments:
+            query {dict} -- The (raw) query on the scsr collection (see export_query)
+
+        Keyword Arguments:
+            batch_size {int} -- The scsrs per batch (default: {CONSOLIDATION_BATCH_SIZE})
+            canonical {bool} -- The reassigned elements are exported as the element they resolve to (default: {True})
+    """
+    batch_size=batch_size or ScsrDB.CONSOLIDATION_BATCH_SIZE
+    the_fields={"external_id":1, "game":1, "user":1, "date_modified":1}
+    the_fields.update({function_key:1 for function_key,attribute,behaviors in SCSR_LAYOUT})
+    cursor=ScsrDB._get_collection().find(query,the_fields).batch_size(batch_size) # pylint: disable=protected-access
+    batch=[]
+    for scsr_doc in cursor:
+        batch.append(scsr_doc)
+        if len(batch)>=batch_size:
+            for row in _batch_rows(batch,canonical):
+                yield row
+            batch=[]
+    for row in _batch_rows(batch,canonical):
+        yield row
+
+
+_SLOT_ORDER = {(function_key,behavior):position for position,(function_key,behavior) in
+    enumerate((function_key,behavior) for function_key,attribute,behaviors in SCSR_LAYOUT for behavior in behaviors)}
+
+
+def _batch_rows(scsr_docs, canonical):
+    """ The rows of a batch of (projected) scsr documents: see iter_rows """
+    if not scsr_docs:
+        return
+    position={doc["_id"]:index for index,doc in enumerate(scsr_docs)}
+    slots=sorted(ScsrDB.__batch_behavior_elements__(scsr_docs),key=lambda slot:(position[slot[0]],_SLOT_ORDER[(slot[1],slot[2])]))
+    if canonical:
+        slots=[(scsr_id,function_key,behavior,behavior_id,list(dict.fromkeys(canonical_elements.canonical_id(oid) for oid in elements))) for scsr_id,function_key,behavior,behavior_id,elements in slots]
+    games=external_ids(GameDB,set(doc.get("game") for doc in scsr_docs)-{None})
+    users=external_ids(UserDB,set(doc.get("user") for doc in scsr_docs)-{None})
+    elements=external_ids(ElementDB,set(oid for slot in slots for oid in slot[4]))
+    scsrs={doc["_id"]:doc for doc in scsr_docs}
+    for scsr_id,function_key,behavior,behavior_id,the_elements in slots:
+        doc=scsrs[scsr_id]
+        for oid in the_elements:
+            if oid in elements:
+                yield (doc.get("external_id"), games.get(doc.get("game")), users.get(doc.get("user")),
+                    function_key, behavior, elements[oid], doc.get("date_modified"))
+
+
+class CsvWriter(object):
+    """ Writes the rows as CSV, with a header (the timestamps in ISO format) """
+
+    def __init__(self, path):
+        self.file=open(path,"w",newline="",encoding="utf-8")
+        self.writer=csv.writer(self.file)
+        self.writer.writerow(COLUMNS)
+
+    def write(self, rows):
+        self.writer.writerows(row[:-1]+(row[-1].isoformat() if row[-1] else None,) for row in rows)
+
+    def close(self):
+        self.file.close()
+
+
+class JsonlWriter(object):
+    """ Writes the rows as JSON lines (the timestamps in ISO format) """
+
+    def __init__(self, path):
+        self.file=open(path,"w",encoding="utf-8")
+
+    def write(self, rows):
+        self.file.write("".join(json.dumps(dict(zip(COLUMNS,row[:-1]+(row[-1].isoformat() if row[-1] else None,))))+"\n" for row in rows))
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetWriter(object):
+    """ Writes the rows as Parquet, a row group per chunk (pyarrow required) """
+
+    def __init__(self, path):
+        if pyarrow is None:
+            raise RuntimeError("ERROR: The parquet and arrow exports require pyarrow")
+        self.schema=pyarrow.schema([(column,pyarrow.string()) for column in COLUMNS[:-1]]+[(COLUMNS[-1],pyarrow.timestamp("ms"))])
+        self.writer=self.open(path)
+
+    def open(self, path):
+        return pyarrow.parquet.ParquetWriter(path,self.schema)
+
+    def write(self, rows):
+        if not rows:
+            return
+        columns=list(zip(*rows))
+        self.writer.write_table(pyarrow.Table.from_arrays([pyarrow.array(column,type=field.type) for column,field in zip(columns,self.schema)],schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+class ArrowWriter(ParquetWriter):
+    """ Writes the rows as an Arrow (IPC) file, a record batch per chunk (pyarrow required) """
+
+    def open(self, path):
+        return pyarrow.ipc.new_file(path,self.schema)
+
+
+WRITERS = {"csv":CsvWriter, "jsonl":JsonlWriter, "parquet":ParquetWriter, "arrow":ArrowWriter}
+
+
+def export_scsrs(path, query=None, file_format=None, chunk_size=None, batch_size=None, canonical=True):
+    """ Writes the rows of the scsrs matching the query to a file, a chunk at a time
+
+        Arguments:
+            path {str} -- The file
+
+        Keyword Arguments:
+            query {dict} -- The (raw) query on the scsr collection (default: {None}: all, see export_query)
+            file_format {str} -- "csv", "jsonl", "parquet" or "arrow" (default: {None}: from the extension)
+            chunk_size {int} -- The rows written at once (default: {CHUNK_SIZE})
+            batch_size {int} -- The scsrs read at once (default: {CONSOLIDATION_BATCH_SIZE})
+            canonical {bool} -- The reassigned elements are exported as the element they resolve to (default: {True})
+
+        Returns:
+            int -- The number of rows written
+    """
+    file_format=(file_format or path.rsplit(".",1)[-1]).lower()
+    if file_format not in WRITERS:
+        raise ValueError("ERROR: Unknown export format: "+str(file_format))
+    chunk_size=chunk_size or CHUNK_SIZE
+    writer=WRITERS[file_format](path)
+    written=0
+    chunk=[]
+    try:
+        for row in iter_rows(query or {},batch_size,canonical):
+            chunk.append(row)
+            if len(chunk)>=chunk_size:
+                writer.write(chunk)
+                written+=len(chunk)
+                chunk=[]
+        if chunk:
+            writer.write(chunk)
+            written+=len(chunk)
+    finally:
+        writer.close()
+    return written
@@ -1,10 +1,22 @@
-from mongoengine import signals
+from mongoengine import signals, Q
+from pymongo import UpdateOne
 from uuid import uuid4
 import copy
-from collections import abc
+import itertools
+from collections import abc, Counter
 from datetime import datetime
 from application import db
-from scsr.models.elements import ElementDB, ElementAO
+from scsr.models.elements import ElementDB, ElementAO, element_ids, canonical_elements
+from game.models.game import GameDB
+from utils import identity_map
+from utils.interning import count_of
+from utils.lazy import LazyList, reference_ids
+from utils.memo import memoized
+from utils.indexes import index_registry
+from bson import ObjectId
+
+# Increases whenever the elements of a behavior change: its memoized hash is recomputed
+_member_changes = itertools.count(1)
 
 class BehaviorDiffDB(db.Document):
     elements_added = db.ListField(db.ReferenceField(ElementDB), db_field="elements_added", default=[]) # pylint: disable=no-member
@@ -25,6 +37,32 @@ class BehaviorDiffDB(db.Document):
             }
         }
 
+    @staticmethod
+    def s_to_objs(ids):
+        """ Converts the diffs of the ids (to_obj) with two queries: the diffs, then all their elements.
+
+            Arguments:
+                ids {list} -- The ids of the BehaviorDiffDB
+
+            Returns:
+                list -- The diff objects in the order of the ids (None for a diff not found)
+        """
+        diffs={diff.pk:diff for diff in BehaviorDiffDB.objects(id__in=ids).no_dereference()} # pylint: disable=no-member
+        referenced=set()
+        for diff in diffs.values():
+            referenced.update(reference_ids(diff,"elements_added"))
+            referenced.update(reference_ids(diff,"elements_removed"))
+        elements={element.pk:element.to_obj() for element in ElementDB.objects(id__in=list(referenced))} # pylint: disable=no-member
+        def converted(diff,field):
+            return set(elements[the_id] for the_id in reference_ids(diff,field) if the_id in elements)
+        return [{
+                "created":diffs[the_id].created,
+                "diff": {
+                    "added":converted(diffs[the_id],"elements_added"),
+                    "removed":converted(diffs[the_id],"elements_removed")
+                }
+            } if the_id in diffs else None for the_id in ids]
+
     def to_json(self):
         return {
             "created":self.created,
@@ -38,13 +76,21 @@ class BehaviorDiffDB(db.Document):
         return f"Added: {self.elements_added} ||| Removed: {self.elements_removed}"
 
 class BehaviorAO(abc.MutableSet):
+    """ The set of elements of a behavior.
+        The elements are interned by external_id (element_ids) and the set is kept as an int bitset (bits). The behavior
+        keeps its own element objects and their slots (_members, id -> (slot, element)): the ids it uses are not reused
+        while it lives. The set operations are int operations on the bits and the member ids, without hashing the
+        elements again; membership and length only read the bits.
+        The elements property converts from/to a set of ElementAO.
+    """
     
     def __init__(self, elements=(), behavior_type=""):
         if(behavior_type):
             if(behavior_type not in ["INTERACTIVITY", "LUDIC", "MECHANICAL", "GAMEFICATION", "DEVICE", "composed"]):
                 raise TypeError("ERROR: Behavior type not recognized. Type provided: "+behavior_type)
 
-        self.elements = set(elements)
+        elements=list(elements)
+        self.__set_members__(BehaviorAO.__members_of__(elements))
 
         self.behavior_type = behavior_type
 
@@ -53,19 +99,134 @@ class BehaviorAO(abc.MutableSet):
         # quantification operations (+) sets the behavior type so it does not allows saving
         # logic (and set) operations maintains only one instance, preserving the set properties.
         #   -- HOWEVER! Comparison between different types of behaviors are allowed, but does not allow saving.
-        self.element_count = list(elements)
+        self._counted = None
+        self.element_count = elements
         self.updated=datetime.utcnow()
         self.diffdata=[]
 
+    @classmethod
+    def from_members(cls, members, bits=None, behavior_type=""):
+        """ Creates the behavior of the members (id -> (slot, element)), whose bitset is bits (built if not given).
+            Its element_count (one of each element) is only built if read
+        """
+        retorno=cls(behavior_type=behavior_type)
+        retorno.__set_members__(members, bits)
+        retorno._element_count=None
+        return retorno
+
+    def __members_not_in__(self, other):
+        """ The members of the behavior whose ids are not in the other behavior """
+        return {the_id:member for the_id,member in self._members.items() if the_id not in other._members}
+
+    @staticmethod
+    def __members_of__(elements):
+        """ The members (id -> (slot, element)) of the elements, interning them. The first element of each id is kept """
+        members={}
+        for element in elements:
+            the_slot=element_ids.slot(element)
+            if the_slot.id not in members:
+                members[the_slot.id]=(the_slot,element)
+        return members
+
+    def __set_members__(self, members, bits=None):
+        """ Replaces the elements by the members (id -> (slot, element)). The bitset is built if not given """
+        if bits is None:
+            bits=0
+            for the_id in members:
+                bits|=1<<the_id
+        self._members=members
+        self.bits=bits
+        self._revision=next(_member_changes)
+
+    def __elements_not_in__(self, other):
+        """ The elements of the behavior whose ids are not in the other behavior """
+        return [element for the_slot,element in self.__members_not_in__(other).values()]
+
+    @property
+    def elements(self):
+        return set(element for the_slot,element in self._members.values())
+
+    @elements.setter
+    def elements(self, elements):
+        self.__set_members__(BehaviorAO.__members_of__(elements))
+
+    @property
+    def element_count(self):
+        if self._element_count is None:
+            members=self._members
+            if self._counted is not None:
+                self._element_count=[members[the_id][1] for the_id,count in self._counted.items() if the_id in members for _ in range(count)]
+                self._counted=None
+            else:
+                self._element_count=[element for the_slot,element in members.values()]
+        return self._element_count
+
+    @element_count.setter
+    def element_count(self, element_count):
+        self._counted=None
+        self._element_count=element_count
+
+    def __counted_ids__(self):
+        """ The occurrences of the elements (element_count) as interned ids: a Counter or an iterable of ids """
+        if self._counted is not None:
+            return self._counted
+        if self._element_count is None:
+            return list(self._members)
+        the_ids=(element_ids.lookup(element) for element in self._element_count)
+        return [the_id for the_id in the_ids if the_id is not None]
+
+    @classmethod
+    def aggregate(cls, behaviors):
+        """ The sum of many behaviors, as sum() (__add__): the union of the elements, every occurrence counted in element_count.
+            Linear: each behavior is read once into one bitset and one Counter of element ids, instead of a new union and
+            a concatenated element_count list at each step.
+
+            Arguments:
+                behaviors {iterable(BehaviorAO)} -- The behaviors, read once
+
+            Raises:
+                TypeError -- If an item is not a BehaviorAO
+
+            Returns:
+                BehaviorAO -- The sum. Its type is "composed" if the types differ.
+        """
+        retorno=cls.from_members({},0)
+        retorno._counted=Counter()
+        retorno._accumulated=0
+        for behavior in behaviors:
+            retorno.__accumulate__(behavior)
+        return retorno
+
+    def __accumulate__(self, other):
+        """ Adds a behavior to an aggregate (created by aggregate, possibly of no behavior) """
+        if not isinstance(other,BehaviorAO):
+            raise TypeError("ERROR: Trying to sum two different, non related objects")
+        if not self._accumulated:
+            self.behavior_type=other.behavior_type
+        elif self.behavior_type!=other.behavior_type:
+            self.behavior_type="composed"
+        self._accumulated+=1
+        for the_id,member in other._members.items():
+            self._members.setdefault(the_id,member)
+        self.bits|=other.bits
+        self._revision=next(_member_changes)
+        self._counted.update(other.__counted_ids__())
+
+    @staticmethod
+    def __bits_of__(other):
+        """ The bitset of a behavior or of an iterable of elements """
+        if isinstance(other,BehaviorAO):
+            return other.bits
+        return element_ids.bits(other)
 
     @staticmethod
     def from_db(db_obj):
         if(not isinstance(db_obj,BehaviorDB)):
             raise TypeError("ERROR: Argument is not a valid BehaviorDB object")
-        retorno=BehaviorAO([element.to_obj() for element in db_obj.elements],db_obj.behavior_type)
+        retorno=BehaviorAO(identity_map.reference_list(db_obj,"elements","ElementDB"),db_obj.behavior_type)
         retorno.external_id=db_obj.external_id
         retorno.updated=db_obj.updated
-        retorno.diffdata=[difd.to_obj() for difd in db_obj.diffdata]
+        retorno.diffdata=LazyList(reference_ids(db_obj,"diffdata"),BehaviorDiffDB.s_to_objs)
         return retorno
 
 
@@ -78,17 +239,23 @@ class BehaviorAO(abc.MutableSet):
                 the behavior type
                 the string concatenation of every element semi_hashes (as string), provided in a sorted list
                 the element_count does not participates in the process
+            Memoized while the behavior and its elements are the same (__hash_key__)
         """
-        the_ret=""+str(self.external_id)+" - "+self.behavior_type+" - "
-        el_list=[el.__semi_hash__() for el in self.elements]
-        el_list.sort()
-        for element in el_list:
-            the_ret+=f"{element} - "
-        return the_ret
+        def compute():
+            the_ret=""+str(self.external_id)+" - "+self.behavior_type+" - "
+            el_list=[el.__semi_hash__() for el in self]
+            el_list.sort()
+            for element in el_list:
+                the_ret+=f"{element} - "
+            return the_ret
+        return memoized(self,"_semi_hash",self.__hash_key__(),compute)
+
+    def __hash_key__(self):
+        """ The state the hash depends on: the ids, the elements (_revision) and the changes of the elements (ElementAO.changes) """
+        return (self.external_id, self.behavior_type, self._revision, ElementAO.changes)
 
     def __hash__(self):
-        the_string="AO "+self.__semi_hash__()
-        return hash(the_string)
+        return memoized(self,"_hash",self.__hash_key__(),lambda: hash("AO "+self.__semi_hash__()))
 
     def revert_diff(self,difdata):
         """ Reverts current structure with diff data. (maintaining the diff_data structure)
@@ -102,25 +269,30 @@ class BehaviorAO(abc.MutableSet):
         #check diff structure:
         if not isinstance(difdata,dict):
             return self.elements
-        data=self.elements.copy()
-        self.elements=(data-difdata["diff"]["added"])|difdata["diff"]["removed"]
+        added=set(element_ids.lookup(element) for element in difdata["diff"]["added"])
+        members={the_id:member for the_id,member in self._members.items() if the_id not in added}
+        for the_id,member in BehaviorAO.__members_of__(difdata["diff"]["removed"]).items():
+            members.setdefault(the_id,member)
+        self.__set_members__(members)
         return self
 
     def reset(self):
         #only maintains diffdata
-        self.elements=set()
+        self.__set_members__({},0)
         self.element_count=[]
         self.save()
         return self
 
     def __contains__(self, element):
-        return element in self.elements
+        if not isinstance(element,ElementAO):
+            return False
+        return bool(self.bits & element_ids.bit(element))
 
     def __iter__(self):
-        return iter(self.elements)
+        return iter([element for the_slot,element in self._members.values()])
 
     def __len__(self):
-        return len(self.elements)
+        return count_of(self.bits)
 
     def __or__(self, other):
         the_type=self.behavior_type
@@ -128,7 +300,7 @@ class BehaviorAO(abc.MutableSet):
             raise TypeError("Operand Type differs. They must be the same")
         if not self.behavior_type==other.behavior_type:
             the_type="composed" #composed type cannot be saved!
-        retorno=self.__class__(self.elements | other.elements, behavior_type=the_type)
+        retorno=self.__class__.from_members({**other._members, **self._members}, self.bits | other.bits, behavior_type=the_type)
         return retorno
 
     def __and__(self, other):
@@ -137,7 +309,7 @@ class BehaviorAO(abc.MutableSet):
             raise TypeError("Operand Type differs. They must be the same")
         if not self.behavior_type==other.behavior_type:
             the_type="composed" #composed type cannot be saved!
-        retorno = self.__class__(self.elements & other.elements, behavior_type=the_type)
+        retorno = self.__class__.from_members({the_id:member for the_id,member in self._members.items() if the_id in other._members}, self.bits & other.bits, behavior_type=the_type)
         return retorno
 
     def __xor__(self, other):
@@ -146,7 +318,7 @@ class BehaviorAO(abc.MutableSet):
             raise TypeError("Operand Type differs. They must be the same")
         if not self.behavior_type==other.behavior_type:
             the_type="composed" #composed type cannot be saved!
-        retorno = self.__class__(self.elements ^ other.elements, behavior_type=the_type)
+        retorno = self.__class__.from_members({**other.__members_not_in__(self), **self.__members_not_in__(other)}, self.bits ^ other.bits, behavior_type=the_type)
         return retorno
 
     def __sub__(self,other):
@@ -155,7 +327,7 @@ class BehaviorAO(abc.MutableSet):
             raise TypeError("Operand Type differs. They must be the same")
         if not self.behavior_type==other.behavior_type:
             the_type="composed" #composed type cannot be saved!
-        retorno = self.__class__(self.elements - other.elements, behavior_type=the_type)
+        retorno = self.__class__.from_members(self.__members_not_in__(other), self.bits & ~other.bits, behavior_type=the_type)
         return retorno
 
     #__radd__ can add BehaviorAO+0, that's why we check the validity. If valid it must be a BehaviorAI
@@ -189,8 +361,8 @@ class BehaviorAO(abc.MutableSet):
     def diff(self,other):
         if not isinstance(other,BehaviorAO):
             raise TypeError("ERROR: Trying to sum two different, non related objects")
-        present=self.elements.difference(other.elements)
-        absent=other.elements.difference(self.elements)
+        present=set(self.__elements_not_in__(other))
+        absent=set(other.__elements_not_in__(self))
         return {
             "created":datetime.utcnow,
             "added":present,
@@ -220,8 +392,8 @@ class BehaviorAO(abc.MutableSet):
         for other in others:
             if not isinstance(other,BehaviorAO):
                 raise TypeError("ERROR: Trying to sum two different, non related objects")
-            present=present+list(one.elements.difference(other.elements))
-            absent=absent+list(other.elements.difference(one.elements))
+            present=present+one.__elements_not_in__(other)
+            absent=absent+other.__elements_not_in__(one)
         return {
             "created":datetime.utcnow,
             "added":present,
@@ -234,8 +406,8 @@ class BehaviorAO(abc.MutableSet):
     def s_diff(one,other):
         if not isinstance(other,BehaviorAO) or not isinstance(one,BehaviorAO):
             raise TypeError("ERROR: Trying to sum two different, non related objects")
-        present=one.elements.difference(other.elements)
-        absent=other.elements.difference(one.elements)
+        present=set(one.__elements_not_in__(other))
+        absent=set(other.__elements_not_in__(one))
         return {
             "created": datetime.utcnow,
             "added": present,
@@ -246,32 +418,54 @@ class BehaviorAO(abc.MutableSet):
     def add(self, element):
         if not isinstance(element,ElementAO):
             raise TypeError("element is not a valid ElementAO object")
-        if not self.__contains__(element):
-            self.elements.add(element)
-            self.element_count.append(element)
+        the_slot=element_ids.slot(element)
+        the_bit=1<<the_slot.id
+        if not self.bits & the_bit:
+            #read before the member is added: it may be built from the members
+            element_count=self.element_count
+            self.bits|=the_bit
+            self._members[the_slot.id]=(the_slot,element)
+            self._revision=next(_member_changes)
+            element_count.append(element)
 
     def discard(self, element):
         if not isinstance(element,ElementAO):
             raise TypeError("element is not a valid ElementAO object")
         #it uses only ther external_id for the element data.
-        self.elements.discard(element)
+        the_id=element_ids.lookup(element)
+        if the_id is None or not self.bits>>the_id & 1:
+            return
+        self.bits&=~(1<<the_id)
+        del self._members[the_id]
+        self._revision=next(_member_changes)
         #discard removes all occurrences of the element
-        while element in self.element_count:
-            self.element_count.remove(element)
+        the_key=element_ids.key(element)
+        self.element_count=[counted for counted in self.element_count if element_ids.key(counted)!=the_key]
 
     def quantify(self): 
-        """ Returns the dictionary of the quantification of the elements.
+        """ Returns the quantification of the elements.
+            The counting is linear (Counter) and the element DB objects are retrieved in a single query.
+            The reassigned elements are counted in their canonical ones (canonical_elements).
         
         Returns:
-            set containing a dict with the element DB object as 'element' and how many times it occurs as 'count'
+            list containing a dict with the element DB object as 'element' and how many times it occurs as 'count'
         """
-
-        return ({"element":element.__get_persisted__(),"count":self.element_count.count(element)} for element in self.elements)
+        counted=Counter(self.__counted_ids__())
+        members=self._members
+        counted=canonical_elements.fold_external_ids(Counter({members[the_id][1].external_id:count for the_id,count in counted.items() if the_id in members}))
+        the_ids=[element.external_id for element in self]
+        canonical_ids=[]
+        for external_id in the_ids:
+            external_id=canonical_elements.canonical_external_id(external_id)
+            if external_id not in canonical_ids:
+                canonical_ids.append(external_id)
+        persisted={element.external_id:element for element in ElementDB.objects.filter(external_id__in=canonical_ids)} if canonical_ids else {} # pylint: disable=no-member
+        return [{"element":persisted.get(external_id),"count":counted[external_id]} for external_id in canonical_ids]
 
     def to_json(self):
         return {
             "behavior_type": self.behavior_type,
-            "elements": [el.to_json() for el in self.elements]
+            "elements": [el.to_json() for el in self]
         }
 
     def __repr__(self):
@@ -303,7 +497,7 @@ class BehaviorAO(abc.MutableSet):
         if self.behavior_type not in ["INTERACTIVITY", "LUDIC", "MECHANICAL", "GAMEFICATION", "DEVICE"]:
             return TypeError,"Behavior Type not Recognized."
         # And all elements in the list must be valid ElementAO objects
-        for element in self.elements:
+        for element in self:
             if not isinstance(element,ElementAO):
                 return TypeError,"Attempting to save a non ElementAO object"
         #Behavior mus ALWAYS have an external ID. 
@@ -323,11 +517,11 @@ class BehaviorAO(abc.MutableSet):
         #Persists and update self data.
         returned_obj=BehaviorDB.__persist__(self)
         self.updated=returned_obj.updated
-        self.diffdata=[difd.to_obj() for difd in returned_obj.diffdata]
+        self.diffdata=returned_obj.diffdata
         return self
     
     def copy(self):
-        to_ret=BehaviorAO(self.elements.copy(), self.behavior_type)
+        to_ret=BehaviorAO.from_members(dict(self._members), self.bits, self.behavior_type)
         return to_ret
 
     def difference(self,other):
@@ -345,7 +539,7 @@ class BehaviorAO(abc.MutableSet):
         retorno=self ^ other
         retorno=retorno & self
         self.element_count=retorno.element_count
-        self.elements = retorno.elements
+        self.__set_members__(retorno._members, retorno.bits)
         self.behavior_type = retorno.behavior_type
 
     def intersection(self,other):
@@ -365,7 +559,7 @@ class BehaviorAO(abc.MutableSet):
             raise TypeError("ERROR: Cannot DiffUpdate different types of behaviors.")
         retorno= self | other
         self.element_count=retorno.element_count
-        self.elements = retorno.elements
+        self.__set_members__(retorno._members, retorno.bits)
         self.behavior_type = retorno.behavior_type
         
 
@@ -376,7 +570,7 @@ class BehaviorAO(abc.MutableSet):
             raise TypeError("ERROR: Cannot DiffUpdate different types of behaviors.")
         retorno= self & other
         self.element_count=retorno.element_count
-        self.elements = retorno.elements
+        self.__set_members__(retorno._members, retorno.bits)
         self.behavior_type = retorno.behavior_type
 
     def symmetric_difference(self,other):
@@ -392,11 +586,37 @@ class BehaviorAO(abc.MutableSet):
             raise TypeError("ERROR: Cannot DiffUpdate different types of behaviors.")
         retorno=self ^ other
         self.element_count=retorno.element_count
-        self.elements = retorno.elements
+        self.__set_members__(retorno._members, retorno.bits)
         self.behavior_type = retorno.behavior_type
 
-    for method in ['clear', 'isdisjoint', 'issubset', 'issuperset', 'pop', 'remove', 'update']:
-        locals()[method] = (lambda method:lambda self, other=(): getattr(self.elements, method)(*((other,) if other else ()) ) ) (method)
+    def clear(self):
+        self.__set_members__({},0)
+        self.element_count=[]
+
+    def isdisjoint(self, other):
+        return not self.bits & BehaviorAO.__bits_of__(other)
+
+    def issubset(self, other):
+        return not self.bits & ~BehaviorAO.__bits_of__(other)
+
+    def issuperset(self, other):
+        return not BehaviorAO.__bits_of__(other) & ~self.bits
+
+    def pop(self):
+        if not self.bits:
+            raise KeyError("pop from an empty behavior")
+        element=self._members[(self.bits & -self.bits).bit_length()-1][1]
+        self.discard(element)
+        return element
+
+    def remove(self, element):
+        if element not in self:
+            raise KeyError(element)
+        self.discard(element)
+
+    def update(self, other=()):
+        for element in other:
+            self.add(element)
 
 
 class BehaviorDB(db.Document):
@@ -418,6 +638,21 @@ class BehaviorDB(db.Document):
     created = db.DateTimeField(db_field="created", required=True, default=datetime.utcnow) # pylint: disable=no-member
     #diffdata is a list of differentials, passible of sorting via creation date
     diffdata = db.ListField(db.ReferenceField(BehaviorDiffDB),db_field="diffdata") # pylint: disable=no-member
+    #the game and the function (persuasive, aesthetic...) the behavior belongs to. Set when the scsr is created.
+    #The diffs of the behaviors with game and function are counted in the ConsolidatedScsrDB of the game.
+    game = db.ReferenceField(GameDB, db_field="game") # pylint: disable=no-member
+    function = db.StringField(db_field="function") # pylint: disable=no-member
+    #diffs appended since the last snapshot (BehaviorSnapshotDB)
+    since_snapshot = db.IntField(db_field="since_snapshot", default=0) # pylint: disable=no-member
+
+    meta = {
+        "indexes": ["external_id", "game"]
+    }
+
+    # diffs read per round trip by the compaction (compact_history)
+    COMPACTION_BATCH_SIZE = 500
+    # attempts of a batch save whose behaviors are changed by concurrent saves, before giving up (see __persist_many__)
+    PERSIST_ATTEMPTS = 5
 
     def __repr__(self):
         base = f"{self.behavior_type}: {self.elements} - {len(self.diffdata)-1} updates"
@@ -477,9 +712,291 @@ class BehaviorDB(db.Document):
         the_diff.save()
         db_obj.diffdata.append(the_diff)
         db_obj.updated=datetime.utcnow()
+        db_obj.since_snapshot=(db_obj.since_snapshot or 0)+1
+        snapshot_due=db_obj.since_snapshot>=BehaviorSnapshotDB.EVERY
+        if snapshot_due:
+            db_obj.since_snapshot=0
         db_obj.save()
+        if snapshot_due:
+            BehaviorSnapshotDB(behavior=db_obj, diff=the_diff, created=the_diff.created, elements=db_obj.elements).save()
+        BehaviorDB.__count_diffs__([(
+            db_obj.to_mongo().get("game"),
+            db_obj.function,
+            db_obj.behavior_type,
+            [element.external_id for element in added],
+            [element.external_id for element in removed])])
         return db_obj.to_obj()
 
+    @staticmethod
+    def __count_diffs__(entries):
+        """ Propagates the diffs to the consolidated counters of the games (see ConsolidatedScsrDB.__apply_diffs__)
+
+        Arguments:
+            entries {list(tuple)} -- (game id, function, behavior type, added element external_ids, removed element external_ids)
+        """
+        #imported here: scsr.models.scsr depends on this module
+        from scsr.models.scsr import ConsolidatedScsrDB
+        ConsolidatedScsrDB.__apply_diffs__(entries)
+
+    @staticmethod
+    def __persist_many__(behobs):
+        """ Persists a batch of behaviors with a fixed number of round trips to the database, whatever the batch size.
+            The semantics are the same as __persist__: each behavior receives a new BehaviorDiffDB (even if empty) with the elements
+            added and removed since the last persistence.
+            The round trips are:
+                1 - the current elements of every behavior in the batch
+                2 - the ElementDB objects, both the new ones and the previous ones
+                3 - insert_many of the BehaviorDiffDB objects
+                4 - bulk_write of the behaviors update
+                5 - insert_many of the snapshots (only when some behavior reached BehaviorSnapshotDB.EVERY diffs since the last one)
+                6 - bulk_write of the consolidated counters (only when the behaviors belong to a game)
+            A behavior changed by another save between 1 and 4 is not overwritten: it is read and diffed again (see
+            __persist_attempt__), so the history and the counters follow both saves.
+            The application objects are updated in place (updated and diffdata).
+
+        Arguments:
+            behobs {list(BehaviorAO)} -- the behaviors to persist
+
+        Raises:
+            TypeError -- Not a BehaviorAO or behavior type not recognized
+            RuntimeError -- Behavior without external_id, not persisted or changed during every one of the PERSIST_ATTEMPTS
+
+        Returns:
+            dict -- {behavior external_id: BehaviorDiffDB} with the diff generated for each behavior
+        """
+        if not behobs:
+            return {}
+        for behob in behobs:
+            if not isinstance(behob,BehaviorAO):
+                raise TypeError("ERROR: Cannot persist a non Behavior type in the Behavior Collection!")
+            if behob.behavior_type not in ["INTERACTIVITY", "LUDIC", "MECHANICAL", "GAMEFICATION", "DEVICE"]:
+                raise TypeError("Behavior Type not Recognized.")
+            if not behob.external_id:
+                raise RuntimeError("ERROR: Cannot persist a nonexistent data!")
+        written={}
+        pending=behobs
+        for _ in range(BehaviorDB.PERSIST_ATTEMPTS):
+            pending=BehaviorDB.__persist_attempt__(pending,written)
+            if not pending:
+                break
+        else:
+            raise RuntimeError("ERROR: Behavior Data changing while persisted - "+", ".join(behob.external_id for behob in pending))
+        retorno={}
+        for behob in behobs:
+            the_diff=written[behob.external_id]
+            added_ids=set(element.external_id for element in the_diff.elements_added)
+            behob.updated=the_diff.created
+            behob.diffdata=behob.diffdata+[{
+                "created":the_diff.created,
+                "diff":{
+                    "added":set(elt for elt in behob.elements if elt.external_id in added_ids),
+                    "removed":set(element.to_obj() for element in the_diff.elements_removed)
+                }
+            }]
+            retorno[behob.external_id]=the_diff
+        return retorno
+
+    @staticmethod
+    def __persist_attempt__(behobs, written):
+        """ One attempt of __persist_many__. Each behavior is only updated if its elements (and diffs since the last
+            snapshot) are still the ones its diff was computed from: the behaviors changed meanwhile by another save
+            are left out, and their diffs deleted, so they are diffed again on the state written by that save.
+
+        Arguments:
+            behobs {list(BehaviorAO)} -- the behaviors to persist
+            written {dict} -- {behavior external_id: BehaviorDiffDB}, filled with the behaviors updated
+
+        Returns:
+            list(BehaviorAO) -- the behaviors not updated (changed meanwhile, or repeated in the batch)
+        """
+        #a behavior repeated in the batch is written by the next attempt, on the state written by this one
+        firsts={}
+        for behob in behobs:
+            firsts.setdefault(behob.external_id,behob)
+        repeated=[behob for behob in behobs if firsts[behob.external_id] is not behob]
+        behobs=list(firsts.values())
+        behavior_collection=BehaviorDB._get_collection()
+        the_ids=[behob.external_id for behob in behobs]
+        current={doc["external_id"]:doc for doc in behavior_collection.find({"external_id":{"$in":the_ids}},{"external_id":1,"elements":1,"game":1,"function":1,"since_snapshot":1})}
+        if len(current)<len(set(the_ids)):
+            raise RuntimeError("ERROR: Persisted Behavior Data not Found!")
+        #one query resolves both the new elements (by external_id) and the previous ones (by id)
+        element_ids=set(elt.external_id for behob in behobs for elt in behob.elements)
+        previous_ids=set(oid for doc in current.values() for oid in doc.get("elements",[]))
+        the_elements=ElementDB.objects(Q(external_id__in=list(element_ids)) | Q(id__in=list(previous_ids))) if (element_ids or previous_ids) else [] # pylint: disable=no-member
+        by_external_id={}
+        by_id={}
+        for element in the_elements:
+            by_external_id[element.external_id]=element
+            by_id[element.id]=element
+        the_diffs=[]
+        the_updates=[]
+        now=datetime.utcnow()
+        for behob in behobs:
+            previous=current[behob.external_id].get("elements",[])
+            #elements not persisted are disregarded, as in __persist__
+            the_elements=[by_external_id[elt.external_id] for elt in behob.elements if elt.external_id in by_external_id]
+            new_ids=[element.id for element in the_elements]
+            previous_set=set(previous)
+            new_set=set(new_ids)
+            the_diff=BehaviorDiffDB()
+            the_diff.elements_added=[element for element in the_elements if element.id not in previous_set]
+            the_diff.elements_removed=[by_id[oid] for oid in previous if oid not in new_set and oid in by_id]
+            the_diff.created=now
+            the_diffs.append(the_diff)
+            the_updates.append((behob,new_ids))
+        inserted=BehaviorDiffDB._get_collection().insert_many([the_diff.to_mongo() for the_diff in the_diffs], ordered=True)
+        for the_diff,diff_id in zip(the_diffs,inserted.inserted_ids):
+            the_diff.id=diff_id
+        the_writes=[]
+        the_snapshots=[]
+        for (behob,new_ids),the_diff in zip(the_updates,the_diffs):
+            since_snapshot=current[behob.external_id].get("since_snapshot",0)+1
+            if since_snapshot>=BehaviorSnapshotDB.EVERY:
+                since_snapshot=0
+                the_snapshots.append({"behavior":current[behob.external_id]["_id"],"diff":the_diff.id,"created":now,"elements":new_ids})
+            #None matches a missing field: the state read is compared as it is stored
+            the_writes.append(UpdateOne(
+                {"external_id":behob.external_id,"elements":current[behob.external_id].get("elements"),"since_snapshot":current[behob.external_id].get("since_snapshot")},
+                {
+                    "$set":{"elements":new_ids,"behavior":behob.behavior_type,"updated":now,"since_snapshot":since_snapshot},
+                    "$push":{"diffdata":the_diff.id}
+                }))
+        updated=list(zip(behobs,the_diffs))
+        conflicts=[]
+        if behavior_collection.bulk_write(the_writes, ordered=False).matched_count<len(the_writes):
+            #the behaviors holding their new diff were updated, the others were changed meanwhile
+            pushed=set(doc["external_id"] for doc in behavior_collection.find({"diffdata":{"$in":[the_diff.id for the_diff in the_diffs]}},{"external_id":1}))
+            conflicts=[(behob,the_diff) for behob,the_diff in updated if behob.external_id not in pushed]
+            updated=[(behob,the_diff) for behob,the_diff in updated if behob.external_id in pushed]
+            dropped=set(the_diff.id for behob,the_diff in conflicts)
+            BehaviorDiffDB._get_collection().delete_many({"_id":{"$in":list(dropped)}}) # pylint: disable=protected-access
+            the_snapshots=[snapshot for snapshot in the_snapshots if snapshot["diff"] not in dropped]
+        if the_snapshots:
+            BehaviorSnapshotDB._get_collection().insert_many(the_snapshots, ordered=False) # pylint: disable=protected-access
+        BehaviorDB.__count_diffs__([(
+            current[behob.external_id].get("game"),
+            current[behob.external_id].get("function"),
+            behob.behavior_type,
+            [element.external_id for element in the_diff.elements_added],
+            [element.external_id for element in the_diff.elements_removed]) for behob,the_diff in updated])
+        for behob,the_diff in updated:
+            written[behob.external_id]=the_diff
+        return [behob for behob,the_diff in conflicts]+repeated
+
+    @staticmethod
+    def quantify(query):
+        """ Quantifies the elements of the persisted behaviors matching the query, grouped by function and behavior.
+            The grouping is made by the database ($unwind/$group) in a single aggregation. The element DB objects are
+            then retrieved in one query (no $lookup, the deployed MongoDB does not support it).
+            The function is the one stamped in the behavior when its scsr was created (None for loose behaviors).
+
+        Arguments:
+            query {dict} -- the raw query selecting the behaviors. Ex: {"game": game_db.id}
+
+        Returns:
+            dict -- {function: {behavior: [{"element": ElementDB, "count": int}]}}, the lists sorted by count (descending)
+        """
+        pipeline=[
+            {"$match":query},
+            {"$project":{"function":1,"behavior":1,"elements":1}},
+            {"$unwind":"$elements"},
+            {"$group":{"_id":{"function":"$function","behavior":"$behavior","element":"$elements"},"count":{"$sum":1}}},
+            {"$sort":{"count":-1}},
+            {"$group":{
+                "_id":{"function":"$_id.function","behavior":"$_id.behavior"},
+                "elements":{"$push":{"element":"$_id.element","count":"$count"}}
+            }}
+        ]
+        grouped={(doc["_id"].get("function"),doc["_id"].get("behavior")):doc["elements"] for doc in BehaviorDB._get_collection().aggregate(pipeline)}
+        #the reassigned elements are counted in their canonical ones
+        for key,elements in grouped.items():
+            folded=canonical_elements.fold_ids(Counter({counted["element"]:counted["count"] for counted in elements}))
+            grouped[key]=[{"element":oid,"count":count} for oid,count in folded.most_common()]
+        the_ids=set(counted["element"] for elements in grouped.values() for counted in elements)
+        persisted={element.id:element for element in ElementDB.objects.filter(id__in=list(the_ids))} if the_ids else {} # pylint: disable=no-member
+        retorno={}
+        for (function,behavior),elements in grouped.items():
+            retorno.setdefault(function,{})[behavior.lower()]=[
+                {"element":persisted[counted["element"]],"count":counted["count"]} for counted in elements if counted["element"] in persisted
+            ]
+        return retorno
+
+    @staticmethod
+    def compact_history(query, batch_size=None):
+        """ Compacts the diffdata of the behaviors matching the query:
+                - the empty diffs (nothing added or removed) are dropped from the diffdata, except the first one (the creation).
+                  The diff documents are kept: a ScsrDiffDB may still reference them (see ScsrDB.compact_history).
+                - the snapshots of the behaviors are rewritten: one every BehaviorSnapshotDB.EVERY diffs left.
+            A behavior saved while compacted is skipped (its diffdata is only replaced if unchanged): compact it again later.
+
+        Arguments:
+            query {dict} -- The (raw) query on the behavior collection. Ex.: {"game": game.id}
+
+        Keyword Arguments:
+            batch_size {int} -- The behaviors per batch (default: {COMPACTION_BATCH_SIZE})
+
+        Returns:
+            dict -- {"behaviors": compacted, "dropped": diffs dropped, "snapshots": snapshots written, "skipped": behaviors changed meanwhile}
+        """
+        batch_size=batch_size or BehaviorDB.COMPACTION_BATCH_SIZE
+        stats={"behaviors":0,"dropped":0,"snapshots":0,"skipped":0}
+        batch=[]
+        for behavior_doc in BehaviorDB._get_collection().find(query,{"diffdata":1}).batch_size(batch_size):
+            batch.append(behavior_doc)
+            if len(batch)>=batch_size:
+                BehaviorDB.__compact_batch__(batch,stats)
+                batch=[]
+        BehaviorDB.__compact_batch__(batch,stats)
+        return stats
+
+    @staticmethod
+    def __compact_batch__(behavior_docs, stats):
+        """ Compacts a batch of (projected) behavior documents: see compact_history """
+        if not behavior_docs:
+            return
+        the_ids=[diff_id for doc in behavior_docs for diff_id in doc.get("diffdata",[])]
+        the_diffs={doc["_id"]:doc for doc in BehaviorDiffDB._get_collection().find( # pylint: disable=protected-access
+            {"_id":{"$in":the_ids}},{"created":1,"elements_added":1,"elements_removed":1})}
+        the_writes=[]
+        the_snapshots=[]
+        for behavior_doc in behavior_docs:
+            chain=behavior_doc.get("diffdata",[])
+            kept=[diff_id for position,diff_id in enumerate(chain) if diff_id in the_diffs and (position==0 or
+                the_diffs[diff_id].get("elements_added") or the_diffs[diff_id].get("elements_removed"))]
+            elements=set()
+            snapshots=[]
+            for position,diff_id in enumerate(kept):
+                elements.difference_update(the_diffs[diff_id].get("elements_removed",[]))
+                elements.update(the_diffs[diff_id].get("elements_added",[]))
+                if (position+1)%BehaviorSnapshotDB.EVERY==0:
+                    snapshots.append({"behavior":behavior_doc["_id"],"diff":diff_id,"created":the_diffs[diff_id]["created"],"elements":list(elements)})
+            the_writes.append((behavior_doc["_id"],chain,kept,len(kept)%BehaviorSnapshotDB.EVERY))
+            the_snapshots.append(snapshots)
+        behavior_collection=BehaviorDB._get_collection() # pylint: disable=protected-access
+        result=behavior_collection.bulk_write([UpdateOne(
+            {"_id":behavior_id,"diffdata":chain},
+            {"$set":{"diffdata":kept,"since_snapshot":since_snapshot}}) for behavior_id,chain,kept,since_snapshot in the_writes], ordered=False)
+        compacted=set(behavior_id for behavior_id,chain,kept,since_snapshot in the_writes)
+        if result.matched_count<len(the_writes):
+            #the behaviors saved meanwhile do not hold the compacted diffdata
+            expected={behavior_id:kept for behavior_id,chain,kept,since_snapshot in the_writes}
+            compacted=set(doc["_id"] for doc in behavior_collection.find({"_id":{"$in":list(compacted)}},{"diffdata":1})
+                if doc.get("diffdata",[])==expected[doc["_id"]])
+        snapshot_collection=BehaviorSnapshotDB._get_collection() # pylint: disable=protected-access
+        snapshot_collection.delete_many({"behavior":{"$in":list(compacted)}})
+        new_snapshots=[]
+        for (behavior_id,chain,kept,since_snapshot),snapshots in zip(the_writes,the_snapshots):
+            if behavior_id in compacted:
+                stats["behaviors"]+=1
+                stats["dropped"]+=len(chain)-len(kept)
+                new_snapshots.extend(snapshots)
+            else:
+                stats["skipped"]+=1
+        if new_snapshots:
+            snapshot_collection.insert_many(new_snapshots, ordered=False)
+        stats["snapshots"]+=len(new_snapshots)
+
     @staticmethod
     def __create_persistence__(behavior_type):
         if not behavior_type:
@@ -511,6 +1028,75 @@ class BehaviorDB(db.Document):
             raise RuntimeError("ERROR: Attempting to save an invalid behavior type: "+document.behavior_type)
 
 
+
+class BehaviorSnapshotDB(db.Document):
+    """ The elements of a behavior right after one of its diffs. Written every EVERY diffs of the behavior (by the saves
+        and by the compaction), so the behavior at a date is rebuilt from the nearest snapshot and at most EVERY diffs,
+        not from its whole diffdata.
+    """
+    behavior = db.ReferenceField(BehaviorDB, db_field="behavior", required=True) # pylint: disable=no-member
+    diff = db.ReferenceField(BehaviorDiffDB, db_field="diff", required=True) # pylint: disable=no-member
+    created = db.DateTimeField(db_field="created", required=True) # pylint: disable=no-member
+    elements = db.ListField(db.ReferenceField(ElementDB), db_field="elements", default=[]) # pylint: disable=no-member
+
+    meta = {
+        "indexes": [("behavior", "-created")]
+    }
+
+    # diffs between snapshots. Set from the SNAPSHOT_EVERY config
+    EVERY = 50
+
+    @staticmethod
+    def s_elements_as_of(behavior_ids, date):
+        """ Rebuilds the elements of the behaviors as they were at the date: the nearest snapshot up to the date,
+            then the diffs after it (in diffdata order) created up to the date.
+            The round trips are fixed: the behaviors, the snapshots, the elements of the chosen ones and the diffs.
+
+        Arguments:
+            behavior_ids {list} -- The ids of the BehaviorDB
+            date {datetime} -- The moment
+
+        Returns:
+            dict -- {behavior id: set(element ids)}. A behavior created after the date, or not found, is absent.
+        """
+        behavior_docs=[doc for doc in BehaviorDB._get_collection().find( # pylint: disable=protected-access
+            {"_id":{"$in":list(behavior_ids)},"created":{"$lte":date}},{"diffdata":1})]
+        if not behavior_docs:
+            return {}
+        snapshot_collection=BehaviorSnapshotDB._get_collection() # pylint: disable=protected-access
+        nearest={}
+        for doc in snapshot_collection.find({"behavior":{"$in":[doc["_id"] for doc in behavior_docs]},"created":{"$lte":date}},{"behavior":1,"created":1}):
+            if doc["behavior"] not in nearest or doc["created"]>nearest[doc["behavior"]]["created"]:
+                nearest[doc["behavior"]]=doc
+        snapshots={doc["behavior"]:doc for doc in snapshot_collection.find(
+            {"_id":{"$in":[doc["_id"] for doc in nearest.values()]}},{"behavior":1,"diff":1,"elements":1})} if nearest else {}
+        pending={}
+        for behavior_doc in behavior_docs:
+            chain=behavior_doc.get("diffdata",[])
+            snapshot=snapshots.get(behavior_doc["_id"])
+            start=chain.index(snapshot["diff"])+1 if snapshot and snapshot["diff"] in chain else 0
+            if not start:
+                snapshot=None
+            pending[behavior_doc["_id"]]=(set(snapshot["elements"]) if snapshot else set(),chain[start:])
+        the_diffs={doc["_id"]:doc for doc in BehaviorDiffDB._get_collection().find( # pylint: disable=protected-access
+            {"_id":{"$in":[diff_id for elements,chain in pending.values() for diff_id in chain]},"created":{"$lte":date}},
+            {"elements_added":1,"elements_removed":1})}
+        retorno={}
+        for behavior_id,(elements,chain) in pending.items():
+            #only the diffs up to the date were read: applied in the diffdata order
+            for the_diff in (the_diffs[diff_id] for diff_id in chain if diff_id in the_diffs):
+                elements.difference_update(the_diff.get("elements_removed",[]))
+                elements.update(the_diff.get("elements_added",[]))
+            retorno[behavior_id]=elements
+        return retorno
+
+
 signals.pre_save.connect(BehaviorDB.pre_save, sender=BehaviorDB)
+index_registry.declare(BehaviorDB,
+    probes=[
+        ("__get_persisted__", {"external_id": "probe"}),
+        ("__persist_many__", {"external_id": {"$in": ["probe"]}}),
+        ("quantify", {"game": ObjectId()})
+    ])
 
 
@@ -1,14 +1,29 @@
 import json
+import itertools
+import time
 from mongoengine import signals
 from application import db
 from uuid import uuid4
 from datetime import datetime
-from collections import abc
+from collections import abc, Counter
 
 from sys_app.models.localization import TranslationsAO
 from game.models.game import GameAO
+from utils import identity_map
+from utils.interning import Interner
+from utils.canonical import Canonical
+from utils.indexes import index_registry
+from utils.typeahead import typeahead_index
+from utils.tasks import background_task
+
+# Increases whenever an element already hashed changes: the hashes memoized from elements (BehaviorAO) are recomputed
+_element_changes = itertools.count(1)
 
 class ElementAO(object):
+    # the fields the hash depends on: assigning them drops the memoized hash
+    __hashed__ = ("element", "active", "reassigned_to", "reassigned_from")
+    changes = 0
+
     def __init__(self):
         self.external_id=None
         self.active=True
@@ -22,22 +37,48 @@ class ElementAO(object):
     def from_db(db_obj):
         if(not isinstance(db_obj,ElementDB)):
             raise TypeError("ERROR: Argument is not a valid ElementDB object.")
-        retorno = ElementAO()
-        retorno.external_id = db_obj.external_id
-        retorno.active = db_obj.active
-        retorno.element = db_obj.element
-        if db_obj.reassigned_to:
-            retorno.reassigned_to = db_obj.reassigned_to.to_obj()
-        if db_obj.reassigned_from:
-            retorno.reassigned_from = [elem.to_obj() for elem in db_obj.reassigned_from]
-        retorno.updated = db_obj.updated
-        retorno.created = db_obj.created
-        return retorno
+        #converted within a scope (opened if none is), so the reassignments, that reference each other, end in the map
+        with identity_map.identity_scope():
+            retorno = identity_map.cached(db_obj)
+            if retorno is not None:
+                return retorno
+            retorno = ElementAO()
+            retorno.external_id = db_obj.external_id
+            retorno.active = db_obj.active
+            #a copy: the ElementDB changes its names in place (update_element), unseen by the memoized hash
+            retorno.element = dict(db_obj.element)
+            retorno.updated = db_obj.updated
+            retorno.created = db_obj.created
+            #registered before the reassignments, since they reference each other
+            identity_map.register(db_obj,retorno)
+            retorno.reassigned_to = identity_map.reference(db_obj,"reassigned_to","ElementDB")
+            retorno.reassigned_from = identity_map.reference_list(db_obj,"reassigned_from","ElementDB")
+            return retorno
+
+    def __setattr__(self, name, value):
+        if name in ElementAO.__hashed__:
+            self.__changed__()
+        object.__setattr__(self, name, value)
+
+    def __changed__(self):
+        """ Drops the memoized hash (see __semi_hash__). Called by the mutators """
+        if self.__dict__.pop("_hash",None) is not None:
+            ElementAO.changes=next(_element_changes)
 
     def __eq__(self,other):
         return self.__hash__()==other.__hash__()
 
     def __semi_hash__(self):
+        """ The string identifying the element (names, active and reassignments).
+            Memoized with the hash until the element changes (__changed__)
+        """
+        cached=self.__dict__.get("_hash")
+        if cached is None:
+            the_str=self.__compute_semi_hash__()
+            cached=self.__dict__["_hash"]=(the_str,hash("AO "+the_str))
+        return cached[0]
+
+    def __compute_semi_hash__(self):
         the_str=""
         langs=list(self.element.keys())
         if langs:
@@ -64,9 +105,13 @@ class ElementAO(object):
                 Creates the string for reassigned from, using only the external_id of the elements
                 The reassigned_to must be the same. This is valid only with the external_id (or else we have a recursion)
                 Finally, the updated data.
+            The hash is memoized (see __semi_hash__).
         """
-        the_str="AO "+self.__semi_hash__()
-        return hash(the_str)
+        cached=self.__dict__.get("_hash")
+        if cached is None:
+            self.__semi_hash__()
+            cached=self.__dict__["_hash"]
+        return cached[1]
 
     def compare_persisted(self,db_obj):
         if not isinstance(db_obj,ElementDB):
@@ -81,7 +126,7 @@ class ElementAO(object):
             raise TypeError("ERROR: Argument is not a valid ElementDB object.")
         self.external_id = db_obj.external_id
         self.active = db_obj.active
-        self.element = db_obj.element
+        self.element = dict(db_obj.element)
         if db_obj.reassigned_to:
             self.reassigned_to = db_obj.reassigned_to.to_obj()
         if db_obj.reassigned_from:
@@ -123,6 +168,7 @@ class ElementAO(object):
         if(not TranslationsAO.has_language(lang)):
             raise RuntimeError("ERROR: Language "+lang+" still not supported!")
         self.element[lang]=name
+        self.__changed__()
         if not hasattr(self,"has_new"):
             self.has_new=set()
         self.has_new.add((lang,name))
@@ -169,7 +215,7 @@ class ElementAO(object):
             self.external_id:{
                 "active":self.active,
                 "element":self.element,
-                "reassigned_to":self.reassigned_to.to_json(),
+                "reassigned_to":self.reassigned_to.to_json() if self.reassigned_to else None,
                 "reassigned_from":[refrom.to_json() for refrom in self.reassigned_from]
             }
         }
@@ -179,6 +225,10 @@ class ElementAO(object):
             return None
         return ElementDB.objects.filter(external_id=self.external_id).first() # pylint: disable=no-member
 
+# The elements interned for the bitsets of the behaviors (BehaviorAO), by external_id: the versions of an element share the id.
+# The elements not persisted yet are interned by object. The ids are held by the behaviors using them (see utils.interning)
+element_ids = Interner(key=lambda element: element.external_id or ("new", id(element)))
+
 class ElementDB(db.Document):
     """Class mapping the element object in the system with the element data in the database
     
@@ -208,7 +258,7 @@ class ElementDB(db.Document):
     created=db.DateTimeField(db_field="created", required=True, default=datetime.utcnow) # pylint: disable=no-member
     
     meta = {
-        "indexes": [("external_id", "active", "element")]
+        "indexes": ["external_id"]
     }
     
     def __repr__(self):
@@ -284,11 +334,18 @@ class ElementDB(db.Document):
                 This does not update the stored SCSR user data, but must perform recalculations on SCSR consolidated data.
                 This does, however, updates the SCSR user data sent to the Frontend. The change must be highlighted and explained.
                 If the user updates, the deprecated is removed and the current is added.
+            The deprecated element (and the ones reassigned to it) is resolved to the canonical element of current (canonical_elements)
+            and its counts in the consolidated data are folded into the canonical one, in background.
+
+            Returns:
+                bool -- False if not elements, if the deprecated is already reassigned or if current resolves to it (a cycle)
         """
         if((not isinstance(current,ElementDB)) or (not isinstance(deprecated,ElementDB))):
             return False
+        if deprecated.reassigned_to or current.pk==deprecated.pk or canonical_elements.canonical_id(current.pk)==deprecated.pk:
+            return False
         #Set the reassigned_to
-        deprecated.reassiged_to=current
+        deprecated.reassigned_to=current
         deprecated.active=False
         deprecated.save()
         #
@@ -297,6 +354,10 @@ class ElementDB(db.Document):
             current.reassigned_from=[]
         current.reassigned_from.append(deprecated)
         current.save()
+        canonical_elements.reassign(deprecated,current)
+        #imported here: scsr.models.scsr depends on this module
+        from scsr.models.scsr import fold_reassigned_element
+        fold_reassigned_element.enqueue("fold_element:"+deprecated.external_id,deprecated.external_id)
         # This is what must return
         return True
 
@@ -327,8 +388,11 @@ class ElementDB(db.Document):
             Arguments:
                 lang {String} -- The language of the element
                 elem {String} -- The partial string that the element contains
+
+            Returns:
+                list -- the active ElementDB found (typeahead index), best matches first
         """
-        return ElementDB.objects(__raw__={"element."+lang.lower():{'$regex':elem,'$options':'i'}, "active":True}) # pylint: disable=no-member
+        return element_typeahead.seek(elem,lang)
         
     @classmethod
     def pre_save(cls, sender, document, **kwargs):
@@ -350,14 +414,125 @@ class ElementDB(db.Document):
             sender {ElementDB} -- The sender of the signal
             document {ElementDB} -- The instance of the document
         """
-
-        refel=ElementReferenceDB.objects.filter(element=document).first() # pylint: disable=no-member
-        if not refel:
-            #Element just created. Create the reference for it
-            ElementReferenceAO(element=document.to_obj()).save()
+        #Element just created? The reference is created in background (ElementReferenceDB.s_ensure_reference)
+        create_element_reference.enqueue("element_reference:"+document.external_id,document.external_id)
 
 signals.pre_save.connect(ElementDB.pre_save, sender=ElementDB)
 signals.post_save.connect(ElementDB.post_save, sender=ElementDB)
+element_typeahead = typeahead_index("element", ElementDB, lambda element: element.element if element.active else None, fields=["element","active"])
+index_registry.declare(ElementDB,
+    localized=[("element.{lang}", "active")],
+    probes=[
+        ("seek_element", {"element.{lang}": "probe", "active": True}),
+        ("seek", {"external_id": "probe"})
+    ])
+
+
+class ElementCanonicalDB(db.Document):
+    """ The canonicalization table: each reassigned element and the element it resolves to (the end of its reassigned_to chain).
+        Kept compressed: when an element is reassigned, the ones resolving to it are updated to its canonical element.
+
+        Attributes:
+            element {ElementDB} -- The reassigned (deprecated) element
+            external_id {str} -- Its external_id
+            canonical {ElementDB} -- The active element it resolves to
+            canonical_external_id {str} -- Its external_id
+    """
+    element = db.ReferenceField(ElementDB, db_field="element", primary_key=True) # pylint: disable=no-member
+    external_id = db.StringField(db_field="external_id", required=True) # pylint: disable=no-member
+    canonical = db.ReferenceField(ElementDB, db_field="canonical", required=True) # pylint: disable=no-member
+    canonical_external_id = db.StringField(db_field="canonical_external_id", required=True) # pylint: disable=no-member
+
+    meta = {
+        "indexes": ["canonical"]
+    }
+
+
+class CanonicalElements(Canonical):
+    """ The canonicalization table in memory, by id and by external_id. Reloaded (one query) when older than ttl seconds,
+        so the reassignments made by other processes are seen.
+
+        Keyword Arguments:
+            ttl {float} -- Seconds between reloads (default: {300})
+    """
+
+    def __init__(self, ttl=300):
+        Canonical.__init__(self)
+        self.ttl=ttl
+        self.loaded=None
+        #the external_ids of the elements in the table (deprecated and canonical), both ways
+        self.external_ids={}
+        self.ids={}
+
+    def configure(self, ttl=None):
+        if ttl is not None:
+            self.ttl=ttl
+        self.loaded=None
+
+    def __ensure__(self):
+        if self.loaded is not None and time.monotonic()-self.loaded<self.ttl:
+            return
+        pairs=[]
+        external_ids={}
+        for doc in ElementCanonicalDB._get_collection().find(): # pylint: disable=protected-access
+            pairs.append((doc["_id"],doc["canonical"]))
+            external_ids[doc["_id"]]=doc["external_id"]
+            external_ids[doc["canonical"]]=doc["canonical_external_id"]
+        self.load(pairs)
+        self.external_ids=external_ids
+        self.ids={external_id:the_id for the_id,external_id in external_ids.items()}
+        self.loaded=time.monotonic()
+
+    def canonical_id(self, element_id):
+        """ The id of the element the element (id) resolves to """
+        self.__ensure__()
+        return self.find(element_id)
+
+    def canonical_external_id(self, external_id):
+        """ The external_id of the element the element (external_id) resolves to """
+        self.__ensure__()
+        the_id=self.ids.get(external_id)
+        if the_id is None or the_id not in self.parent:
+            return external_id
+        return self.external_ids[self.find(the_id)]
+
+    def fold_ids(self, counter):
+        """ The counter (element id -> count) with the deprecated elements counted in their canonical ones """
+        self.__ensure__()
+        return self.fold(counter)
+
+    def fold_external_ids(self, counter):
+        """ The counter (element external_id -> count) with the deprecated elements counted in their canonical ones """
+        self.__ensure__()
+        if not self.parent:
+            return Counter(counter)
+        retorno=Counter()
+        for external_id,count in counter.items():
+            retorno[self.canonical_external_id(external_id)]+=count
+        return retorno
+
+    def reassign(self, deprecated, current):
+        """ Records the reassignment (ElementDB.reassign), in memory and in the table
+
+            Arguments:
+                deprecated {ElementDB} -- The element reassigned
+                current {ElementDB} -- The element it was reassigned to
+        """
+        self.__ensure__()
+        root=self.replace(deprecated.pk,current.pk)
+        root_external_id=self.external_ids.get(root,current.external_id)
+        self.external_ids[deprecated.pk]=deprecated.external_id
+        self.external_ids[root]=root_external_id
+        self.ids[deprecated.external_id]=deprecated.pk
+        self.ids[root_external_id]=root
+        collection=ElementCanonicalDB._get_collection() # pylint: disable=protected-access
+        collection.update_many({"canonical":deprecated.pk},{"$set":{"canonical":root,"canonical_external_id":root_external_id}})
+        collection.update_one({"_id":deprecated.pk},{"$set":{
+            "external_id":deprecated.external_id,"canonical":root,"canonical_external_id":root_external_id}},upsert=True)
+
+
+# The element each reassigned element resolves to. TTL set from the CANONICAL_ELEMENTS_TTL config
+canonical_elements = CanonicalElements()
 
 class ElementReferenceDB(db.Document):
     """ Class to perform ORM of the reference related to the element
@@ -394,6 +569,7 @@ class ElementReferenceDB(db.Document):
 
         Methods:
             to_obj {ElementReferenceAO} --
+            s_ensure_reference {ElementReferenceDB} -- The reference of the element, created (default reference) if missing
     """
 
     element = db.ReferenceField(ElementDB,db_field="element",primary_key=True, required=True) # pylint: disable=no-member
@@ -402,6 +578,24 @@ class ElementReferenceDB(db.Document):
     def to_obj(self):
         return ElementReferenceAO.from_db(self)
 
+    @staticmethod
+    def s_ensure_reference(el_db):
+        """ Returns the reference of the element, creating the default one if the element has none.
+            The reference is keyed by the element: the insert happens only if absent ($setOnInsert), a reference set meanwhile is kept.
+
+            Arguments:
+                el_db {ElementDB} -- The element
+
+            Returns:
+                ElementReferenceDB -- The reference
+        """
+        refel=ElementReferenceDB.objects.filter(element=el_db).first() # pylint: disable=no-member
+        if not refel:
+            ElementReferenceDB._get_collection().update_one( # pylint: disable=protected-access
+                {"_id":el_db.pk},{"$setOnInsert":{"reference":ElementReferenceAO().reference}},upsert=True)
+            refel=ElementReferenceDB.objects.filter(element=el_db).first() # pylint: disable=no-member
+        return refel
+
 class ElementReferenceAO(object):
     def __init__(self, element=None, reference=None):
         if element:
@@ -449,10 +643,10 @@ class ElementReferenceAO(object):
         if not isinstance(element,ElementAO):
             raise TypeError("Error: Trying to get a reference of a not ElementAO object")
         el_db=ElementDB.objects.filter(external_id=element.external_id).first() # pylint: disable=no-member
-        the_ret=ElementReferenceDB.objects.filter(element=el_db).first() # pylint: disable=no-member
-        if(not the_ret):
+        if(not el_db):
             raise RuntimeError("Error Valid Element Object does not possess reference")
-        return the_ret.to_obj()
+        #the reference of an element just saved may still be in the queue
+        return ElementReferenceDB.s_ensure_reference(el_db).to_obj()
     
     @staticmethod
     def get_reference_sources():
@@ -608,3 +802,12 @@ class ElementGameMappingAO(abc.MutableSet):
 
     for method in ['clear', 'copy', 'difference', 'difference_update', 'discard', 'intersection', 'intersection_update', 'isdisjoint', 'issubset', 'issuperset', 'pop', 'remove', 'symmetric_difference', 'symmetric_difference_update', 'union', 'update']:
         locals()[method] = (lambda method:lambda self, other=(): getattr(self.games, method)(*((other,) if other else ()) ) ) (method)
+
+
+@background_task()
+def create_element_reference(element_id):
+    """ Task: creates the default reference of a new element (ElementDB.post_save) """
+    el_db=ElementDB.objects.filter(external_id=element_id).first() # pylint: disable=no-member
+    if not el_db:
+        raise RuntimeError("ERROR: Element not found: "+str(element_id))
+    ElementReferenceDB.s_ensure_reference(el_db)
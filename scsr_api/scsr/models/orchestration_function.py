@@ -6,6 +6,7 @@ from datetime import datetime
 from scsr.models.behaviors import BehaviorDB, BehaviorAO
 from scsr.models.elements import ElementAO, ElementDB
 from application import the_log
+from utils.memo import memoized
 
 """The functions aggregates behaviors. They were created to provide easy coding and code reading, as well as the behaviors.
     Each function is formed by the following fields:
@@ -23,6 +24,10 @@ class OrchestrationFunctionDB(db.Document):
     updated = db.DateTimeField(db_field="updated", required=True, default=datetime.utcnow) # pylint: disable=no-member
     created = db.DateTimeField(db_field="created", required=True, default=datetime.utcnow) # pylint: disable=no-member
 
+    meta = {
+        "indexes": ["external_id"]
+    }
+
     def to_obj(self):
         return OrchestrationFunctionAO.from_db(self)
 
@@ -154,6 +159,8 @@ signals.pre_save.connect(OrchestrationFunctionDB.pre_save, sender=OrchestrationF
 
 #As with Behaviors, FunctionAO objects must not be created for manipulation. A FunctionAO may always have an ExternalID.
 class OrchestrationFunctionAO(abc.MutableSet):
+    # the behaviors of the function, in the constructor order
+    BEHAVIORS = ("interactivity", "mechanical", "gamefication")
     
     def __init__(self, interactivity_=None, mechanical_=None, gamefication_=None):
         """Constructor, only valid with valid BehaviorAO's
@@ -235,15 +242,16 @@ class OrchestrationFunctionAO(abc.MutableSet):
             The calculation is performed in the following form:
                 the external_id (if not present, it must be a composed) concatenated with
                 the string concatenation of every behavior semi_hashes (as string), provided in a sorted list
-            Returns the string computed.
+            Returns the string computed. Memoized while the behaviors are the same (__hash_key__)
         """
-        the_ret=(self.external_id if self.external_id else "None")+" - "+self.interactivity.__semi_hash__()+" - "+self.mechanical.__semi_hash__()+" - "+" - "+self.gamefication.__semi_hash__()
+        return memoized(self,"_semi_hash",self.__hash_key__(),lambda: (self.external_id if self.external_id else "None")+" - "+self.interactivity.__semi_hash__()+" - "+self.mechanical.__semi_hash__()+" - "+" - "+self.gamefication.__semi_hash__())
 
-        return the_ret
+    def __hash_key__(self):
+        """ The state the hash depends on: the external_id and the state of the behaviors """
+        return (self.external_id, self.interactivity.__hash_key__(), self.mechanical.__hash_key__(), self.gamefication.__hash_key__())
 
     def __hash__(self):
-        the_string="AO "+self.__semi_hash__()
-        return hash(the_string)
+        return memoized(self,"_hash",self.__hash_key__(),lambda: hash("AO "+self.__semi_hash__()))
 
     """ 
         Decide how to deal with:
@@ -338,9 +346,32 @@ class OrchestrationFunctionAO(abc.MutableSet):
         self.composed=True
         return retorno
 
+    @classmethod
+    def aggregate(cls, functions):
+        """ The sum of many functions, as sum(), in one pass: each behavior is aggregated by BehaviorAO.aggregate
+
+        Arguments:
+            functions {iterable(OrchestrationFunctionAO)} -- The functions, read once
+
+        Raises:
+            TypeError -- If an item is not a OrchestrationFunctionAO
+
+        Returns:
+            OrchestrationFunctionAO -- The composed function
+        """
+        aggregates=[BehaviorAO.aggregate(()) for behavior in cls.BEHAVIORS]
+        for function in functions:
+            if not isinstance(function,cls):
+                raise TypeError("ERROR: Trying to sum two different, non related objects")
+            for behavior,aggregate in zip(cls.BEHAVIORS,aggregates):
+                aggregate.__accumulate__(getattr(function,behavior))
+        retorno=cls(*aggregates)
+        retorno.composed=True
+        return retorno
+
     # Unlike __radd__, where the other can be 0 (used for sum), __add__ demands an argument.
     def __add__(self,other):
-        if not isinstance(self.__class__):
+        if not isinstance(other,self.__class__):
             raise TypeError("ERROR: Trying to sum two different, non related objects")
         retorno = OrchestrationFunctionAO(self.interactivity+other.interactivity, self.mechanical+other.mechanical, self.gamefication+other.gamefication)
         #Indicates a composed, quantified element. In order to save it must be 1: Normalized, 2: Applied to a valid gamegesis.
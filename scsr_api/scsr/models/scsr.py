@@ -1,7 +1,8 @@
 from mongoengine import signals
+from pymongo import UpdateOne, UpdateMany
 from uuid import uuid4
 from datetime import datetime, timedelta
-from collections import abc
+from collections import abc, Counter
 
 import copy
 from user.models.user import UserDB, UserAO
@@ -9,7 +10,8 @@ from game.models.game import GameDB, GameAO
 from game.models.genre import GenreDB, GenreAO
 from game.models.user_game_genre import GamesGenresDB, GamesGenresAO
 
-from scsr.models.elements import ElementAO
+from scsr.models.elements import ElementAO, ElementDB, ElementCanonicalDB, canonical_elements
+from scsr.models.behaviors import BehaviorDB, BehaviorDiffDB, BehaviorSnapshotDB, BehaviorAO
 
 from scsr.models.persuasive_function import PersuasiveFunctionDB, PersuasiveFunctionAO
 from scsr.models.aesthetic_function import AestheticFunctionDB, AestheticFunctionAO
@@ -18,6 +20,12 @@ from scsr.models.reification_function import ReificationFunctionDB, ReificationF
 
 from application import db
 from application import the_log
+from utils import identity_map
+from utils.indexes import index_registry
+from utils.tasks import background_task
+from utils.memo import memoized
+from utils.lazy import LazyList, reference_ids
+from bson import ObjectId
 
 
 class ScsrDiffAO():
@@ -54,6 +62,46 @@ class ScsrDiffAO():
         }
         return retorno
 
+    @staticmethod
+    def s_from_raw(db_obj, behavior_diffs):
+        """ Converts a diff loaded without dereferencing its coded_scsr, taking the behavior diffs already converted
+
+            Arguments:
+                db_obj {ScsrDiffDB} -- The diff, loaded with no_dereference()
+                behavior_diffs {dict} -- The converted behavior diffs by id (see BehaviorDiffDB.s_to_objs)
+        """
+        retorno=ScsrDiffAO()
+        retorno.external_id=db_obj.external_id
+        retorno.date_modified=db_obj.date_modified
+        retorno.coded_scsr={
+            function:{behavior:behavior_diffs.get(ScsrDiffAO.__ref_id__(ref)) for behavior,ref in behaviors.items()}
+            for function,behaviors in db_obj.coded_scsr.items()
+        }
+        return retorno
+
+    @staticmethod
+    def __ref_id__(ref):
+        if isinstance(ref,dict):
+            ref=ref.get("_ref")
+        return getattr(ref,"id",ref)
+
+    @staticmethod
+    def s_load(ids):
+        """ Converts the diffs of the ids with three queries: the diffs, their behavior diffs and the elements of those.
+            Used to load the history of the scsrs a page at a time.
+
+            Arguments:
+                ids {list} -- The ids of the ScsrDiffDB
+
+            Returns:
+                list -- The ScsrDiffAO in the order of the ids (None for a diff not found)
+        """
+        diffs={diff.pk:diff for diff in ScsrDiffDB.objects(id__in=ids).no_dereference()} # pylint: disable=no-member
+        behavior_ids=[ScsrDiffAO.__ref_id__(ref) for diff in diffs.values()
+            for behaviors in diff.coded_scsr.values() for ref in behaviors.values()]
+        behavior_diffs=dict(zip(behavior_ids,BehaviorDiffDB.s_to_objs(behavior_ids)))
+        return [ScsrDiffAO.s_from_raw(diffs[the_id],behavior_diffs) if the_id in diffs else None for the_id in ids]
+
     def to_json(self):
         retorno={
             "external_id": self.external_id,
@@ -124,28 +172,45 @@ class ScsrDiffDB(db.Document):
 
 signals.pre_save.connect(ScsrDiffDB.pre_save, sender=ScsrDiffDB)
 
+# The layout of a scsr: the function key (as used in the coded_scsr), the attribute holding the function and its behaviors.
+SCSR_LAYOUT = (
+    ("persuasive", "persuasive_function", ("interactivity", "gamefication", "ludic")),
+    ("aesthetic", "aesthetic_function", ("interactivity", "ludic")),
+    ("orchestration", "orchestration_function", ("interactivity", "gamefication", "mechanical")),
+    ("reification", "reification_function", ("interactivity", "mechanical", "device"))
+)
+# The application classes of the functions, by function key
+FUNCTION_AO = {
+    "persuasive": PersuasiveFunctionAO,
+    "aesthetic": AestheticFunctionAO,
+    "orchestration": OrchestrationFunctionAO,
+    "reification": ReificationFunctionAO
+}
+# Dates sent to the background tasks
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
 
 class ScsrAO(abc.MutableSet):
     """ TODO: Redefine the DOCSTRING
     """
 
     def __init__(self, persuasive_=None, aesthetic_=None, orchestration_=None, reification_=None):
-        if persuasive_ and (not isinstance(persuasive_,PersuasiveFunctionAO)):
+        if (persuasive_ is not None) and (not isinstance(persuasive_,PersuasiveFunctionAO)):
             raise TypeError("ERROR: Parameter is not a valid PersuasiveFunctionAO object")
-        if aesthetic_ and (not isinstance(aesthetic_,AestheticFunctionAO)):
+        if (aesthetic_ is not None) and (not isinstance(aesthetic_,AestheticFunctionAO)):
             raise TypeError("ERROR: Parameter is not a valid AestheticFunctionAO object")
-        if orchestration_ and (not isinstance(orchestration_,OrchestrationFunctionAO)):
+        if (orchestration_ is not None) and (not isinstance(orchestration_,OrchestrationFunctionAO)):
             raise TypeError("ERROR: Parameter is not a valid OrchestrationFunctionAO object")
-        if reification_ and (not isinstance(reification_,ReificationFunctionAO)):
+        if (reification_ is not None) and (not isinstance(reification_,ReificationFunctionAO)):
             raise TypeError("ERROR: Parameter is not a valid ReificationFunctionAO object")
         self.external_id = None
         self.user = None
         self.game = None
         #create empty functions to be able to operate
-        self.persuasive_function = persuasive_ if persuasive_ else PersuasiveFunctionAO()
-        self.aesthetic_function = aesthetic_ if aesthetic_ else AestheticFunctionAO()
-        self.orchestration_function = orchestration_ if orchestration_ else OrchestrationFunctionAO()
-        self.reification_function = reification_ if reification_ else ReificationFunctionAO()
+        self.persuasive_function = persuasive_ if persuasive_ is not None else PersuasiveFunctionAO()
+        self.aesthetic_function = aesthetic_ if aesthetic_ is not None else AestheticFunctionAO()
+        self.orchestration_function = orchestration_ if orchestration_ is not None else OrchestrationFunctionAO()
+        self.reification_function = reification_ if reification_ is not None else ReificationFunctionAO()
         self.history = []
         self.date_creation = None
         self.date_modified = None
@@ -155,17 +220,17 @@ class ScsrAO(abc.MutableSet):
     #TODO: TEST
     @staticmethod
     def from_db(scsr):
-        retorno = ScsrAO()
         if not isinstance(scsr,ScsrDB):
             raise TypeError("ERROR: Assigning a non SCSR object to SCSR application object")
+        retorno = ScsrAO(
+            scsr.persuasive_function.to_obj(),
+            scsr.aesthetic_function.to_obj(),
+            scsr.orchestration_function.to_obj(),
+            scsr.reification_function.to_obj())
         retorno.external_id=scsr.external_id
-        retorno.user=scsr.user.to_obj()
-        retorno.game=scsr.game.to_obj()
-        retorno.persuasive_function=scsr.persuasive_function.to_obj()
-        retorno.aesthetic_function=scsr.aesthetic_function.to_obj()
-        retorno.orchestration_function=scsr.orchestration_function.to_obj()
-        retorno.reification_function=scsr.reification_function.to_obj()
-        retorno.history=[diff.to_obj() for diff in scsr.history]
+        retorno.user=identity_map.reference(scsr,"user","UserDB")
+        retorno.game=identity_map.reference(scsr,"game","GameDB")
+        retorno.history=LazyList(reference_ids(scsr,"history"),ScsrDiffAO.s_load)
         retorno.date_creation=scsr.date_creation
         retorno.date_modified=scsr.date_modified
         return retorno
@@ -181,13 +246,27 @@ class ScsrAO(abc.MutableSet):
         return retorno
 
     def __semi_hash__(self):
-        retorno = self.external_id+"-"+self.user.__semi_hash__()+self.game.__semi_hash__()+self.persuasive_function.__semi_hash__()
-        retorno = retorno + self.aesthetic_function.__semi_hash__() + self.orchestration_function.__semi_hash__()
-        retorno = retorno + self.reification_function.__semi_hash__() + self.date_creation + self.date_modified
-        return retorno
+        """ The string identifying the scsr: its ids, the semi hashes of the functions and the dates.
+            Memoized while they are the same (__hash_key__)
+        """
+        def compute():
+            retorno = str(self.external_id)+"-"+self.__id_of__(self.user)+self.__id_of__(self.game)+self.persuasive_function.__semi_hash__()
+            retorno = retorno + self.aesthetic_function.__semi_hash__() + self.orchestration_function.__semi_hash__()
+            retorno = retorno + self.reification_function.__semi_hash__() + str(self.date_creation) + str(self.date_modified)
+            return retorno
+        return memoized(self,"_semi_hash",self.__hash_key__(),compute)
+
+    @staticmethod
+    def __id_of__(related):
+        return related.external_id if related else "None"
+
+    def __hash_key__(self):
+        """ The state the hash depends on: the ids, the dates and the state of the functions """
+        return (self.external_id, self.__id_of__(self.user), self.__id_of__(self.game), self.date_creation, self.date_modified)+tuple(
+            getattr(self,attribute).__hash_key__() for function_key,attribute,behaviors in SCSR_LAYOUT)
 
     def __hash__(self):
-        return hash(self.__semi_hash__()+"AO")
+        return memoized(self,"_hash",self.__hash_key__(),lambda: hash(self.__semi_hash__()+"AO"))
 
 
     #TODO: TEST
@@ -341,6 +420,51 @@ class ScsrAO(abc.MutableSet):
             retorno.user=self.user
         return retorno
 
+    @staticmethod
+    def aggregate(scsrs):
+        """ The sum of many scsrs, as sum(), in one pass and linear in the total of elements: the behaviors of every function
+            are aggregated (BehaviorAO.aggregate) as the scsrs are read, so they can be streamed (a generator).
+
+        Arguments:
+            scsrs {iterable(ScsrAO)} -- The scsrs, read once
+
+        Raises:
+            TypeError -- If an item is not a ScsrAO
+
+        Returns:
+            ScsrAO -- The composed scsr. Composite if the games differ; the game and the user are kept if they are the same for all.
+        """
+        aggregates={(function_key,behavior):BehaviorAO.aggregate(()) for function_key,attribute,behaviors in SCSR_LAYOUT for behavior in behaviors}
+        the_game=the_user=None
+        same_game=same_user=True
+        counted=0
+        for scsr in scsrs:
+            if not isinstance(scsr,ScsrAO):
+                raise TypeError("ERROR: Trying to sum two different, non related objects")
+            if not counted:
+                the_game,the_user=scsr.game,scsr.user
+            else:
+                same_game=same_game and scsr.game==the_game
+                same_user=same_user and scsr.user==the_user
+            counted+=1
+            for function_key,attribute,behaviors in SCSR_LAYOUT:
+                the_function=getattr(scsr,attribute)
+                for behavior in behaviors:
+                    aggregates[(function_key,behavior)].__accumulate__(getattr(the_function,behavior))
+        functions=[]
+        for function_key,attribute,behaviors in SCSR_LAYOUT:
+            function_ao=FUNCTION_AO[function_key]
+            the_function=function_ao(*[aggregates[(function_key,behavior)] for behavior in function_ao.BEHAVIORS])
+            the_function.composed=True
+            functions.append(the_function)
+        retorno=ScsrAO(*functions)
+        retorno.is_composite=not same_game
+        if same_game:
+            retorno.game=the_game
+        if same_user:
+            retorno.user=the_user
+        return retorno
+
     #TODO: TEST
     # Unlike __radd__, where the other can be 0 (used for sum), __add__ demands an argument.
     def __add__(self,other):
@@ -398,7 +522,7 @@ class ScsrAO(abc.MutableSet):
             for other in others:
                 if not isinstance(other,ScsrAO):
                     raise TypeError("ERROR: Trying to sum two different, non related objects")
-            accum=sum(others)
+            accum=ScsrAO.aggregate(others)
         else:
             accum=others
         return {
@@ -498,49 +622,53 @@ class ScsrAO(abc.MutableSet):
 
     #TODO: TEST
     def save(self):
-        """ Persists the persuasive function data.
+        """ Persists the scsr data.
             This persistence is given the following form:
-            1 - The function must not have unassigned elements
-            2 - Each behavior is saved. If one incurs error, the others are not saved. the function is not saved.
-                2.1 - If behaviors are saved, and error occurs afterwards, ok. The behavior data persistence is valid, but the function is not.
-            3 - The function is saved.
+            1 - The functions must not have unassigned elements and every behavior must be valid. If not, nothing is saved.
+            2 - All the behaviors are saved in bulk (see BehaviorDB.__persist_many__), each one generating its BehaviorDiffDB.
+            3 - The ScsrDiffDB referencing the behavior diffs is created and appended to the scsr history.
+            The whole process costs a fixed number of round trips to the database, whatever the number of elements.
         
         Raises:
             TypeError -- Behavior must have the type defined and of specific value
             TypeError -- All objects in the set must be of ElementAO type and persisted. I.e.: Have a valid external_id
         """
-        saved=None
         errorType,msg = self.check_save()
         if errorType:
             raise errorType(msg)
-        pers=self.persuasive_function
-        aest=self.aesthetic_function
-        orch=self.orchestration_function
-        reif=self.reification_function
-        try:
-            #save the behaviors
-            self.persuasive_function.save()
-            self.aesthetic_function.save()
-            self.orchestration_function.save()
-            self.reification_function.save()
-        except:
-            if self.persuasive_function!=pers:
-                self.persuasive_function=pers
-            if self.aesthetic_function!=aest:
-                self.aesthetic_function=aest
-            if self.orchestration_function!=orch:
-                self.orchestration_function=orch
-            if self.reification_function!=reif:
-                self.reification_function=reif
-            raise RuntimeError("ERROR: Some of the  functions  were not saved. ")
-        #try saving the function
+        for function_key,attribute,behaviors in SCSR_LAYOUT:
+            the_function=getattr(self,attribute)
+            if len(the_function.unassigned_element)>0:
+                raise RuntimeError("ERROR: Function must not have unassigned elements! - "+function_key)
+            for behavior in behaviors:
+                errorType,msg = getattr(the_function,behavior).check_save()
+                if errorType:
+                    raise errorType(msg)
         try:
-            saved=PersuasiveFunctionDB.__persist__(self)
-        except:
+            saved=ScsrDB.__persist_bulk__(self)
+        except (TypeError,RuntimeError):
+            raise
+        except Exception:
             raise RuntimeError("ERROR: Not able to save the SCSR: "+self.external_id)
-        if(saved):
-            self.history=[the_diff.to_obj() for the_diff in saved.history]
-    
+        self.date_modified=saved.date_modified
+        the_diff=ScsrDiffAO()
+        the_diff.external_id=saved.history[-1].external_id
+        the_diff.date_modified=saved.history[-1].date_modified
+        the_diff.coded_scsr={
+            function_key:{behavior:getattr(getattr(self,attribute),behavior).diffdata[-1] for behavior in behaviors}
+            for function_key,attribute,behaviors in SCSR_LAYOUT
+        }
+        self.history.append(the_diff)
+        return self
+
+    def quantify(self):
+        """ Returns the quantification of the elements by function and behavior (see BehaviorAO.quantify)
+        
+        Returns:
+            dict -- {function: {behavior: [{"element": ElementDB, "count": int}]}}
+        """
+        return {function_key:getattr(self,attribute).quantify() for function_key,attribute,behaviors in SCSR_LAYOUT}
+
     #TODO: TEST
     def copy(self):
         to_ret=ScsrAO(self.persuasive_function.copy(),self.aesthetic_function.copy(), self.orchestration_function.copy(), self.reification_function.copy())
@@ -630,6 +758,15 @@ class ScsrDB(db.Document):
     date_creation = db.DateTimeField(db_field="date_creation", required=True, default=datetime.utcnow) # pylint: disable=no-member
     date_modified = db.DateTimeField(db_field="date_modified", required=True, default=datetime.utcnow) # pylint: disable=no-member
 
+    meta = {
+        "indexes": ["external_id", ("game", "user"), "user"]
+    }
+
+    # scsrs read per round trip by the streaming consolidation (iter_behavior_elements). Set from the CONSOLIDATION_BATCH_SIZE config
+    CONSOLIDATION_BATCH_SIZE = 500
+    # scsrs read per round trip by the compaction (compact_history)
+    COMPACTION_BATCH_SIZE = 500
+
     def __repr__(self):
         retorno="external_id: "+self.external_id if self.external_id else "None**"
         retorno="\nUser: "+self.user
@@ -690,8 +827,28 @@ class ScsrDB(db.Document):
         history.save()
         to_persist.history.append(history)
         to_persist.save()
+        ScsrDB.__stamp_behaviors__(game,{
+            function_key:[getattr(getattr(to_persist,attribute),behavior).id for behavior in behaviors]
+            for function_key,attribute,behaviors in SCSR_LAYOUT
+        })
+        ConsolidatedScsrDB.__count_assessment__(game)
         return to_persist
 
+    @staticmethod
+    def __stamp_behaviors__(game,behavior_ids):
+        """ Sets the game and the function of the behaviors, so their diffs are counted in the consolidated counters of the game.
+            When a behavior was not stamped yet, the version of the consolidated data is incremented: a save of it that
+            was disregarded (no game) before the stamp makes a rebuild reading it meanwhile read it again.
+
+        Arguments:
+            game {GameDB} -- The game the behaviors belong to
+            behavior_ids {dict} -- {function key: [BehaviorDB ids]}
+        """
+        the_updates=[UpdateMany({"_id":{"$in":the_ids},"$or":[{"game":{"$ne":game.id}},{"function":{"$ne":function_key}}]},
+            {"$set":{"game":game.id,"function":function_key}}) for function_key,the_ids in behavior_ids.items() if the_ids]
+        if the_updates and BehaviorDB._get_collection().bulk_write(the_updates, ordered=False).modified_count:
+            ConsolidatedScsrDB._get_collection().update_one({"_id":game.id},{"$inc":{"version":1}})
+
     #TODO: Verifiy
     @staticmethod
     def __persist__(scao):
@@ -742,6 +899,265 @@ class ScsrDB(db.Document):
         finally:
             return to_save
 
+    @staticmethod
+    def __persist_bulk__(scao):
+        """ Persists the whole scsr in bulk, keeping the same history semantics of __persist__:
+            every behavior receives its BehaviorDiffDB and the scsr receives a ScsrDiffDB referencing them.
+            Unlike __persist__ it does not depend on the functions being saved beforehand, nor does it reload the structure.
+            The round trips are fixed: 5 for the behaviors (BehaviorDB.__persist_many__, including the consolidated counters),
+            one for each function and one for the scsr. The ScsrDiffDB is created and appended to the history in background
+            (append_scsr_history).
+
+        Arguments:
+            scao {ScsrAO} -- the scsr to persist
+
+        Raises:
+            TypeError -- Argument is not a ScsrAO
+            RuntimeError -- The scsr is not persisted
+
+        Returns:
+            ScsrDB -- A partial ScsrDB (external_id, date_modified and the new history entry only)
+        """
+        if not isinstance(scao,ScsrAO):
+            raise TypeError("ERROR: Argument is not a valid ScsrAO object.")
+        the_behaviors=[]
+        for function_key,attribute,behaviors in SCSR_LAYOUT:
+            the_function=getattr(scao,attribute)
+            the_behaviors+=[getattr(the_function,behavior) for behavior in behaviors]
+        the_diffs=BehaviorDB.__persist_many__(the_behaviors)
+        now=datetime.utcnow()
+        #the four functions share the update date. Their documents are in different collections, so they are updated one by one.
+        for function_key,attribute,behaviors in SCSR_LAYOUT:
+            the_function=getattr(scao,attribute)
+            FUNCTION_DB[function_key]._get_collection().update_one({"external_id":the_function.external_id},{"$set":{"updated":now}})
+            the_function.updated=now
+        result=ScsrDB._get_collection().update_one(
+            {"external_id":scao.external_id},
+            {"$set":{"date_modified":now}})
+        if not result.matched_count:
+            raise RuntimeError("ERROR: Unable to retrieve reference to persist - ScsrDB - "+str(scao.external_id))
+        #the history entry is built in background (append_scsr_history). Its ids are set here, so the caller already knows them
+        history=ScsrDiffDB(id=ObjectId(), external_id=str(uuid4()), date_modified=now)
+        coded_ids={
+            function_key:{behavior:str(the_diffs[getattr(getattr(scao,attribute),behavior).external_id].id) for behavior in behaviors}
+            for function_key,attribute,behaviors in SCSR_LAYOUT
+        }
+        append_scsr_history.enqueue("scsr_history:"+history.external_id,scao.external_id,str(history.id),history.external_id,now.strftime(DATE_FORMAT),coded_ids)
+        retorno=ScsrDB(external_id=scao.external_id, date_modified=now)
+        retorno.history=[history]
+        return retorno
+
+    @staticmethod
+    def quantify_game(gdbo):
+        """ Quantifies the elements of every scsr of the game, by function and behavior, with a single aggregation (see BehaviorDB.quantify)
+
+        Arguments:
+            gdbo {GameDB} -- The game
+
+        Returns:
+            dict -- {function: {behavior: [{"element": ElementDB, "count": int}]}}
+        """
+        if not isinstance(gdbo,GameDB):
+            raise TypeError("ERROR: Invalid type for the game  data.")
+        return BehaviorDB.quantify({"game":gdbo.id})
+
+    @staticmethod
+    def iter_behavior_elements(query, batch_size=None):
+        """ Streams the elements of the behaviors of the scsrs matching the query, without loading the scsrs
+            (no history, user, game or application objects): the scsrs are read from a projected cursor, batch_size at a time,
+            and each batch resolves its functions and behaviors with one query per collection (ids only).
+
+        Arguments:
+            query {dict} -- The (raw) query on the scsr collection. Ex.: {"game": game.id}
+
+        Keyword Arguments:
+            batch_size {int} -- The scsrs per batch (default: {CONSOLIDATION_BATCH_SIZE})
+
+        Yields:
+            tuple -- (scsr id, function key, behavior, behavior id, [element ids])
+        """
+        batch_size=batch_size or ScsrDB.CONSOLIDATION_BATCH_SIZE
+        cursor=ScsrDB._get_collection().find(query,{function_key:1 for function_key,attribute,behaviors in SCSR_LAYOUT}).batch_size(batch_size)
+        batch=[]
+        for scsr_doc in cursor:
+            batch.append(scsr_doc)
+            if len(batch)>=batch_size:
+                for item in ScsrDB.__batch_behavior_elements__(batch):
+                    yield item
+                batch=[]
+        for item in ScsrDB.__batch_behavior_elements__(batch):
+            yield item
+
+    @staticmethod
+    def __batch_behavior_elements__(scsr_docs):
+        """ Resolves the behavior elements of a batch of (projected) scsr documents: see iter_behavior_elements """
+        if not scsr_docs:
+            return
+        slots={}
+        for function_key,attribute,behaviors in SCSR_LAYOUT:
+            owners={doc[function_key]:doc["_id"] for doc in scsr_docs if doc.get(function_key)}
+            if not owners:
+                continue
+            for function_doc in FUNCTION_DB[function_key]._get_collection().find({"_id":{"$in":list(owners)}},{behavior:1 for behavior in behaviors}):
+                for behavior in behaviors:
+                    if function_doc.get(behavior):
+                        slots[function_doc[behavior]]=(owners[function_doc["_id"]],function_key,behavior)
+        if not slots:
+            return
+        for behavior_doc in BehaviorDB._get_collection().find({"_id":{"$in":list(slots)}},{"elements":1}):
+            scsr_id,function_key,behavior=slots[behavior_doc["_id"]]
+            yield (scsr_id,function_key,behavior,behavior_doc["_id"],behavior_doc.get("elements",[]))
+
+    @staticmethod
+    def consolidate(query, batch_size=None, on_batch=None):
+        """ Quantifies the elements of the scsrs matching the query by function and behavior, streaming them
+            (iter_behavior_elements): the memory depends on the distinct elements, not on the number of scsrs.
+
+        Arguments:
+            query {dict} -- The (raw) query on the scsr collection
+
+        Keyword Arguments:
+            batch_size {int} -- The scsrs per batch (default: {CONSOLIDATION_BATCH_SIZE})
+            on_batch {callable} -- Called with {function key: [behavior ids]} of every batch of behaviors read (default: {None})
+
+        Returns:
+            tuple -- ({function: {behavior: {element external_id: count}}}, number of scsrs)
+        """
+        batch_size=batch_size or ScsrDB.CONSOLIDATION_BATCH_SIZE
+        counted={(function_key,behavior):Counter() for function_key,attribute,behaviors in SCSR_LAYOUT for behavior in behaviors}
+        pending={}
+        read=0
+        for scsr_id,function_key,behavior,behavior_id,elements in ScsrDB.iter_behavior_elements(query,batch_size):
+            counted[(function_key,behavior)].update(elements)
+            if on_batch:
+                pending.setdefault(function_key,[]).append(behavior_id)
+                read+=1
+                if read>=batch_size:
+                    on_batch(pending)
+                    pending,read={},0
+        if on_batch and pending:
+            on_batch(pending)
+        return ScsrDB.__counters_of__(counted),ScsrDB._get_collection().count_documents(query)
+
+    @staticmethod
+    def __counters_of__(counted):
+        """ Turns the counts by element id into the consolidated counters: the reassigned elements are counted in their
+            canonical ones, and the ids are replaced by the external_ids (one query; the elements removed are dropped).
+
+        Arguments:
+            counted {dict} -- {(function key, behavior): Counter(element id)}
+
+        Returns:
+            dict -- {function: {behavior: {element external_id: count}}}
+        """
+        counted={key:canonical_elements.fold_ids(counter) for key,counter in counted.items()}
+        the_ids=set(oid for counter in counted.values() for oid in counter)
+        external_ids={doc["_id"]:doc["external_id"] for doc in ElementDB._get_collection().find({"_id":{"$in":list(the_ids)}},{"external_id":1})} if the_ids else {} # pylint: disable=protected-access
+        return {
+            function_key:{
+                behavior:{external_ids[oid]:count for oid,count in counted[(function_key,behavior)].items() if oid in external_ids}
+                for behavior in behaviors
+            } for function_key,attribute,behaviors in SCSR_LAYOUT
+        }
+
+    @staticmethod
+    def elements_as_of(external_id, date):
+        """ Rebuilds the elements of the scsr behaviors as they were at the date (see BehaviorSnapshotDB.s_elements_as_of)
+
+        Arguments:
+            external_id {str} -- The scsr external_id
+            date {datetime} -- The moment
+
+        Returns:
+            dict -- {function: {behavior: set(element ids)}}, or None if the scsr did not exist at the date
+        """
+        scsr_doc=ScsrDB._get_collection().find_one({"external_id":external_id,"date_creation":{"$lte":date}},{"_id":1})
+        if not scsr_doc:
+            return None
+        slots={behavior_id:(function_key,behavior) for scsr_id,function_key,behavior,behavior_id,elements in ScsrDB.iter_behavior_elements({"_id":scsr_doc["_id"]})}
+        retorno={function_key:{behavior:set() for behavior in behaviors} for function_key,attribute,behaviors in SCSR_LAYOUT}
+        for behavior_id,elements in BehaviorSnapshotDB.s_elements_as_of(list(slots),date).items():
+            function_key,behavior=slots[behavior_id]
+            retorno[function_key][behavior]=elements
+        return retorno
+
+    @staticmethod
+    def compact_history(query, batch_size=None):
+        """ Compacts the history of the scsrs matching the query: the ScsrDiffDB whose behavior diffs are all empty
+            (a save that changed nothing) are dropped, except the first one (the creation). The dropped diffs and their
+            behavior diffs are deleted, and pulled from the diffdata of the behaviors.
+            The diffdata of the behaviors is then compacted by BehaviorDB.compact_history (the manage.py compact_history
+            command runs both). A scsr saved while compacted is skipped: compact it again later.
+
+        Arguments:
+            query {dict} -- The (raw) query on the scsr collection. Ex.: {"game": game.id}
+
+        Keyword Arguments:
+            batch_size {int} -- The scsrs per batch (default: {COMPACTION_BATCH_SIZE})
+
+        Returns:
+            dict -- {"scsrs": compacted, "dropped": scsr diffs dropped, "skipped": scsrs changed meanwhile}
+        """
+        batch_size=batch_size or ScsrDB.COMPACTION_BATCH_SIZE
+        stats={"scsrs":0,"dropped":0,"skipped":0}
+        projection={function_key:1 for function_key,attribute,behaviors in SCSR_LAYOUT}
+        projection["history"]=1
+        batch=[]
+        for scsr_doc in ScsrDB._get_collection().find(query,projection).batch_size(batch_size):
+            batch.append(scsr_doc)
+            if len(batch)>=batch_size:
+                ScsrDB.__compact_batch__(batch,stats)
+                batch=[]
+        ScsrDB.__compact_batch__(batch,stats)
+        return stats
+
+    @staticmethod
+    def __compact_batch__(scsr_docs, stats):
+        """ Compacts a batch of (projected) scsr documents: see compact_history """
+        if not scsr_docs:
+            return
+        the_diffs={doc["_id"]:doc for doc in ScsrDiffDB._get_collection().find( # pylint: disable=protected-access
+            {"_id":{"$in":[diff_id for doc in scsr_docs for diff_id in doc.get("history",[])]}},{"coded_scsr":1})}
+        coded={diff_id:[ScsrDiffAO.__ref_id__(ref) for behaviors in doc.get("coded_scsr",{}).values() for ref in behaviors.values()]
+            for diff_id,doc in the_diffs.items()}
+        changed=set(doc["_id"] for doc in BehaviorDiffDB._get_collection().find( # pylint: disable=protected-access
+            {"_id":{"$in":[behavior_diff for behavior_diffs in coded.values() for behavior_diff in behavior_diffs]},
+            "$or":[{"elements_added.0":{"$exists":True}},{"elements_removed.0":{"$exists":True}}]},{"_id":1}))
+        the_writes=[]
+        for scsr_doc in scsr_docs:
+            chain=scsr_doc.get("history",[])
+            kept=[diff_id for position,diff_id in enumerate(chain) if diff_id in the_diffs and (position==0 or
+                any(behavior_diff in changed for behavior_diff in coded[diff_id]))]
+            if len(kept)<len(chain):
+                the_writes.append((scsr_doc["_id"],chain,kept))
+        scsr_collection=ScsrDB._get_collection()
+        compacted=set()
+        if the_writes:
+            result=scsr_collection.bulk_write([UpdateOne({"_id":scsr_id,"history":chain},{"$set":{"history":kept}})
+                for scsr_id,chain,kept in the_writes], ordered=False)
+            compacted=set(scsr_id for scsr_id,chain,kept in the_writes)
+            if result.matched_count<len(the_writes):
+                #the scsrs saved meanwhile do not hold the compacted history
+                expected={scsr_id:kept for scsr_id,chain,kept in the_writes}
+                compacted=set(doc["_id"] for doc in scsr_collection.find({"_id":{"$in":list(compacted)}},{"history":1})
+                    if doc.get("history",[])==expected[doc["_id"]])
+        dropped=[]
+        for scsr_id,chain,kept in the_writes:
+            if scsr_id in compacted:
+                kept_set=set(kept)
+                dropped.extend(diff_id for diff_id in chain if diff_id not in kept_set)
+        stats["scsrs"]+=len(scsr_docs)-len(the_writes)+len(compacted)
+        stats["skipped"]+=len(the_writes)-len(compacted)
+        stats["dropped"]+=len(dropped)
+        if not dropped:
+            return
+        behavior_diffs=[behavior_diff for diff_id in dropped if diff_id in coded for behavior_diff in coded[diff_id]]
+        behavior_ids=[behavior_id for scsr_id,function_key,behavior,behavior_id,elements in
+            ScsrDB.__batch_behavior_elements__([doc for doc in scsr_docs if doc["_id"] in compacted])]
+        BehaviorDB._get_collection().update_many({"_id":{"$in":behavior_ids}},{"$pull":{"diffdata":{"$in":behavior_diffs}}}) # pylint: disable=protected-access
+        BehaviorDiffDB._get_collection().delete_many({"_id":{"$in":behavior_diffs}}) # pylint: disable=protected-access
+        ScsrDiffDB._get_collection().delete_many({"_id":{"$in":dropped}}) # pylint: disable=protected-access
+
     @staticmethod
     def get_scsr(eid):
         if not isinstance(eid,str):
@@ -793,10 +1209,10 @@ class ScsrDB(db.Document):
 
     @staticmethod
     def get_scsr_list_by_genre(gdbo):
-        if not isinstance(gdbo,GameDB):
-            raise TypeError("ERROR: Invalid type for the game  data.")
-        the_games=GamesGenresDB.seek_genre(gdbo)
-        the_data=ScsrDB.objects.filter(game__in=the_games.gamesList) # pylint: disable=no-member
+        if not isinstance(gdbo,GenreDB):
+            raise TypeError("ERROR: Invalid type for the genre data.")
+        the_games=GamesGenresDB.s_games_sets([gdbo])[gdbo.pk]
+        the_data=ScsrDB.objects.filter(game__in=list(the_games.games)) # pylint: disable=no-member
         return the_data
 
     @classmethod
@@ -814,99 +1230,218 @@ class ScsrDB(db.Document):
 
 
 signals.pre_save.connect(ScsrDB.pre_save, sender=ScsrDB)
+index_registry.declare(ScsrDB,
+    probes=[
+        ("get_scsr", {"external_id": "probe"}),
+        ("get_scsr_list_by_game", {"game": ObjectId()}),
+        ("get_scsr_list_by_user", {"user": ObjectId()}),
+        ("get_scsr_list_by_game_and_users", {"game": ObjectId(), "user": {"$in": [ObjectId()]}}),
+        ("get_scsr_list_by_genre", {"game": {"$in": [ObjectId()]}})
+    ])
+
+FUNCTION_DB = {
+    "persuasive": PersuasiveFunctionDB,
+    "aesthetic": AestheticFunctionDB,
+    "orchestration": OrchestrationFunctionDB,
+    "reification": ReificationFunctionDB
+}
+for the_function_db in FUNCTION_DB.values():
+    index_registry.declare(the_function_db, probes=[("__get_persisted__", {"external_id": "probe"})])
 
 
 class ConsolidatedScsrDB(db.Document):
+    """ The consolidated (quantified) structural representation of a game.
+        The counters are kept up to date at write time: every behavior diff increments (added) or decrements (removed)
+        the count of the element in the function/behavior of the game. Reading it is a single indexed query.
+        The counters are of the form:
+        {
+            "persuasive":{"interactivity":{element_external_id:qtt}...}
+            ...
+        }
+        Games assessed before the counters existed (counted False) are computed once from their current scsrs (see __rebuild__).
+        Every write to the counters or assessments increments version: a rebuild only replaces the counters if the version
+        did not change while it read the scsrs. Their date_modified is the database clock ($currentDate), not the one of
+        the application server writing them (see scsr.similarity).
+    """
     game = db.ReferenceField(GameDB, db_field="db_game", required=True, primary_key=True)  # pylint: disable=no-member
+    external_id = db.StringField(db_field="external_id") # pylint: disable=no-member
+    game_external_id = db.StringField(db_field="game_external_id") # pylint: disable=no-member
     assessments = db.IntField(db_field="assessments", required=True, default=1) # pylint: disable=no-member
+    counters = db.DictField(db_field="counters", default={}) # pylint: disable=no-member
+    counted = db.BooleanField(db_field="counted", default=False) # pylint: disable=no-member
+    version = db.IntField(db_field="version", default=0) # pylint: disable=no-member
     date_creation = db.DateTimeField(db_field="date_creation", required=True, default=datetime.utcnow) # pylint: disable=no-member
     date_modified = db.DateTimeField(db_field="date_modified", required=True, default=datetime.utcnow) # pylint: disable=no-member
-    """History will store the dict with the quantified data in the following form: [{
+    """History stored the dict with the quantified data in the following form: [{
         "persuasive":{"interactivity":{element_id:qtt}...}
         }]
+        It is no longer appended (the counters are kept at write time, see __apply_diffs__): kept for the data stored before.
     """
 
     history = db.ListField(db_field="history", required = True, default=[]) # pylint: disable=no-member
 
+    meta = {
+        "indexes": ["game_external_id"]
+    }
+
+    # reads of a rebuild whose consolidated data changed meanwhile, before giving up (see __rebuild__)
+    REBUILD_ATTEMPTS = 5
+
     @staticmethod
     def get_consolidated(game):
         if not isinstance(game,GameAO):
             raise TypeError("ERROR: Argument is not a valid GameAO")
-        do_have=ConsolidatedScsrDB.objects.filter(game=game.__get_persisted__()).first() # pylint: disable=no-member
-        if do_have:
-            """
-                If the data is less than a week (computed in a weekly basis) and there are data in the history
-            """
-            week=timedelta(days=7)
-            agora=datetime.utcnow()
-            if(agora-do_have.date_modified<week):
-                return do_have.to_json()
-            """
-                Else, create new computation for an existing do_have and assign the history.
-                do_have.date_modified=datetime.utcnow()
-            """
-        else:
-            #there is no do_have, a new one is needed
-            do_have=ConsolidatedScsrDB()
-            do_have.game=game.__get_persisted__()
-            do_have.date_creation=datetime.utcnow()
-        game_scsr_list=ScsrDB.get_scsr_list_by_game(game.__get_persisted__())
-        the_sum=sum(game_scsr_list)
-        the_quant=the_sum.quantify()
-        do_have.history.append(the_quant)
-        do_have.date_modified=datetime.utcnow()
-        do_have.assessments=ScsrDB.objects.filter(game=game.__get_persisted__()).count() # pylint: disable=no-member
-        do_have.save()
-        return do_have
+        do_have=ConsolidatedScsrDB.objects.filter(game_external_id=game.external_id).first() # pylint: disable=no-member
+        if not do_have or not do_have.counted:
+            game_db=game.__get_persisted__()
+            if not game_db:
+                raise RuntimeError("ERROR: Persistent Data not Found or Mismatched.")
+            ConsolidatedScsrDB.__rebuild__(game_db)
+            do_have=ConsolidatedScsrDB.objects.filter(game_external_id=game.external_id).first() # pylint: disable=no-member
+        do_have.__refold__()
+        return do_have.to_json()
 
-    def to_json(self):
-        current=self.history[-1]
-        #the json to be returned is based on a ScsrAO object, only including the quantification data for each element
-        return {
-            "persuasive":{
-                "interactivity":({"element":dado["element"].to_obj().to_json(),"count":dado["count"]} for dado in current['persuasive']['interactivity']),
-                "ludic":({"element":dado["element"].to_obj().to_json(),"count":dado["count"]} for dado in current['persuasive']['ludic']),
-                "gamefication":({"element":dado["element"].to_obj().to_json(),"count":dado["count"]} for dado in current['persuasive']['gamefication'])
-            },
-            "aesthetic":{
-                "interactivity":({"element":dado["element"].to_obj().to_json(),"count":dado["count"]} for dado in current['aesthetic']['interactivity']),
-                "ludic":({"element":dado["element"].to_obj().to_json(),"count":dado["count"]} for dado in current['aesthetic']['ludic'])
-            },
-            "orchestration":{
-                "interactivity":({"element":dado["element"].to_obj().to_json(),"count":dado["count"]} for dado in current['orchestration']['interactivity']),
-                "mechanical":({"element":dado["element"].to_obj().to_json(),"count":dado["count"]} for dado in current['orchestration']['mechanical']),
-                "gamefication":({"element":dado["element"].to_obj().to_json(),"count":dado["count"]} for dado in current['orchestration']['gamefication']),
+    @staticmethod
+    def fold_counters(counters):
+        """ The counters with the reassigned elements counted in their canonical ones (canonical_elements).
+            The counters are folded on read: a process whose canonical elements are not reloaded yet (CANONICAL_ELEMENTS_TTL)
+            may still count a reassigned element after its counts were moved (fold_reassigned_element).
+
+        Arguments:
+            counters {dict} -- {function: {behavior: {element external_id: count}}}
+
+        Returns:
+            dict -- The counters folded, of the same form
+        """
+        return {function_key:{behavior:dict(canonical_elements.fold_external_ids(counted)) for behavior,counted in behaviors.items()}
+            for function_key,behaviors in (counters or {}).items()}
+
+    def __refold__(self):
+        """ Moves again the counts of the reassigned elements counted after they were folded (see fold_counters).
+            One fold task per element and state of the consolidated data: the reads of the same state do not repeat it
+        """
+        stale=set(eid for behaviors in self.counters.values() for counted in behaviors.values() for eid in counted
+            if canonical_elements.canonical_external_id(eid)!=eid)
+        for external_id in stale:
+            fold_reassigned_element.enqueue("fold_element:"+external_id+":"+self.date_modified.isoformat(),external_id)
+
+    @staticmethod
+    def __count_assessment__(game):
+        """ Accounts a new scsr (assessment) for the game, creating the consolidated data if needed.
+
+        Arguments:
+            game {GameDB} -- The game assessed
+        """
+        now=datetime.utcnow()
+        ConsolidatedScsrDB._get_collection().update_one(
+            {"_id":game.id},
+            {
+                "$inc":{"assessments":1,"version":1},
+                "$currentDate":{"date_modified":True},
+                "$setOnInsert":{
+                    "external_id":str(uuid4()),
+                    "game_external_id":game.external_id,
+                    "counters":{},
+                    "counted":False,
+                    "date_creation":now,
+                    "history":[]
+                }
             },
-            "reification":{
-                "interactivity":({"element":dado["element"].to_obj().to_json(),"count":dado["count"]} for dado in current['reification']['interactivity']),
-                "mechanical":({"element":dado["element"].to_obj().to_json(),"count":dado["count"]} for dado in current['reification']['mechanical']),
-                "device":({"element":dado["element"].to_obj().to_json(),"count":dado["count"]} for dado in current['reification']['device'])
+            upsert=True)
+
+    @staticmethod
+    def __apply_diffs__(entries):
+        """ Applies behavior diffs to the counters, with one atomic $inc per game.
+            Entries without game or function (behaviors not belonging to a scsr) are disregarded.
+            The reassigned elements are counted in their canonical ones.
+            The counters are only incremented if the consolidated data of the game already exists, otherwise it will be
+            computed from scratch when first read.
+
+        Arguments:
+            entries {list(tuple)} -- (game id, function, behavior type, added element external_ids, removed element external_ids)
+        """
+        increments={}
+        for game_id,function,behavior_type,added,removed in entries:
+            if not game_id or not function:
+                continue
+            the_inc=increments.setdefault(game_id,Counter())
+            prefix="counters."+function+"."+behavior_type.lower()+"."
+            for eid in added:
+                the_inc[prefix+canonical_elements.canonical_external_id(eid)]+=1
+            for eid in removed:
+                the_inc[prefix+canonical_elements.canonical_external_id(eid)]-=1
+        the_updates=[]
+        for game_id,the_inc in increments.items():
+            the_inc={key:value for key,value in the_inc.items() if value}
+            if the_inc:
+                the_inc["version"]=1
+                the_updates.append(UpdateOne({"_id":game_id},{"$inc":the_inc,"$currentDate":{"date_modified":True}}))
+        if the_updates:
+            ConsolidatedScsrDB._get_collection().bulk_write(the_updates, ordered=False)
+
+    @staticmethod
+    def __rebuild__(game):
+        """ Computes the counters of the game from the current state of its scsrs and marks it as counted (see ScsrDB.consolidate).
+            The behaviors of the game are stamped (game and function), so the following diffs are counted.
+            The counters are replaced only if no diff was applied and no behavior was stamped (version) while the scsrs
+            were read, otherwise they are read again: the diffs applied meanwhile are not lost.
+
+        Arguments:
+            game {GameDB} -- The game to consolidate
+
+        Raises:
+            RuntimeError -- If the consolidated data changed during every one of the REBUILD_ATTEMPTS reads
+        """
+        collection=ConsolidatedScsrDB._get_collection()
+        #created first (not counted), so the stamps and diffs applied during the reads move its version
+        collection.update_one({"_id":game.id},{
+            "$setOnInsert":{
+                "external_id":str(uuid4()),
+                "game_external_id":game.external_id,
+                "assessments":0,
+                "counters":{},
+                "counted":False,
+                "version":0,
+                "date_creation":datetime.utcnow(),
+                "date_modified":datetime.utcnow(),
+                "history":[]
             }
-        }
+        },upsert=True)
+        for _ in range(ConsolidatedScsrDB.REBUILD_ATTEMPTS):
+            current=collection.find_one({"_id":game.id},{"version":1})
+            #streamed: the scsrs of the game are read in batches, the behaviors of each batch are stamped as read
+            counters,assessments=ScsrDB.consolidate({"game":game.id},on_batch=lambda stamps: ScsrDB.__stamp_behaviors__(game,stamps))
+            version={"version":current["version"]} if "version" in current else {"version":{"$exists":False}}
+            #not matched if changed meanwhile: read again
+            result=collection.update_one(dict(version,_id=game.id),{
+                "$set":{
+                    "game_external_id":game.external_id,
+                    "counters":counters,
+                    "counted":True,
+                    "assessments":assessments
+                },
+                "$inc":{"version":1},
+                "$currentDate":{"date_modified":True}
+            })
+            if result.matched_count:
+                return
+        raise RuntimeError("ERROR: Consolidated data of the game changing while rebuilt - "+str(game.external_id))
 
-    def history_json(self):
+    def to_json(self):
         #the json to be returned is based on a ScsrAO object, only including the quantification data for each element
-        return [{
-            "persuasive":{
-                "interactivity":({"element":dado["element"].to_obj().to_json(),"count":dado["count"]} for dado in current['persuasive']['interactivity']),
-                "ludic":({"element":dado["element"].to_obj().to_json(),"count":dado["count"]} for dado in current['persuasive']['ludic']),
-                "gamefication":({"element":dado["element"].to_obj().to_json(),"count":dado["count"]} for dado in current['persuasive']['gamefication'])
-            },
-            "aesthetic":{
-                "interactivity":({"element":dado["element"].to_obj().to_json(),"count":dado["count"]} for dado in current['aesthetic']['interactivity']),
-                "ludic":({"element":dado["element"].to_obj().to_json(),"count":dado["count"]} for dado in current['aesthetic']['ludic'])
-            },
-            "orchestration":{
-                "interactivity":({"element":dado["element"].to_obj().to_json(),"count":dado["count"]} for dado in current['orchestration']['interactivity']),
-                "mechanical":({"element":dado["element"].to_obj().to_json(),"count":dado["count"]} for dado in current['orchestration']['mechanical']),
-                "gamefication":({"element":dado["element"].to_obj().to_json(),"count":dado["count"]} for dado in current['orchestration']['gamefication']),
-            },
-            "reification":{
-                "interactivity":({"element":dado["element"].to_obj().to_json(),"count":dado["count"]} for dado in current['reification']['interactivity']),
-                "mechanical":({"element":dado["element"].to_obj().to_json(),"count":dado["count"]} for dado in current['reification']['mechanical']),
-                "device":({"element":dado["element"].to_obj().to_json(),"count":dado["count"]} for dado in current['reification']['device'])
-            }
-        } for current in self.history]
+        counters=ConsolidatedScsrDB.fold_counters(self.counters)
+        the_ids=set(eid for behaviors in counters.values() for counted in behaviors.values() for eid,count in counted.items() if count>0)
+        elements={element.external_id:element.to_obj().to_json() for element in ElementDB.objects.filter(external_id__in=list(the_ids))} if the_ids else {} # pylint: disable=no-member
+        retorno={}
+        for function_key,attribute,behaviors in SCSR_LAYOUT:
+            retorno[function_key]={}
+            for behavior in behaviors:
+                counted=counters.get(function_key,{}).get(behavior,{})
+                retorno[function_key][behavior]=[
+                    {"element":elements[eid],"count":count}
+                    for eid,count in sorted(counted.items(), key=lambda item: -item[1]) if count>0 and eid in elements
+                ]
+        return retorno
 
     @classmethod
     def preSave(cls, sender, document, **kwargs):
@@ -921,6 +1456,68 @@ class ConsolidatedScsrDB(db.Document):
         pass
 
 signals.pre_save.connect(ConsolidatedScsrDB.preSave, sender=ConsolidatedScsrDB)
+index_registry.declare(ConsolidatedScsrDB,
+    probes=[
+        ("get_consolidated", {"game_external_id": "probe"})
+    ])
 
 
+@background_task()
+def append_scsr_history(scsr_id, diff_id, diff_external_id, date_modified, coded_ids):
+    """ Task: creates the ScsrDiffDB of a bulk save (ScsrDB.__persist_bulk__) and appends it to the scsr history.
+        Both steps are idempotent: the diff id is set by the save, and the history keeps its ids sorted (creation order)
+        whatever the order the tasks run.
 
+        Arguments:
+            scsr_id {str} -- The scsr external_id
+            diff_id {str} -- The ObjectId of the ScsrDiffDB
+            diff_external_id {str} -- The external_id of the ScsrDiffDB
+            date_modified {str} -- The date of the save (DATE_FORMAT)
+            coded_ids {dict} -- {function: {behavior: BehaviorDiffDB id}}
+    """
+    the_id=ObjectId(diff_id)
+    if not ScsrDiffDB.objects.filter(id=the_id).first(): # pylint: disable=no-member
+        the_diffs={the_diff.id:the_diff for the_diff in BehaviorDiffDB.objects.filter( # pylint: disable=no-member
+            id__in=[ObjectId(behavior_id) for behaviors in coded_ids.values() for behavior_id in behaviors.values()])}
+        history=ScsrDiffDB(id=the_id, external_id=diff_external_id, date_modified=datetime.strptime(date_modified,DATE_FORMAT))
+        history.coded_scsr={
+            function_key:{behavior:the_diffs[ObjectId(behavior_id)] for behavior,behavior_id in behaviors.items()}
+            for function_key,behaviors in coded_ids.items()
+        }
+        history.save(force_insert=True)
+    result=ScsrDB._get_collection().update_one( # pylint: disable=protected-access
+        {"external_id":scsr_id,"history":{"$ne":the_id}},
+        {"$push":{"history":{"$each":[the_id],"$sort":1}}})
+    if not result.matched_count and not ScsrDB.objects.filter(external_id=scsr_id).first(): # pylint: disable=no-member
+        raise RuntimeError("ERROR: Unable to retrieve reference to persist - ScsrDB - "+str(scsr_id))
+
+
+@background_task()
+def fold_reassigned_element(external_id):
+    """ Task: moves the counts of a reassigned element (ElementDB.reassign) to its canonical element, in the consolidated
+        data of every game. Each game is updated only if its counts of the element did not change since read.
+
+        Arguments:
+            external_id {str} -- The external_id of the reassigned element
+    """
+    canonical=ElementCanonicalDB._get_collection().find_one({"external_id":external_id},{"canonical_external_id":1}) # pylint: disable=protected-access
+    if not canonical:
+        raise RuntimeError("ERROR: Element not reassigned - "+str(external_id))
+    canonical_id=canonical["canonical_external_id"]
+    paths=[("counters."+function_key+"."+behavior+".",function_key,behavior) for function_key,attribute,behaviors in SCSR_LAYOUT for behavior in behaviors]
+    collection=ConsolidatedScsrDB._get_collection()
+    query={"$or":[{prefix+external_id:{"$exists":True}} for prefix,function_key,behavior in paths]}
+    for _ in range(5):
+        changed=0
+        for doc in collection.find(query,{prefix+external_id:1 for prefix,function_key,behavior in paths}):
+            counts={prefix:doc["counters"][function_key][behavior][external_id] for prefix,function_key,behavior in paths
+                if external_id in doc.get("counters",{}).get(function_key,{}).get(behavior,{})}
+            condition={prefix+external_id:count for prefix,count in counts.items()}
+            condition["_id"]=doc["_id"]
+            result=collection.update_one(condition,{
+                "$inc":{prefix+canonical_id:count for prefix,count in counts.items()},
+                "$unset":{prefix+external_id:"" for prefix in counts}})
+            changed+=0 if result.matched_count else 1
+        if not changed:
+            return
+    raise RuntimeError("ERROR: Counts of "+str(external_id)+" changing while folded")
@@ -0,0 +1,138 @@
+from collections import Counter
+
+from game.models.game import GameDB, GameAO
+from scsr.models.elements import ElementDB
+from scsr.models.behaviors import BehaviorDB, BehaviorSnapshotDB, BehaviorAO
+from scsr.models.scsr import ScsrDB, ScsrAO, ScsrDiffDB, ScsrDiffAO, ConsolidatedScsrDB, SCSR_LAYOUT, FUNCTION_AO
+from utils import identity_map
+from utils.lazy import LazyList, reference_ids
+
+"""Time travel: the behaviors and scsrs as they were at a date, and the consolidated data of a game at a date.
+
+    The elements of a behavior at a date come from its nearest snapshot and the diffs after it (see
+    BehaviorSnapshotDB.s_elements_as_of): the cost depends on SNAPSHOT_EVERY, not on the size of the history.
+    The histories are in creation order: the entries up to a date, selected by the query, are a prefix of them.
+    The behaviors are resolved in bulk: a scsr costs the same round trips as one behavior, a game is streamed
+    CONSOLIDATION_BATCH_SIZE scsrs at a time.
+"""
+
+
+def behaviors_as_of(behavior_ids, date):
+    """ Rebuilds the behaviors as they were at the date
+
+        Arguments:
+            behavior_ids {list} -- The ids of the BehaviorDB
+            date {datetime} -- The moment
+
+        Returns:
+            dict -- {behavior id: BehaviorAO}. A behavior created after the date is absent.
+    """
+    the_elements=BehaviorSnapshotDB.s_elements_as_of(behavior_ids,date)
+    if not the_elements:
+        return {}
+    the_ids=set(oid for elements in the_elements.values() for oid in elements)
+    elements={element.pk:element.to_obj() for element in ElementDB.objects(id__in=list(the_ids))} if the_ids else {} # pylint: disable=no-member
+    retorno={}
+    for doc in BehaviorDB._get_collection().find({"_id":{"$in":list(the_elements)}},{"external_id":1,"behavior":1}): # pylint: disable=protected-access
+        behavior=BehaviorAO([elements[oid] for oid in the_elements[doc["_id"]] if oid in elements],doc["behavior"])
+        behavior.external_id=doc["external_id"]
+        behavior.updated=date
+        retorno[doc["_id"]]=behavior
+    return retorno
+
+
+def behavior_as_of(external_id, date):
+    """ Rebuilds the behavior as it was at the date
+
+        Arguments:
+            external_id {str} -- The behavior external_id
+            date {datetime} -- The moment
+
+        Returns:
+            BehaviorAO -- The behavior, or None if it did not exist at the date
+    """
+    behavior_doc=BehaviorDB._get_collection().find_one({"external_id":external_id},{"_id":1}) # pylint: disable=protected-access
+    if not behavior_doc:
+        return None
+    return behaviors_as_of([behavior_doc["_id"]],date).get(behavior_doc["_id"])
+
+
+def scsr_as_of(external_id, date):
+    """ Rebuilds the scsr as it was at the date: its behaviors, and its history up to the date
+
+        Arguments:
+            external_id {str} -- The scsr external_id
+            date {datetime} -- The moment
+
+        Returns:
+            ScsrAO -- The scsr (date_modified is the date of its last save up to the date), or None if it did not exist at the date
+    """
+    scsr=ScsrDB.objects(external_id=external_id,date_creation__lte=date).first() # pylint: disable=no-member
+    if not scsr:
+        return None
+    slots={behavior_id:(function_key,behavior) for scsr_id,function_key,behavior,behavior_id,elements in ScsrDB.iter_behavior_elements({"_id":scsr.pk})}
+    the_behaviors={(function_key,behavior):BehaviorAO() for function_key,attribute,behaviors in SCSR_LAYOUT for behavior in behaviors}
+    for behavior_id,behavior_ao in behaviors_as_of(list(slots),date).items():
+        the_behaviors[slots[behavior_id]]=behavior_ao
+    retorno=ScsrAO(*[
+        FUNCTION_AO[function_key](*[the_behaviors[(function_key,behavior)] for behavior in FUNCTION_AO[function_key].BEHAVIORS])
+        for function_key,attribute,behaviors in SCSR_LAYOUT])
+    retorno.external_id=scsr.external_id
+    retorno.user=identity_map.reference(scsr,"user","UserDB")
+    retorno.game=identity_map.reference(scsr,"game","GameDB")
+    history=reference_ids(scsr,"history")
+    dates={doc["_id"]:doc["date_modified"] for doc in ScsrDiffDB._get_collection().find({"_id":{"$in":history},"date_modified":{"$lte":date}},{"date_modified":1})} # pylint: disable=protected-access
+    history=[diff_id for diff_id in history if diff_id in dates]
+    retorno.history=LazyList(history,ScsrDiffAO.s_load)
+    retorno.date_creation=scsr.date_creation
+    retorno.date_modified=dates[history[-1]] if history else scsr.date_creation
+    return retorno
+
+
+def consolidated_as_of(game, date, batch_size=None):
+    """ Quantifies the elements of the scsrs of the game as they were at the date (see ScsrDB.consolidate).
+        The scsrs are streamed: the behaviors of each batch are rebuilt together.
+
+        Arguments:
+            game {GameDB} -- The game
+            date {datetime} -- The moment
+
+        Keyword Arguments:
+            batch_size {int} -- The behaviors rebuilt at once (default: {CONSOLIDATION_BATCH_SIZE})
+
+        Returns:
+            tuple -- ({function: {behavior: {element external_id: count}}}, number of scsrs at the date)
+    """
+    if not isinstance(game,GameDB):
+        raise TypeError("ERROR: Invalid type for the game  data.")
+    batch_size=batch_size or ScsrDB.CONSOLIDATION_BATCH_SIZE
+    query={"game":game.id,"date_creation":{"$lte":date}}
+    counted={(function_key,behavior):Counter() for function_key,attribute,behaviors in SCSR_LAYOUT for behavior in behaviors}
+    slots={}
+    def flush():
+        for behavior_id,elements in BehaviorSnapshotDB.s_elements_as_of(list(slots),date).items():
+            counted[slots[behavior_id]].update(elements)
+        slots.clear()
+    for scsr_id,function_key,behavior,behavior_id,elements in ScsrDB.iter_behavior_elements(query,batch_size):
+        slots[behavior_id]=(function_key,behavior)
+        if len(slots)>=batch_size:
+            flush()
+    flush()
+    return ScsrDB.__counters_of__(counted),ScsrDB._get_collection().count_documents(query) # pylint: disable=protected-access
+
+
+def get_consolidated_as_of(game, date):
+    """ The consolidated data of the game at the date, in the form of ConsolidatedScsrDB.get_consolidated
+
+        Arguments:
+            game {GameAO} -- The game
+            date {datetime} -- The moment
+    """
+    if not isinstance(game,GameAO):
+        raise TypeError("ERROR: Argument is not a valid GameAO")
+    game_db=game.__get_persisted__()
+    if not game_db:
+        raise RuntimeError("ERROR: Persistent Data not Found or Mismatched.")
+    counters,assessments=consolidated_as_of(game_db,date)
+    #not saved: only renders the counters
+    return ConsolidatedScsrDB(game=game_db, game_external_id=game_db.external_id, counters=counters, assessments=assessments, counted=True).to_json()
@@ -1,8 +1,10 @@
 import json
 import unittest
+from unittest import mock
 from mongoengine.connection import _get_db
 from scsr.models.elements import ElementAO, ElementDB, ElementReferenceDB, ElementReferenceAO, ElementGameMappingAO, ElementGameMappingDB
-from scsr.models.behaviors import BehaviorAO, BehaviorDB
+from datetime import datetime
+from scsr.models.behaviors import BehaviorAO, BehaviorDB, BehaviorDiffDB, BehaviorSnapshotDB
 from application import ScsrAPP
 from settings import MONGODB_HOST
 class BehaviorModelTest(unittest.TestCase):
@@ -330,3 +332,228 @@ class BehaviorModelTest(unittest.TestCase):
         assert bdiff.behavior_type == "composed"
         self.assertRaises(TypeError,behMec.difference_update,behLud)
         
+
+    def test_13(self):
+        """ Persist a batch of behaviors at once
+            Validation: each behavior gets one more diff, with the right added/removed elements
+            Validation: Database elements match the application objects
+        """
+        print("test_13")
+        beh1=BehaviorAO.get_behavior(self.eid1)
+        behMec=BehaviorAO.get_behavior(self.eidMech)
+        diffs1=len(beh1.diffdata)
+        diffsMec=len(behMec.diffdata)
+        removed=list(beh1.elements)[0]
+        beh1.discard(removed)
+        beh1.add(self.elAO[43])
+        behMec.add(self.elAO[44])
+        the_diffs=BehaviorDB.__persist_many__([beh1,behMec])
+        assert len(the_diffs)==2
+        assert len(beh1.diffdata)==diffs1+1
+        assert len(behMec.diffdata)==diffsMec+1
+        assert beh1.diffdata[-1]["diff"]["removed"]=={removed}
+        assert beh1.diffdata[-1]["diff"]["added"]=={self.elAO[43]}
+        assert behMec.diffdata[-1]["diff"]["added"]=={self.elAO[44]}
+        stored1=BehaviorAO.get_behavior(self.eid1)
+        storedMec=BehaviorAO.get_behavior(self.eidMech)
+        assert stored1.elements==beh1.elements
+        assert storedMec.elements==behMec.elements
+        assert len(stored1.diffdata)==diffs1+1
+
+    def test_14(self):
+        """ Quantify the persisted behaviors (aggregation) and the application objects
+            Validation: elements present in both ludic behaviors count 2, the others 1
+        """
+        print("test_14")
+        beh1=BehaviorAO.get_behavior(self.eid1)
+        beh2=BehaviorAO.get_behavior(self.eid2)
+        quantified=BehaviorDB.quantify({"external_id":{"$in":[self.eid1,self.eid2]}})
+        counted={dado["element"].external_id:dado["count"] for dado in quantified[None]["ludic"]}
+        for el in (beh1|beh2).elements:
+            expected=2 if (el in beh1 and el in beh2) else 1
+            assert counted[el.external_id]==expected
+        summed=beh1+beh2
+        for dado in summed.quantify():
+            assert dado["count"]==summed.element_count.count(dado["element"].to_obj())
+
+    def test_15(self):
+        """ Aggregate many behaviors in one pass
+            Validation: the same elements and counts of the pairwise sum
+            Validation: mixed types are composed
+        """
+        print("test_15")
+        beh1=BehaviorAO.get_behavior(self.eid1)
+        beh2=BehaviorAO.get_behavior(self.eid2)
+        behMec=BehaviorAO.get_behavior(self.eidMech)
+        summed=beh1+beh2+beh1
+        aggregated=BehaviorAO.aggregate(iter([beh1,beh2,beh1]))
+        assert aggregated.behavior_type=="LUDIC"
+        assert aggregated.elements==summed.elements
+        assert sorted(el.external_id for el in aggregated.element_count)==sorted(el.external_id for el in summed.element_count)
+        assert {dado["element"].external_id:dado["count"] for dado in aggregated.quantify()}=={dado["element"].external_id:dado["count"] for dado in summed.quantify()}
+        assert BehaviorAO.aggregate([beh1,behMec]).behavior_type=="composed"
+        assert len(BehaviorAO.aggregate([]))==0
+
+    def test_16(self):
+        """ Snapshots, compaction and the behavior at a date
+            Validation: the elements at each save are rebuilt, before and after the compaction
+            Validation: the empty diffs are dropped, the creation diff is kept
+        """
+        print("test_16")
+        every=BehaviorSnapshotDB.EVERY
+        BehaviorSnapshotDB.EVERY=3
+        try:
+            beh=BehaviorAO.create_behavior("DEVICE")
+            marks=[]
+            for position in range(8):
+                if position%2:
+                    beh.add(self.elAO[position])
+                beh.save()
+                marks.append((datetime.utcnow(),set(el.external_id for el in beh.elements)))
+            db_obj=BehaviorDB.objects.filter(external_id=beh.external_id).first() # pylint: disable=no-member
+            as_ids=lambda the_ids: set(el.external_id for el in ElementDB.objects.filter(id__in=list(the_ids))) # pylint: disable=no-member
+            def check():
+                for date,elements in marks:
+                    assert as_ids(BehaviorSnapshotDB.s_elements_as_of([db_obj.id],date)[db_obj.id])==elements
+            check()
+            stats=BehaviorDB.compact_history({"_id":db_obj.id})
+            assert stats["dropped"]==4
+            assert len(BehaviorDB.objects.filter(id=db_obj.id).first().diffdata)==5 # pylint: disable=no-member
+            check()
+        finally:
+            BehaviorSnapshotDB.EVERY=every
+
+    def test_17(self):
+        """ The behavior at a date (time travel)
+            Validation: the elements and external_id at each save; None before the creation
+        """
+        print("test_17")
+        from scsr.models import temporal
+        beh=BehaviorAO.create_behavior("MECHANICAL")
+        marks=[]
+        for position in range(5):
+            beh.add(self.elAO[position+10])
+            beh.save()
+            marks.append((datetime.utcnow(),beh.elements))
+        for date,elements in marks:
+            rebuilt=temporal.behavior_as_of(beh.external_id,date)
+            assert rebuilt.external_id==beh.external_id
+            assert rebuilt.elements==elements
+        assert temporal.behavior_as_of(beh.external_id,datetime(2000,1,1)) is None
+
+    def test_18(self):
+        """ Concurrent saves of the same behavior
+            Validation: a save landing after the elements were read is not overwritten: the diff is computed again
+            Validation: the history replays to the elements stored
+        """
+        print("test_18")
+        beh=BehaviorAO.create_behavior("LUDIC")
+        beh.add(self.elAO[20])
+        beh.save()
+        first=BehaviorAO.get_behavior(beh.external_id)
+        second=BehaviorAO.get_behavior(beh.external_id)
+        first.add(self.elAO[21])
+        second.add(self.elAO[22])
+        collection=BehaviorDiffDB._get_collection
+        saved=[]
+        def concurrent():
+            if not saved:
+                #saved after the first read the elements, before it writes them
+                saved.append(True)
+                BehaviorDB.__persist_many__([second])
+            return collection()
+        with mock.patch.object(BehaviorDiffDB,"_get_collection",side_effect=concurrent):
+            the_diff=BehaviorDB.__persist_many__([first])[first.external_id]
+        assert [el.external_id for el in the_diff.elements_added]==[self.elAO[21].external_id]
+        assert [el.external_id for el in the_diff.elements_removed]==[self.elAO[22].external_id]
+        db_obj=BehaviorDB.objects.filter(external_id=beh.external_id).first() # pylint: disable=no-member
+        assert set(el.external_id for el in db_obj.elements)==set([self.elAO[20].external_id,self.elAO[21].external_id])
+        assert BehaviorSnapshotDB.s_elements_as_of([db_obj.id],datetime.utcnow())[db_obj.id]==set(el.id for el in db_obj.elements)
+
+
+class BehaviorSetTest(unittest.TestCase):
+    """ The set operations of the behaviors (bitsets of the interned elements), without the database """
+
+    @staticmethod
+    def element(external_id, name):
+        element=ElementAO()
+        element.external_id=external_id
+        element.element={"en":name}
+        return element
+
+    def setUp(self):
+        self.els=[self.element("set-el-"+str(index),"name"+str(index)) for index in range(6)]
+        self.beh1=BehaviorAO([self.els[index] for index in [0,1,2,3]],"LUDIC")
+        self.beh2=BehaviorAO([self.els[index] for index in [2,3,4]],"LUDIC")
+
+    def ids(self, behavior):
+        return set(element.external_id for element in behavior)
+
+    def test_01_operations(self):
+        """ |, &, ^ and - give the elements of the set operations, with their lengths """
+        expected={
+            "or":(self.beh1 | self.beh2, [0,1,2,3,4]),
+            "and":(self.beh1 & self.beh2, [2,3]),
+            "xor":(self.beh1 ^ self.beh2, [0,1,4]),
+            "sub":(self.beh1 - self.beh2, [0,1]),
+            "rsub":(self.beh2 - self.beh1, [4])
+        }
+        for name,(behavior,indexes) in expected.items():
+            assert self.ids(behavior)==set(self.els[index].external_id for index in indexes), name
+            assert len(behavior)==len(indexes), name
+            assert behavior.behavior_type=="LUDIC"
+        assert (self.beh1 | BehaviorAO([self.els[5]],"MECHANICAL")).behavior_type=="composed"
+        assert self.beh1.isdisjoint([self.els[4],self.els[5]]) and not self.beh1.isdisjoint([self.els[3]])
+        assert (self.beh1 & self.beh2).issubset(self.beh1)
+        assert self.beh1.issuperset([self.els[0]])
+        assert self.els[5] not in self.beh1 and "not an element" not in self.beh1
+
+    def test_02_mutations(self):
+        """ add, discard, pop and the *_update methods change the elements in place """
+        self.beh1.add(self.els[5])
+        self.beh1.add(self.els[5])
+        assert len(self.beh1)==5 and self.els[5] in self.beh1
+        self.beh1.discard(self.els[0])
+        assert self.els[0] not in self.beh1 and len(self.beh1)==4
+        assert self.els[0].external_id not in [element.external_id for element in self.beh1.element_count]
+        popped=self.beh1.pop()
+        assert popped not in self.beh1 and len(self.beh1)==3
+        self.beh1.intersection_update(self.beh2)
+        assert self.ids(self.beh1)<=set(self.els[index].external_id for index in [2,3])
+        self.beh2.symmetric_difference_update(BehaviorAO([self.els[4],self.els[5]],"LUDIC"))
+        assert self.ids(self.beh2)==set(self.els[index].external_id for index in [2,3,5])
+        self.beh2.clear()
+        assert len(self.beh2)==0 and list(self.beh2)==[]
+
+    def test_03_own_elements(self):
+        """ A behavior keeps its own element objects: another version of the element (same external_id) is the same
+            member, but each behavior iterates to the object it was given
+        """
+        own=self.element("set-el-0","a")
+        other=self.element("set-el-0","a")
+        beh=BehaviorAO([own],"LUDIC")
+        beh_other=BehaviorAO([other],"LUDIC")
+        other.element={"en":"zzz"}
+        assert list(beh)[0] is own and list(beh)[0].element=={"en":"a"}
+        assert other in beh and len(beh | beh_other)==1
+        assert list(beh | beh_other)[0] is own
+        assert list(beh_other | beh)[0] is other
+
+    def test_04_bounded_ids(self):
+        """ The ids of the behaviors no longer alive are reused: the bitsets do not grow with every element ever seen """
+        import gc
+        for index in range(1000):
+            BehaviorAO([self.element("set-gone-"+str(index),"gone")],"LUDIC")
+        gc.collect()
+        fresh=BehaviorAO([self.element("set-fresh-"+str(index),"fresh") for index in range(3)],"LUDIC")
+        assert fresh.bits.bit_length()<=len(self.els)+3
+        assert len(fresh)==3 and len(list(fresh))==3
+
+    def test_05_aggregate(self):
+        """ The aggregate counts every occurrence, with the elements of each behavior """
+        aggregated=BehaviorAO.aggregate([self.beh1,self.beh2,self.beh1])
+        counts={}
+        for element in aggregated.element_count:
+            counts[element.external_id]=counts.get(element.external_id,0)+1
+        assert counts=={"set-el-0":2,"set-el-1":2,"set-el-2":3,"set-el-3":3,"set-el-4":1}
+        assert len(aggregated)==5
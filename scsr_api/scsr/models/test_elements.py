@@ -1,7 +1,9 @@
 import json
 import unittest
+from datetime import datetime
 from mongoengine.connection import _get_db
 from scsr.models.elements import ElementAO, ElementDB, ElementReferenceDB, ElementReferenceAO, ElementGameMappingAO, ElementGameMappingDB
+from scsr.models.elements import ElementCanonicalDB, canonical_elements
 from scsr.models.behaviors import BehaviorAO, BehaviorDB
 from scsr.models.orchestration_function import OrchestrationFunctionAO, OrchestrationFunctionDB
 from application import ScsrAPP
@@ -16,8 +18,7 @@ from settings import MONGODB_HOST
         Creating an element reference
         Updating an element reference
         Retrieving an element reference
-
-    TODO: Tests of reassignments
+        Reassigning elements
 """
 
 class ElementModelTest(unittest.TestCase):
@@ -300,18 +301,60 @@ class ElementModelTest(unittest.TestCase):
         
     ''' def test_element_class_reassign_element(self): '''
     def test_07(self):
-        # TODO: This one is responsibility of the admin Class.
-        #seek element to deprecate (E3)
-        #create element to deprecate (E5)
-        #seek element to assign to (E2)
-        #assign E3, E5 to E2
+        #create the elements to deprecate (E6, E7) and the one to assign to (E8)
+        E6=ElementDB.seek_or_create("pt","Correr")
+        E7=ElementDB.seek_or_create("pt","Corrida")
+        E8=ElementDB.seek_or_create("pt","Corre")
+        #assign E6, E7 to E8
+        assert ElementDB.reassign(E8,E6)
+        assert ElementDB.reassign(E8,E7)
         #check deprecated elements (reassigned_to and active)
+        for deprecated in (E6,E7):
+            the_el=ElementDB.objects.filter(external_id=deprecated.external_id).first() # pylint: disable=no-member
+            assert the_el.reassigned_to.external_id==E8.external_id
+            assert the_el.active is False
+            assert canonical_elements.canonical_external_id(deprecated.external_id)==E8.external_id
         #check reassigned element (reassigned_from)
-        #create element to assign to deprecated
-        #assign
-        #the assigned_to must be the end of the chain, not the deprecated.
-        pass
+        the_el=ElementDB.objects.filter(external_id=E8.external_id).first() # pylint: disable=no-member
+        assert set(el.external_id for el in the_el.reassigned_from)=={E6.external_id,E7.external_id}
+        #create element to assign the current to (E9) and assign
+        E9=ElementDB.seek_or_create("pt","Corredor")
+        assert ElementDB.reassign(E9,the_el)
+        #the canonical element must be the end of the chain, not the deprecated.
+        for deprecated in (E6,E7,E8):
+            assert canonical_elements.canonical_external_id(deprecated.external_id)==E9.external_id
+            assert ElementCanonicalDB.objects.filter(external_id=deprecated.external_id).first().canonical_external_id==E9.external_id # pylint: disable=no-member
+        #an element already reassigned, or a cycle, is refused
+        assert not ElementDB.reassign(E9,E6)
+        assert not ElementDB.reassign(E6,ElementDB.objects.filter(external_id=E9.external_id).first()) # pylint: disable=no-member
+        #the deprecated elements are counted in the canonical one
+        assert canonical_elements.fold_external_ids({E6.external_id:1,E9.external_id:2})=={E9.external_id:3}
 
     
 
-    
\ No newline at end of file
+    
+    def test_08(self):
+        #the application object does not share the names with the persisted one: its memoized hash stays valid
+        the_db=ElementDB.seek_or_create("en","Swim")
+        the_ao=the_db.to_obj()
+        hashed=the_ao.__semi_hash__()
+        the_db.update_element("en","Dive")
+        assert the_ao.element["en"]=="Swim"
+        assert the_ao.__semi_hash__()==hashed
+        assert ElementDB.objects.filter(external_id=the_db.external_id).first().to_obj().element["en"]=="Dive" # pylint: disable=no-member
+
+    def test_09(self):
+        #a reassigned element counted after its counts were folded (stale canonical elements) is folded on read, then again
+        from game.models.game import GameDB
+        from scsr.models.scsr import ConsolidatedScsrDB
+        #recorded in the canonicalization table only: the elements are rendered without their reassignments
+        E6=ElementDB.seek_or_create("pt","Nadar")
+        E9=ElementDB.seek_or_create("pt","Nado")
+        canonical_elements.reassign(E6,E9)
+        game=GameDB.objects.first() # pylint: disable=no-member
+        ConsolidatedScsrDB._get_collection().insert_one({"_id":game.pk,"game_external_id":game.external_id,"counted":True,"assessments":1, # pylint: disable=protected-access
+            "counters":{"persuasive":{"ludic":{E6.external_id:2,E9.external_id:1}}},"date_modified":datetime.utcnow(),"history":[]})
+        consolidated=ConsolidatedScsrDB.get_consolidated(game.to_obj())
+        assert [(list(dado["element"].keys())[0],dado["count"]) for dado in consolidated["persuasive"]["ludic"]]==[(E9.external_id,3)]
+        stored=ConsolidatedScsrDB._get_collection().find_one({"_id":game.pk})["counters"]["persuasive"]["ludic"] # pylint: disable=protected-access
+        assert stored=={E9.external_id:3}
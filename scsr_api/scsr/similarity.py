@@ -0,0 +1,319 @@
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+
+import numpy
+
+from game.models.game import GameDB
+from game.models.genre import GenreDB
+from game.models.user_game_genre import GamesGenresDB
+from scsr.models.elements import ElementDB, canonical_elements
+from scsr.models.scsr import ScsrDB, ConsolidatedScsrDB, SCSR_LAYOUT
+from user.models.user import UserDB
+
+"""Similarity of the games (and of the readings of the users) by the elements assigned to them, over the whole catalog.
+
+    GameElementMatrix keeps the counts of the consolidated data (ConsolidatedScsrDB.counters) as a dense game x element
+    matrix: a row per game, a column per (canonical) element. A view selects the counters summed in the matrix: all of
+    them (collapsed), a function or a behavior of a function. The queries are numpy operations over the whole matrix:
+        cosine -- of the counts
+        jaccard -- of the sets of elements assigned (count > 0)
+    The matrix is refreshed incrementally: only the consolidated data modified since the last refresh is read and
+    its rows replaced. The date_modified are stamped by the database clock, but a write stamped before the last one read
+    may commit after it: each refresh reads again the safety window (seconds) before the last date read.
+    Games never consolidated (counted False) have no row until their consolidated data is read.
+"""
+
+METRICS = ("cosine", "jaccard")
+
+
+def _check_metric(metric):
+    if metric not in METRICS:
+        raise ValueError("ERROR: Unknown metric: "+str(metric)+". Use one of "+", ".join(METRICS))
+
+
+def similarities(matrix, vector, metric="cosine"):
+    """ Returns the similarity of each row of the matrix to the vector (0 for an empty row or vector)
+
+        Arguments:
+            matrix {numpy.ndarray} -- rows x columns
+            vector {numpy.ndarray} -- columns
+
+        Keyword Arguments:
+            metric {str} -- "cosine" or "jaccard" (default: {"cosine"})
+    """
+    _check_metric(metric)
+    retorno=numpy.zeros(matrix.shape[0])
+    if metric=="cosine":
+        dots=matrix@vector
+        norms=numpy.sqrt(numpy.einsum("ij,ij->i",matrix,matrix))*numpy.sqrt(vector@vector)
+        return numpy.divide(dots,norms,out=retorno,where=norms>0)
+    present=(matrix>0).astype(numpy.float32)
+    assigned=(vector>0).astype(numpy.float32)
+    intersections=present@assigned
+    unions=present.sum(axis=1)+assigned.sum()-intersections
+    return numpy.divide(intersections,unions,out=retorno,where=unions>0)
+
+
+def pairwise(matrix, metric="cosine"):
+    """ Returns the rows x rows similarities of the rows of the matrix (0 between empty rows) """
+    _check_metric(metric)
+    retorno=numpy.zeros((matrix.shape[0],matrix.shape[0]))
+    if metric=="cosine":
+        norms=numpy.sqrt(numpy.einsum("ij,ij->i",matrix,matrix))
+        return numpy.divide(matrix@matrix.T,numpy.outer(norms,norms),out=retorno,where=numpy.outer(norms,norms)>0)
+    present=(matrix>0).astype(numpy.float32)
+    intersections=present@present.T
+    sizes=present.sum(axis=1)
+    unions=sizes[:,None]+sizes[None,:]-intersections
+    return numpy.divide(intersections,unions,out=retorno,where=unions>0)
+
+
+class GameElementMatrix(object):
+    """ The game x element counts of the consolidated data (see the module)
+
+        Keyword Arguments:
+            view {None, str, tuple} -- None: all the counters; a function key ("persuasive"); or (function key, behavior)
+            ttl {float} -- Seconds after which a query refreshes the matrix first (default: {300})
+            window {float} -- Seconds before the last date read that each refresh reads again (default: {60})
+    """
+
+    def __init__(self, view=None, ttl=300, window=60):
+        self.slots=self.__slots_of__(view)
+        self.view=view
+        self.ttl=ttl
+        self.window=window
+        self.refreshed=None
+        self.synced=None
+        self.game_ids=[]
+        self.games=[]
+        self.rows={}
+        self.elements=[]
+        self.columns={}
+        self.counts=numpy.zeros((0,0),dtype=numpy.float32)
+        self._lock=threading.RLock()
+
+    @staticmethod
+    def __slots_of__(view):
+        slots=[(function_key,behavior) for function_key,attribute,behaviors in SCSR_LAYOUT for behavior in behaviors]
+        if view is None:
+            return slots
+        selected=[slot for slot in slots if slot==tuple(view) or slot[0]==view] if isinstance(view,(str,tuple,list)) else []
+        if not selected:
+            raise ValueError("ERROR: Unknown view: "+str(view))
+        return selected
+
+    def configure(self, ttl=None, window=None):
+        if ttl is not None:
+            self.ttl=ttl
+        if window is not None:
+            self.window=window
+
+    @property
+    def matrix(self):
+        """ The counts: a row per game (games), a column per element (elements) """
+        return self.counts[:len(self.games),:len(self.elements)]
+
+    def __grow__(self, rows, columns):
+        """ Makes room for rows x columns (the capacity doubles, so the appends are amortized) """
+        capacity_rows,capacity_columns=self.counts.shape
+        if rows<=capacity_rows and columns<=capacity_columns:
+            return
+        grown=numpy.zeros((max(rows,capacity_rows*2 if rows>capacity_rows else capacity_rows),
+            max(columns,capacity_columns*2 if columns>capacity_columns else capacity_columns)),dtype=numpy.float32)
+        grown[:capacity_rows,:capacity_columns]=self.counts
+        self.counts=grown
+
+    def __row__(self, game_id, game_external_id):
+        row=self.rows.get(game_id)
+        if row is None:
+            row=self.rows[game_id]=len(self.games)
+            self.game_ids.append(game_id)
+            self.games.append(game_external_id)
+        return row
+
+    def __column__(self, external_id):
+        column=self.columns.get(external_id)
+        if column is None:
+            column=self.columns[external_id]=len(self.elements)
+            self.elements.append(external_id)
+        return column
+
+    def __view_counter__(self, counters):
+        """ The counts of the view in the counters of a consolidated data, by canonical element """
+        counted=Counter()
+        for function_key,behavior in self.slots:
+            for external_id,count in (counters or {}).get(function_key,{}).get(behavior,{}).items():
+                counted[external_id]+=count
+        #folded before the counts are filtered: a reassigned element may be counted (or decremented) on both keys
+        return Counter({external_id:count for external_id,count in canonical_elements.fold_external_ids(counted).items() if count>0})
+
+    def refresh(self):
+        """ Reads the consolidated data modified since the last refresh and replaces the rows of their games
+
+            Returns:
+                int -- The rows replaced (or added)
+        """
+        with self._lock:
+            query={"counted":True}
+            if self.synced is not None:
+                #the safety window again: the writes stamped before the last date read but committed after it are not missed
+                query["date_modified"]={"$gte":self.synced-timedelta(seconds=self.window)}
+            the_rows,the_columns,the_counts=[],[],[]
+            refreshed=set()
+            for doc in ConsolidatedScsrDB._get_collection().find(query,{"game_external_id":1,"counters":1,"date_modified":1}): # pylint: disable=protected-access
+                row=self.__row__(doc["_id"],doc.get("game_external_id"))
+                refreshed.add(row)
+                for external_id,count in self.__view_counter__(doc.get("counters")).items():
+                    the_rows.append(row)
+                    the_columns.append(self.__column__(external_id))
+                    the_counts.append(count)
+                if self.synced is None or doc["date_modified"]>self.synced:
+                    self.synced=doc["date_modified"]
+            self.__grow__(len(self.games),len(self.elements))
+            if refreshed:
+                self.counts[sorted(refreshed),:]=0
+                numpy.add.at(self.counts,(numpy.array(the_rows,dtype=numpy.intp),numpy.array(the_columns,dtype=numpy.intp)),numpy.array(the_counts,dtype=numpy.float32))
+            self.refreshed=time.monotonic()
+            return len(refreshed)
+
+    def __ensure__(self):
+        if self.refreshed is None or time.monotonic()-self.refreshed>=self.ttl:
+            self.refresh()
+
+    def vector(self, counter):
+        """ The row of a counter (element external_id -> count) in the columns of the matrix (the other elements are disregarded) """
+        retorno=numpy.zeros(len(self.elements),dtype=numpy.float32)
+        for external_id,count in counter.items():
+            column=self.columns.get(external_id)
+            if column is not None:
+                retorno[column]+=count
+        return retorno
+
+    def similar_games(self, game, metric="cosine", limit=10):
+        """ The games most similar to the game
+
+            Arguments:
+                game {GameDB} -- The game
+
+            Keyword Arguments:
+                metric {str} -- "cosine" or "jaccard" (default: {"cosine"})
+                limit {int} -- The games returned (default: {10})
+
+            Returns:
+                list -- (game external_id, similarity) of the most similar games (similarity > 0), most similar first
+        """
+        if not isinstance(game,GameDB):
+            raise TypeError("ERROR: Invalid type for the game  data.")
+        with self._lock:
+            self.__ensure__()
+            row=self.rows.get(game.pk)
+            if row is None:
+                return []
+            matrix=self.matrix
+            scores=similarities(matrix,matrix[row],metric)
+            scores[row]=0
+            return self.__top__(scores,limit,self.games)
+
+    @staticmethod
+    def __top__(scores, limit, labels):
+        """ The (label, score) of the limit best positive scores, best first """
+        if limit and limit<len(scores):
+            best=numpy.argpartition(-scores,limit-1)[:limit]
+        else:
+            best=numpy.arange(len(scores))
+        best=best[numpy.argsort(-scores[best],kind="stable")]
+        return [(labels[index],float(scores[index])) for index in best if scores[index]>0]
+
+    def pairwise(self, metric="cosine"):
+        """ The games x games similarities of the whole catalog (rows and columns in the order of games) """
+        with self._lock:
+            self.__ensure__()
+            return pairwise(self.matrix,metric)
+
+    def characteristic_elements(self, genre, limit=10):
+        """ The elements characteristic of the games of a genre: the elements whose share of the counts of the genre
+            exceeds their share of the counts of the catalog, weighted by the share in the genre (p * log(p/q), as in the
+            Kullback-Leibler divergence of the genre from the catalog)
+
+            Arguments:
+                genre {GenreDB} -- The genre
+
+            Keyword Arguments:
+                limit {int} -- The elements returned (default: {10})
+
+            Returns:
+                list -- (element external_id, score) of the most characteristic elements, most characteristic first
+        """
+        if not isinstance(genre,GenreDB):
+            raise TypeError("ERROR: Invalid type for the genre data.")
+        the_games=GamesGenresDB.s_games_sets([genre])[genre.pk].games
+        with self._lock:
+            self.__ensure__()
+            rows=[self.rows[game_id] for game_id in the_games if game_id in self.rows]
+            if not rows:
+                return []
+            matrix=self.matrix
+            in_genre=matrix[rows].sum(axis=0)
+            in_catalog=matrix.sum(axis=0)
+            if not in_genre.sum():
+                return []
+            share=in_genre/in_genre.sum()
+            catalog_share=in_catalog/in_catalog.sum()
+            scores=numpy.zeros(len(self.elements))
+            numpy.multiply(share,numpy.log(numpy.divide(share,catalog_share,out=numpy.ones_like(share),where=share>0)),out=scores,where=share>0)
+            return self.__top__(scores,limit,self.elements)
+
+    def reading(self, user, game=None):
+        """ The elements a user assigned (in the view), over the scsrs of the user or of one game
+
+            Arguments:
+                user {UserDB} -- The user
+
+            Keyword Arguments:
+                game {GameDB} -- Only the scsr of the user for the game (default: {None}: all)
+
+            Returns:
+                Counter -- element external_id -> the scsrs that assigned it (in the behaviors of the view)
+        """
+        if not isinstance(user,UserDB):
+            raise TypeError("ERROR: Invalid type for the user data.")
+        query={"user":user.pk}
+        if game is not None:
+            query["game"]=game.pk
+        slots=set(self.slots)
+        counted=Counter()
+        for scsr_id,function_key,behavior,behavior_id,elements in ScsrDB.iter_behavior_elements(query):
+            if (function_key,behavior) in slots:
+                counted.update(canonical_elements.canonical_id(oid) for oid in elements)
+        the_ids=list(counted)
+        external_ids={doc["_id"]:doc["external_id"] for doc in ElementDB._get_collection().find({"_id":{"$in":the_ids}},{"external_id":1})} if the_ids else {} # pylint: disable=protected-access
+        return Counter({external_ids[oid]:count for oid,count in counted.items() if oid in external_ids})
+
+    def user_distance(self, user_a, user_b, game=None, metric="cosine"):
+        """ The distance (1 - similarity) between the readings of two users (see reading)
+
+            Arguments:
+                user_a {UserDB} -- A user
+                user_b {UserDB} -- The other user
+
+            Keyword Arguments:
+                game {GameDB} -- Compares the scsrs of the users for the game (default: {None}: all their scsrs)
+                metric {str} -- "cosine" or "jaccard" (default: {"cosine"})
+
+            Returns:
+                float -- 0 for the same reading, 1 for readings without elements in common (or empty)
+        """
+        reading_a=self.reading(user_a,game)
+        reading_b=self.reading(user_b,game)
+        elements=list(set(reading_a)|set(reading_b))
+        if not elements:
+            return 1.0
+        vector_a=numpy.array([reading_a.get(element,0) for element in elements],dtype=numpy.float32)
+        vector_b=numpy.array([reading_b.get(element,0) for element in elements],dtype=numpy.float32)
+        return 1.0-float(similarities(vector_a[None,:],vector_b,metric)[0])
+
+
+# The collapsed matrix (all the functions and behaviors), shared by the queries of the process
+game_elements = GameElementMatrix()
@@ -0,0 +1,129 @@
+import unittest
+from unittest import mock
+from datetime import datetime
+from mongoengine.connection import _get_db
+from application import ScsrAPP
+from settings import MONGODB_HOST
+
+class ConsolidationTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print("*"*130)
+        print(" "*40+"Testing SCSR Consolidation")
+        print("*"*130)
+        cls.db_name = 'scsr-api-test-consolidation'
+
+        cls.app_factory = ScsrAPP(
+            MONGODB_SETTINGS = {'DB': cls.db_name,
+                'HOST': MONGODB_HOST},
+            TESTING = True,
+            WTF_CSRF_ENABLED = False,
+            SECRET_KEY = 'mySecret!').APP
+        cls.app = cls.app_factory.test_client()
+        from install_system import start_countries, start_language, start_genre, start_games, start_elements_multi
+        start_countries()
+        start_language()
+        start_genre()
+        start_games()
+        start_elements_multi()
+
+    @classmethod
+    def tearDownClass(cls):
+        db = _get_db()
+        db.client.drop_database(db)
+
+    @staticmethod
+    def create_user(name):
+        from user.models.user import UserAO
+        user=UserAO()
+        user.set_username(name)
+        user.set_password("password")
+        user.set_country("BR")
+        user.set_lang("en")
+        user.set_name(name)
+        user.set_surname(name)
+        user.set_email(name+"@consolidation.it")
+        user.set_birthdate(datetime(1977,8,10))
+        user.save()
+        return user
+
+    def test_01_rebuild_concurrent_diff(self):
+        """ A diff applied while the rebuild reads the scsrs is not overwritten: the rebuild reads them again """
+        from game.models.game import GameDB
+        from scsr.models.elements import ElementDB
+        from scsr.models.scsr import ScsrAO, ScsrDB, ConsolidatedScsrDB
+        game=GameDB.objects[0] # pylint: disable=no-member
+        elements=[element.to_obj() for element in ElementDB.objects[:2]] # pylint: disable=no-member
+        the_scsr=ScsrAO.create_scsr(game.to_obj(),self.create_user("rebuilder"))
+        the_scsr.persuasive_function.ludic.add(elements[0])
+        the_scsr.save()
+        consolidate=ScsrDB.consolidate
+        reads=[]
+        def concurrent(*args,**kwargs):
+            retorno=consolidate(*args,**kwargs)
+            reads.append(retorno)
+            if len(reads)==1:
+                #saved after the scsrs were read (and their behaviors stamped), before the counters are written
+                the_scsr.persuasive_function.ludic.add(elements[1])
+                the_scsr.save()
+            return retorno
+        with mock.patch.object(ScsrDB,"consolidate",side_effect=concurrent):
+            consolidated=ConsolidatedScsrDB.get_consolidated(game.to_obj())
+        assert len(reads)==2
+        counted={list(dado["element"].keys())[0]:dado["count"] for dado in consolidated["persuasive"]["ludic"]}
+        assert counted=={elements[0].external_id:1,elements[1].external_id:1}
+
+    def test_02_batched_equals_whole(self):
+        """ The counters streamed in batches (of any size) equal the ones counted on the whole scsrs """
+        from game.models.game import GameDB
+        from scsr.models.elements import ElementDB
+        from scsr.models.scsr import ScsrAO, ScsrDB, SCSR_LAYOUT
+        game=GameDB.objects[1] # pylint: disable=no-member
+        elements=[element.to_obj() for element in ElementDB.objects[:4]] # pylint: disable=no-member
+        for index in range(3):
+            the_scsr=ScsrAO.create_scsr(game.to_obj(),self.create_user("batcher"+str(index)))
+            for element in elements[index:]:
+                the_scsr.persuasive_function.ludic.add(element)
+            the_scsr.aesthetic_function.interactivity.add(elements[index])
+            the_scsr.reification_function.device.add(elements[-1])
+            the_scsr.save()
+        whole={function_key:{behavior:{} for behavior in behaviors} for function_key,attribute,behaviors in SCSR_LAYOUT}
+        for the_scsr in ScsrDB.get_scsr_list_by_game(game):
+            the_scsr=the_scsr.to_obj()
+            for function_key,attribute,behaviors in SCSR_LAYOUT:
+                for behavior in behaviors:
+                    counter=whole[function_key][behavior]
+                    for element in getattr(getattr(the_scsr,attribute),behavior):
+                        counter[element.external_id]=counter.get(element.external_id,0)+1
+        assert whole["persuasive"]["ludic"][elements[-1].external_id]==3
+        for batch_size in (1,2,None):
+            assert ScsrDB.consolidate({"game":game.id},batch_size=batch_size)==(whole,3)
+
+    def test_03_rebuild_unstamped_save(self):
+        """ A save of a behavior not stamped yet, landing between the read of its elements and its stamp, is read again """
+        from game.models.game import GameDB
+        from scsr.models.behaviors import BehaviorDB
+        from scsr.models.elements import ElementDB
+        from scsr.models.scsr import ScsrAO, ScsrDB, ConsolidatedScsrDB
+        game=GameDB.objects[2] # pylint: disable=no-member
+        elements=[element.to_obj() for element in ElementDB.objects[:2]] # pylint: disable=no-member
+        the_scsr=ScsrAO.create_scsr(game.to_obj(),self.create_user("stamper"))
+        the_scsr.persuasive_function.ludic.add(elements[0])
+        the_scsr.save()
+        #as the behaviors saved before they were stamped, and a game not counted yet
+        BehaviorDB._get_collection().update_many({"game":game.id},{"$unset":{"game":1,"function":1}}) # pylint: disable=protected-access
+        ConsolidatedScsrDB._get_collection().update_one({"_id":game.id},{"$set":{"counted":False}}) # pylint: disable=protected-access
+        stamp=ScsrDB.__stamp_behaviors__
+        saved=[]
+        def concurrent(the_game,behavior_ids):
+            if not saved:
+                #saved after the elements were read, before the behaviors are stamped: the diff is disregarded
+                saved.append(True)
+                the_scsr.persuasive_function.ludic.add(elements[1])
+                the_scsr.save()
+            return stamp(the_game,behavior_ids)
+        with mock.patch.object(ScsrDB,"__stamp_behaviors__",side_effect=concurrent):
+            consolidated=ConsolidatedScsrDB.get_consolidated(game.to_obj())
+        counted={list(dado["element"].keys())[0]:dado["count"] for dado in consolidated["persuasive"]["ludic"]}
+        assert counted=={elements[0].external_id:1,elements[1].external_id:1}
@@ -0,0 +1,86 @@
+import unittest
+import os
+import csv
+import json
+import tempfile
+from datetime import datetime
+from mongoengine.connection import _get_db
+from application import ScsrAPP
+from settings import MONGODB_HOST
+
+class ScsrExportTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print("*"*130)
+        print(" "*40+"Testing SCSR Export")
+        print("*"*130)
+        cls.db_name = 'scsr-api-test-export'
+
+        cls.app_factory = ScsrAPP(
+            MONGODB_SETTINGS = {'DB': cls.db_name,
+                'HOST': MONGODB_HOST},
+            TESTING = True,
+            WTF_CSRF_ENABLED = False,
+            SECRET_KEY = 'mySecret!').APP
+        cls.app = cls.app_factory.test_client()
+        from install_system import start_countries, start_language, start_genre, start_games, start_elements_multi
+        start_countries()
+        start_language()
+        start_genre()
+        start_games()
+        start_elements_multi()
+        cls.folder = tempfile.mkdtemp()
+
+    @classmethod
+    def tearDownClass(cls):
+        db = _get_db()
+        db.client.drop_database(db)
+
+    @staticmethod
+    def create_user(name):
+        from user.models.user import UserAO
+        user=UserAO()
+        user.set_username(name)
+        user.set_password("password")
+        user.set_country("BR")
+        user.set_lang("en")
+        user.set_name(name)
+        user.set_surname(name)
+        user.set_email(name+"@export.it")
+        user.set_birthdate(datetime(1977,8,10))
+        user.save()
+        return user
+
+    def test_01_rows(self):
+        """ The export has a row per element of each behavior, for the games of the genre """
+        from game.models.game import GameDB
+        from game.models.genre import GenreDB
+        from game.models.user_game_genre import GamesGenresDB
+        from scsr.models.elements import ElementDB
+        from scsr.models.scsr import ScsrAO, ScsrDB
+        from scsr.export import export_query, export_scsrs, COLUMNS
+        games=list(GameDB.objects[:2]) # pylint: disable=no-member
+        elements=[element.to_obj() for element in ElementDB.objects[:3]] # pylint: disable=no-member
+        expected=set()
+        for index,game in enumerate(games):
+            the_scsr=ScsrAO.create_scsr(game.to_obj(),self.create_user("exporter"+str(index)))
+            the_scsr.persuasive_function.ludic.add(elements[0])
+            the_scsr.persuasive_function.ludic.add(elements[index+1])
+            the_scsr.reification_function.device.add(elements[2])
+            the_scsr.save()
+            scsr_db=ScsrDB.objects.filter(external_id=the_scsr.external_id).first() # pylint: disable=no-member
+            for function,behavior,element in [("persuasive","ludic",elements[0]),("persuasive","ludic",elements[index+1]),("reification","device",elements[2])]:
+                expected.add((the_scsr.external_id,game.external_id,scsr_db.user.external_id,function,behavior,element.external_id))
+        path=os.path.join(self.folder,"scsrs.csv")
+        assert export_scsrs(path,chunk_size=2,batch_size=1)==len(expected)
+        with open(path,newline="",encoding="utf-8") as the_file:
+            rows=list(csv.reader(the_file))
+        assert tuple(rows[0])==COLUMNS
+        assert set(tuple(row[:-1]) for row in rows[1:])==expected
+        genre=GenreDB.objects.first() # pylint: disable=no-member
+        GamesGenresDB._get_collection().update_one({"_id":genre.pk},{"$set":{"gamesList":[games[0].pk]}}) # pylint: disable=protected-access
+        path=os.path.join(self.folder,"scsrs.jsonl")
+        assert export_scsrs(path,export_query(genre))==3
+        with open(path,encoding="utf-8") as the_file:
+            assert set(json.loads(line)["game"] for line in the_file)=={games[0].external_id}
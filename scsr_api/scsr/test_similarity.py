@@ -0,0 +1,114 @@
+import unittest
+import numpy
+from datetime import datetime, timedelta
+from mongoengine.connection import _get_db
+from application import ScsrAPP
+from settings import MONGODB_HOST
+
+class SimilarityTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print("*"*130)
+        print(" "*40+"Testing Similarity")
+        print("*"*130)
+        cls.db_name = 'scsr-api-test-similarity'
+
+        cls.app_factory = ScsrAPP(
+            MONGODB_SETTINGS = {'DB': cls.db_name,
+                'HOST': MONGODB_HOST},
+            TESTING = True,
+            WTF_CSRF_ENABLED = False,
+            SECRET_KEY = 'mySecret!').APP
+        cls.app = cls.app_factory.test_client()
+        from install_system import start_countries, start_language, start_genre, start_games, start_elements_multi
+        start_countries()
+        start_language()
+        start_genre()
+        start_games()
+        start_elements_multi()
+
+    @classmethod
+    def tearDownClass(cls):
+        db = _get_db()
+        db.client.drop_database(db)
+
+    @staticmethod
+    def create_user(name):
+        from user.models.user import UserAO
+        user=UserAO()
+        user.set_username(name)
+        user.set_password("password")
+        user.set_country("BR")
+        user.set_lang("en")
+        user.set_name(name)
+        user.set_surname(name)
+        user.set_email(name+"@similarity.it")
+        user.set_birthdate(datetime(1977,8,10))
+        user.save()
+        return user
+
+    def test_01_metrics(self):
+        """ Cosine of the counts, jaccard of the elements assigned """
+        from scsr.similarity import similarities, pairwise
+        matrix=numpy.array([[2,1,0],[1,0,1],[0,0,0]],dtype=numpy.float32)
+        scores=similarities(matrix,numpy.array([2,1,0],dtype=numpy.float32))
+        assert numpy.allclose(scores,[1,2/numpy.sqrt(10),0])
+        scores=similarities(matrix,numpy.array([1,0,0],dtype=numpy.float32),"jaccard")
+        assert numpy.allclose(scores,[0.5,0.5,0])
+        assert numpy.allclose(pairwise(matrix,"jaccard"),[[1,1/3,0],[1/3,1,0],[0,0,0]])
+        with self.assertRaises(ValueError):
+            similarities(matrix,matrix[0],"euclidean")
+
+    def test_02_catalog(self):
+        """ Similar games, characteristic elements of a genre and distance of readings, refreshed incrementally """
+        from game.models.game import GameDB
+        from game.models.genre import GenreDB
+        from game.models.user_game_genre import GamesGenresDB
+        from scsr.models.elements import ElementDB
+        from scsr.models.scsr import ScsrAO, ConsolidatedScsrDB
+        from user.models.user import UserDB
+        from scsr.similarity import GameElementMatrix
+        games=list(GameDB.objects[:3]) # pylint: disable=no-member
+        elements=[element.to_obj() for element in ElementDB.objects[:6]] # pylint: disable=no-member
+        users=[self.create_user("similar"+str(index)) for index in range(2)]
+        assigned=[[0,1,2],[0,1,3],[4,5]]
+        scsrs=[]
+        for index,game in enumerate(games):
+            for user in users:
+                the_scsr=ScsrAO.create_scsr(game.to_obj(),user)
+                for element in assigned[index]:
+                    the_scsr.persuasive_function.ludic.add(elements[element])
+                the_scsr.save()
+                scsrs.append(the_scsr)
+            ConsolidatedScsrDB.get_consolidated(game.to_obj())
+        matrix=GameElementMatrix(ttl=0)
+        assert matrix.refresh()==3
+        assert matrix.matrix.shape==(3,6)
+        similar=matrix.similar_games(games[0])
+        assert [game for game,score in similar]==[games[1].external_id]
+        assert abs(similar[0][1]-2/3)<1e-6
+        assert abs(matrix.similar_games(games[0],"jaccard")[0][1]-0.5)<1e-6
+        genre=GenreDB.objects.first() # pylint: disable=no-member
+        GamesGenresDB._get_collection().update_one({"_id":genre.pk},{"$set":{"gamesList":[games[2].pk]}}) # pylint: disable=protected-access
+        assert set(element for element,score in matrix.characteristic_elements(genre))=={elements[4].external_id,elements[5].external_id}
+        user_a=UserDB.objects.filter(username="similar0").first() # pylint: disable=no-member
+        user_b=UserDB.objects.filter(username="similar1").first() # pylint: disable=no-member
+        assert abs(matrix.user_distance(user_a,user_b))<1e-6
+        scsrs[-1].persuasive_function.ludic.add(elements[0])
+        scsrs[-1].save()
+        assert matrix.user_distance(user_a,user_b,game=games[2],metric="jaccard")>0
+        assert matrix.refresh()>=1
+        assert games[2].external_id in [game for game,score in matrix.similar_games(games[0])]
+
+    def test_03_late_write(self):
+        """ A write stamped before the last date read, but committed after the refresh, is read by the next one """
+        from scsr.models.scsr import ConsolidatedScsrDB
+        from scsr.similarity import GameElementMatrix
+        matrix=GameElementMatrix(ttl=0,window=60)
+        matrix.refresh()
+        collection=ConsolidatedScsrDB._get_collection() # pylint: disable=protected-access
+        doc=collection.find_one({"counted":True})
+        collection.update_one({"_id":doc["_id"]},{"$set":{"counters.persuasive.ludic.late-element":4,"date_modified":matrix.synced-timedelta(seconds=10)}})
+        matrix.refresh()
+        assert matrix.matrix[matrix.rows[doc["_id"]],matrix.columns["late-element"]]==4
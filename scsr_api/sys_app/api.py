@@ -53,7 +53,7 @@ class AccessAPI(MethodView):
         else:
             #generate token
             if(bcrypt.hashpw(request.json.get('app_secret'), app.app_secret)) == app.app_secret:
-                #delete existing tokens
+                #delete existing tokens (the deletion drops them from the credentials cache, see sys_app.credentials)
                 existing_tokens = Access.objects.filter(app=app).delete()
                 token = str(uuid.uuid4())
                 now = datetime.utcnow().replace(second=0, microsecond=0)
@@ -0,0 +1,52 @@
+from datetime import datetime
+from mongoengine import signals
+
+from utils.cache import TTLCache
+from sys_app.models.base_auth import Access
+
+
+class CredentialCache(object):
+    """ Caches the valid application credentials (app_id, token) until the access expires, so the @app_required
+        decorator does not need the database for known tokens.
+        Only valid credentials are cached. The entries are invalidated when an Access is saved or deleted, which covers
+        the token rotation (AccessAPI.post deletes the previous tokens).
+
+        The backend is an in-process TTLCache. With several processes (workers) a shared backend must be used
+        for the rotation to be seen by all of them: any object with get(key), set(key, value, ttl=) and invalidate(key)
+        (ex: an adapter to a redis/memcached client) can be given to use_backend.
+    """
+
+    def __init__(self, maxsize=4096):
+        self.backend=TTLCache(maxsize=maxsize, ttl=None)
+
+    def use_backend(self, backend):
+        self.backend=backend
+
+    @staticmethod
+    def _key(app_id, token):
+        return "credential:"+str(app_id)+":"+str(token)
+
+    def get(self, app_id, token):
+        """ Returns the expiration of the cached credential, or None if not cached """
+        return self.backend.get(self._key(app_id,token))
+
+    def add(self, app_id, token, expires):
+        """ Caches the credential until it expires """
+        remaining=(expires-datetime.utcnow()).total_seconds()
+        if remaining>0:
+            self.backend.set(self._key(app_id,token),expires,ttl=remaining)
+
+    def invalidate(self, app_id, token):
+        self.backend.invalidate(self._key(app_id,token))
+
+
+credential_cache=CredentialCache()
+
+
+def invalidate_access(sender, document, **kwargs):
+    """ Drops the credential of the saved/deleted access from the cache """
+    if document.app and document.token:
+        credential_cache.invalidate(document.app.app_id, document.token)
+
+signals.post_save.connect(invalidate_access, sender=Access)
+signals.post_delete.connect(invalidate_access, sender=Access)
@@ -1,11 +1,11 @@
-import json
-from six.moves.urllib.request import urlopen
 from functools import wraps
 from flask import request, jsonify, _request_ctx_stack
 from flask_cors import cross_origin
 from jose import jwt
 import datetime
 from sys_app.models.base_auth import App, Access
+from sys_app.credentials import credential_cache
+from sys_app.jwks import JWKSKeyStore, ClaimsCache
 
 
 from sys_app import AuthError
@@ -19,6 +19,11 @@ REDIRECT_URI = "192.168.1.101:5000"
 STATE = "TESTE"
 ALGORITHMS = ["RS256"]
 
+#the signing keys of the provider, cached by kid (see sys_app.jwks). Configured by the application (AUTH0_JWKS_FILE, JWKS_CACHE_TTL)
+key_store = JWKSKeyStore(url="https://"+AUTH0_DOMAIN+"/.well-known/jwks.json")
+#verified tokens, until they expire
+claims_cache = ClaimsCache()
+
 def app_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -29,6 +34,12 @@ def app_required(f):
             return jsonify({
                 "error": error
             }), 403
+        expires = credential_cache.get(app_id, app_token)
+        if expires is not None:
+            if expires < datetime.datetime.utcnow():
+                error={"code":"TOKEN_EXPIRED"}
+                return jsonify({"error": error}), 403
+            return f(*args, **kwargs)
         app = App.objects.filter(app_id=app_id).first()
         if not app:
             error={"code":"INVALID_CREDENTIALS"}
@@ -44,7 +55,7 @@ def app_required(f):
             
             error={"code":"TOKEN_EXPIRED"}
             return jsonify({"error": error}), 403
-
+        credential_cache.add(app_id, app_token, access.expires)
         return f(*args, **kwargs)
     return decorated_function
 
@@ -52,9 +63,7 @@ def app_required(f):
 def get_token_auth_header():
     """Obtains the access token from the Authorization Header
     """
-    print("Get Token")
     auth = request.headers.get("Authorization", None)
-    print("Auth: "+str(auth))
     if not auth:
         raise AuthError.AuthError({"code": "authorization_header_missing",
                         "description":
@@ -85,7 +94,6 @@ def requires_scope(required_scope):
     Args:
         required_scope (str): The scope required to access the resource
     """
-    print("scope")
     token = get_token_auth_header()
     unverified_claims = jwt.get_unverified_claims(token)
     if unverified_claims.get("scope"):
@@ -101,20 +109,11 @@ def requires_auth(f):
     """
     @wraps(f)
     def decorated(*args, **kwargs):
-        print("Auth")
         token = get_token_auth_header()
-        print("Token: "+ token)
-        url="https://"+AUTH0_DOMAIN+"/.well-known/jwks.json"
-        jsonurl = urlopen(url)
-        print("===================================")
-        byteStream=jsonurl.read()
-        decoded = byteStream.decode("utf-8")
-        print("ByteStream")
-        print(byteStream)
-        print("decoded")
-        print(decoded)
-        print("===================================")
-        jwks = json.loads(decoded)
+        payload = claims_cache.get(token)
+        if payload is not None:
+            _request_ctx_stack.top.current_user = payload
+            return f(*args, **kwargs)
         try:
             unverified_header = jwt.get_unverified_header(token)
         except jwt.JWTError:
@@ -127,16 +126,7 @@ def requires_auth(f):
                             "description":
                                 "Invalid header. "
                                 "Use an RS256 signed JWT Access Token"}, 401)
-        rsa_key = {}
-        for key in jwks["keys"]:
-            if key["kid"] == unverified_header["kid"]:
-                rsa_key = {
-                    "kty": key["kty"],
-                    "kid": key["kid"],
-                    "use": key["use"],
-                    "n": key["n"],
-                    "e": key["e"]
-                }
+        rsa_key = key_store.get_key(unverified_header.get("kid"))
         if rsa_key:
             try:
                 payload = jwt.decode(
@@ -160,10 +150,9 @@ def requires_auth(f):
                                     "Unable to parse authentication"
                                     " token."}, 400)
 
+            claims_cache.add(token, payload)
             _request_ctx_stack.top.current_user = payload
             return f(*args, **kwargs)
         raise AuthError.AuthError({"code": "invalid_header",
                         "description": "Unable to find appropriate key"}, 400)
     return decorated
-
-
@@ -0,0 +1,132 @@
+import json
+import threading
+import time
+from six.moves.urllib.request import urlopen
+
+from utils.cache import TTLCache
+
+
+class JWKSKeyStore(object):
+    """ Keeps the RSA keys of a JSON Web Key Set indexed by kid, so the key set is not fetched for every request.
+
+        The keys are fetched from the url (or read from a local file, or given as a dict for offline tests) and live
+        for ttl seconds. An unknown kid (key rotation) forces one refresh: concurrent requests wait for the same refresh
+        instead of fetching the key set each (single flight), and refreshes for unknown kids are spaced by min_refresh
+        seconds so invalid tokens cannot flood the provider.
+
+        Keyword Arguments:
+            url {str} -- The jwks url (default: {None})
+            path {str} -- A local jwks file. Has precedence over the url (default: {None})
+            jwks {dict} -- A static key set (stub). Has precedence over path and url (default: {None})
+            ttl {float} -- Seconds the key set is valid (default: {3600})
+            min_refresh {float} -- Minimum seconds between refreshes forced by unknown kids (default: {30})
+    """
+
+    def __init__(self, url=None, path=None, jwks=None, ttl=3600, min_refresh=30, clock=time.monotonic):
+        self.url=url
+        self.path=path
+        self.jwks=jwks
+        self.ttl=ttl
+        self.min_refresh=min_refresh
+        self.clock=clock
+        self.keys={}
+        self.fetched_at=None
+        self.fetches=0
+        self._generation=0
+        self._lock=threading.Lock()
+
+    def configure(self, url=None, path=None, jwks=None, ttl=None, min_refresh=None):
+        """ Changes the source/bounds of the store, dropping the current keys """
+        with self._lock:
+            if url is not None:
+                self.url=url
+            if path is not None:
+                self.path=path
+            if jwks is not None:
+                self.jwks=jwks
+            if ttl is not None:
+                self.ttl=ttl
+            if min_refresh is not None:
+                self.min_refresh=min_refresh
+            self.keys={}
+            self.fetched_at=None
+            self._generation+=1
+
+    def _load(self):
+        if self.jwks is not None:
+            return self.jwks
+        if self.path:
+            with open(self.path, encoding="utf-8") as the_file:
+                return json.load(the_file)
+        return json.loads(urlopen(self.url).read().decode("utf-8"))
+
+    @staticmethod
+    def _parse(jwks):
+        keys={}
+        for key in jwks.get("keys",[]):
+            if key.get("kty")!="RSA" or "kid" not in key:
+                continue
+            keys[key["kid"]]={
+                "kty": key["kty"],
+                "kid": key["kid"],
+                "use": key.get("use"),
+                "n": key["n"],
+                "e": key["e"]
+            }
+        return keys
+
+    def _expired(self):
+        return self.fetched_at is None or (self.clock()-self.fetched_at)>=self.ttl
+
+    def refresh(self, force=False, seen_generation=None):
+        """ Fetches the key set. Only one thread fetches; the others wait and use its result.
+
+            Keyword Arguments:
+                force {bool} -- Fetch even if the key set is still valid (default: {False})
+                seen_generation {int} -- The generation the caller saw. If another thread refreshed since, nothing is fetched (default: {None})
+        """
+        with self._lock:
+            if seen_generation is not None and seen_generation!=self._generation:
+                return
+            if not force and not self._expired():
+                return
+            if force and self.fetched_at is not None and (self.clock()-self.fetched_at)<self.min_refresh:
+                return
+            self.keys=self._parse(self._load())
+            self.fetched_at=self.clock()
+            self.fetches+=1
+            self._generation+=1
+
+    def get_key(self, kid):
+        """ Returns the RSA key (dict) for the kid, or None if the key set does not have it (even after a refresh) """
+        generation=self._generation
+        if self._expired():
+            self.refresh(seen_generation=generation)
+            generation=self._generation
+        key=self.keys.get(kid)
+        if key is None:
+            self.refresh(force=True, seen_generation=generation)
+            key=self.keys.get(kid)
+        return key
+
+
+class ClaimsCache(object):
+    """ Keeps the decoded claims of the verified tokens until they expire ('exp' claim),
+        so a repeated bearer token does not go through the signature verification again.
+    """
+
+    def __init__(self, maxsize=10000):
+        self.cache=TTLCache(maxsize=maxsize, ttl=None)
+
+    def get(self, token):
+        return self.cache.get(token)
+
+    def add(self, token, claims):
+        if "exp" not in claims:
+            return
+        remaining=claims["exp"]-time.time()
+        if remaining>0:
+            self.cache.set(token, claims, ttl=remaining)
+
+    def clear(self):
+        self.cache.clear()
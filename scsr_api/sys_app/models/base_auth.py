@@ -1,4 +1,6 @@
 from application import db
+from utils.indexes import index_registry
+from bson import ObjectId
 
 class App(db.Document):
     app_id = db.StringField(db_field="ai", unique = True)
@@ -13,3 +15,9 @@ class Access(db.Document):
     token = db.StringField(db_field="t")
     expires = db.DateTimeField(db_field = "e")
 
+    meta = {
+        'indexes': ['app']
+    }
+
+index_registry.declare(App, probes=[("app_required", {"ai": "probe"})])
+index_registry.declare(Access, probes=[("app_required", {"a": ObjectId()})])
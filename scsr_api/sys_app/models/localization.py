@@ -1,7 +1,13 @@
 import json
+from mongoengine import signals
 from application import db
 from user.models.user import UserDB
 from utils.models.lang_code import lang_codeDB
+from utils.cache import TTLCache
+
+#code -> in_system. The language table is tiny and almost never changes.
+#Entries are dropped when the language is saved/deleted and expire after LANGUAGE_CACHE_TTL seconds (see settings)
+language_cache = TTLCache(maxsize=256, ttl=300)
 
 class TextsDB(db.Document):
     """Just to store in the DB the localization data.
@@ -53,7 +59,18 @@ class TranslationsAO(object):
             codigo {string(2)} -- The language code
         
         Returns:
-            SystemTranslationsObject -- A SystemTranslationsObject with the language object indicating it exists, or None if not.
+            bool -- True if the language exists and is in the system, False if not.
         """
-        the_lang=lang_codeDB.objects.filter(code=codigo).first() # pylint: disable=no-member
-        return the_lang.in_system
+        in_system=language_cache.get(codigo)
+        if in_system is None:
+            the_lang=lang_codeDB.objects.filter(code=codigo).first() # pylint: disable=no-member
+            in_system=language_cache.set(codigo,bool(the_lang and the_lang.in_system))
+        return in_system
+
+    @staticmethod
+    def invalidate_language(sender, document, **kwargs):
+        """ Drops the cached language when it is saved or deleted """
+        language_cache.invalidate(document.code)
+
+signals.post_save.connect(TranslationsAO.invalidate_language, sender=lang_codeDB)
+signals.post_delete.connect(TranslationsAO.invalidate_language, sender=lang_codeDB)
@@ -6,6 +6,7 @@ from application import ScsrAPP
 
 
 from sys_app.models.base_auth import App, Access
+from sys_app.jwks import JWKSKeyStore
 from settings import MONGODB_HOST
 
 class AppTest(unittest.TestCase):
@@ -116,3 +117,66 @@ class AppTest(unittest.TestCase):
 
         
         
+    def test_token_rotation(self):
+        rv = self.app.post('/apps/',
+            data = self.app_dict(),
+            content_type = 'application/json')
+        assert rv.status_code == 200
+        rv = self.app.post('/apps/access_token/',
+            data = self.app_dict(),
+            content_type = 'application/json')
+        old_token = json.loads(rv.data.decode('utf-8')).get('token')
+
+        #the first use caches the credential, the second is answered by the cache
+        for counter in range(2):
+            rv = self.app.get('/games/',
+                headers={'X-APP-ID': 'Scsr_Client', 'X-APP-TOKEN': old_token},
+                content_type = 'application/json')
+            assert rv.status_code == 200
+
+        #rotating the token invalidates the cached credential
+        rv = self.app.post('/apps/access_token/',
+            data = self.app_dict(),
+            content_type = 'application/json')
+        new_token = json.loads(rv.data.decode('utf-8')).get('token')
+        rv = self.app.get('/games/',
+            headers={'X-APP-ID': 'Scsr_Client', 'X-APP-TOKEN': old_token},
+            content_type = 'application/json')
+        assert rv.status_code == 403
+        rv = self.app.get('/games/',
+            headers={'X-APP-ID': 'Scsr_Client', 'X-APP-TOKEN': new_token},
+            content_type = 'application/json')
+        assert rv.status_code == 200
+
+
+class JWKSKeyStoreTest(unittest.TestCase):
+
+    def key_set(self, *kids):
+        return {"keys": [{"kty": "RSA", "kid": kid, "use": "sig", "n": "n-"+kid, "e": "AQAB"} for kid in kids]}
+
+    def test_cached_keys(self):
+        store = JWKSKeyStore(jwks=self.key_set("k1", "k2"))
+        assert store.get_key("k1")["n"] == "n-k1"
+        assert store.get_key("k2")["n"] == "n-k2"
+        assert store.fetches == 1
+
+    def test_unknown_kid(self):
+        now = [0.0]
+        store = JWKSKeyStore(jwks=self.key_set("k1"), min_refresh=30, clock=lambda: now[0])
+        store.get_key("k1")
+        #rotation: the new kid forces a refresh
+        store.jwks = self.key_set("k1", "k2")
+        now[0] = 31
+        assert store.get_key("k2")["n"] == "n-k2"
+        assert store.fetches == 2
+        #an invalid kid does not refresh again before min_refresh
+        assert store.get_key("invalid") is None
+        assert store.fetches == 2
+
+    def test_ttl(self):
+        now = [0.0]
+        store = JWKSKeyStore(jwks=self.key_set("k1"), ttl=10, clock=lambda: now[0])
+        store.get_key("k1")
+        now[0] = 11
+        store.get_key("k1")
+        assert store.fetches == 2
@@ -5,6 +5,9 @@ from email.utils import parseaddr
 from application import db
 from uuid import uuid4
 from utils import sanitize
+from utils import identity_map
+from utils.indexes import index_registry
+from utils.typeahead import typeahead_index, ANY_LANGUAGE
 
 
 
@@ -38,7 +41,7 @@ class UserDB(db.Document):
     created = db.DateTimeField(db_field="created", default = datetime.utcnow) # pylint: disable=no-member
     updated = db.DateTimeField(db_field="updated", default = datetime.utcnow) # pylint: disable=no-member
     meta = {
-        "indexes": [("external_id", "live", "username", "email", "name", "country", "state")]
+        "indexes": [("external_id", "live"), "country", "state", "city"]
     }
 
     def to_obj(self):
@@ -77,6 +80,18 @@ class UserDB(db.Document):
             document.external_id=str(uuid4())
 
 signals.pre_save.connect(UserDB.preSave, sender=UserDB)
+user_name_typeahead = typeahead_index("user.name", UserDB, lambda user: {ANY_LANGUAGE: user.name}, fields=["name"])
+user_surname_typeahead = typeahead_index("user.surname", UserDB, lambda user: {ANY_LANGUAGE: user.surname}, fields=["surname"])
+index_registry.declare(UserDB,
+    probes=[
+        ("__get_persisted__", {"external_id": "probe"}),
+        ("UserAPI.get", {"external_id": "probe", "live": True}),
+        ("get_user_username", {"username": "probe"}),
+        ("get_user_email", {"email": "probe"}),
+        ("get_users_city", {"city": "probe"}),
+        ("get_users_state", {"state": "probe"}),
+        ("get_users_country", {"country": "probe"})
+    ])
 
 class UserAO(object):
     """ Class to represent the data object in the Controller.
@@ -151,7 +166,11 @@ class UserAO(object):
             db_obj {UserDB} -- Returns the UserAO object
         """
 
+        retorno = identity_map.cached(db_obj)
+        if retorno is not None:
+            return retorno
         retorno=UserAO()
+        identity_map.register(db_obj,retorno)
         retorno.external_id = db_obj.external_id
         retorno.country = db_obj.country
         retorno.lang = db_obj.lang
@@ -170,6 +189,11 @@ class UserAO(object):
         retorno.birthdate = db_obj.birthdate
         return retorno
 
+    def __get_persisted__(self):
+        if not self.external_id:
+            return None
+        return UserDB.objects.filter(external_id=self.external_id).first() # pylint: disable=no-member
+
     def to_json(self):
         retorno={
             "external_id" :getattr(self,"external_id",None),
@@ -409,7 +433,7 @@ class UserAO(object):
 
     @staticmethod
     def get_users_surname(name):
-        retorno_temp=UserDB.objects(__raw__={"surname":{'$regex':name,'$options':'i'}})# pylint: disable=no-member
+        retorno_temp=user_surname_typeahead.seek(name)
         retorno=None
         if(retorno_temp):
             retorno=[user.to_obj() for user in retorno_temp]
@@ -417,7 +441,7 @@ class UserAO(object):
     
     @staticmethod
     def get_users_name(name):
-        retorno_temp=UserDB.objects(__raw__={"name":{'$regex':name,'$options':'i'}})# pylint: disable=no-member
+        retorno_temp=user_name_typeahead.seek(name)
         retorno=None
         if(retorno_temp):
             retorno=[user.to_obj() for user in retorno_temp]
@@ -0,0 +1,87 @@
+from collections import OrderedDict
+import threading
+import time
+
+
+class TTLCache(object):
+    """ Bounded in-process cache: least recently used entries are dropped when full and every entry expires after a time to live.
+        Thread safe. Used for the small, read mostly, collections (languages, credentials, keys...).
+
+        Arguments:
+            maxsize {int} -- Maximum number of entries (default: {1024})
+            ttl {float} -- Seconds an entry lives, if not given when set (default: {300}). None: never expires.
+
+        Attributes:
+            hits -- how many lookups found a valid entry
+            misses -- how many lookups did not
+    """
+
+    def __init__(self, maxsize=1024, ttl=300, clock=time.monotonic):
+        self.maxsize=maxsize
+        self.ttl=ttl
+        self.clock=clock
+        self.hits=0
+        self.misses=0
+        self._data=OrderedDict()
+        self._lock=threading.RLock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry=self._data.get(key)
+            if entry is not None:
+                value,expires=entry
+                if expires is None or expires>self.clock():
+                    self._data.move_to_end(key)
+                    self.hits+=1
+                    return value
+                del self._data[key]
+            self.misses+=1
+            return default
+
+    def set(self, key, value, ttl=None, expires_at=None):
+        """ Stores the value.
+
+            Arguments:
+                key {hashable} -- The key
+                value {object} -- The value
+
+            Keyword Arguments:
+                ttl {float} -- Seconds this entry lives (default: {the cache ttl})
+                expires_at {float} -- Absolute expiration, in the cache clock. Has precedence over ttl (default: {None})
+        """
+        if expires_at is None:
+            ttl=self.ttl if ttl is None else ttl
+            expires_at=None if ttl is None else self.clock()+ttl
+        with self._lock:
+            self._data[key]=(value,expires_at)
+            self._data.move_to_end(key)
+            while len(self._data)>self.maxsize:
+                self._data.popitem(last=False)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key,None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def configure(self, maxsize=None, ttl=None):
+        """ Changes the bounds of the cache, dropping the current entries """
+        with self._lock:
+            if maxsize is not None:
+                self.maxsize=maxsize
+            if ttl is not None:
+                self.ttl=ttl
+            self._data.clear()
+
+    def __contains__(self, key):
+        marker=object()
+        return self.get(key,marker) is not marker
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {"hits":self.hits, "misses":self.misses, "size":len(self._data)}
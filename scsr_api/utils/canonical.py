@@ -0,0 +1,64 @@
+from collections import Counter
+import threading
+
+"""Canonical ids: each id replaced by another (deprecated, merged...) resolves to the final one, as in a union-find.
+
+    Only the replaced ids are kept (id -> the id replacing it). Resolving follows the chain once and compresses it:
+    every id of the path then points straight to the final id, so the next resolutions are one lookup.
+"""
+
+
+class Canonical(object):
+    """ Union-find of ids to their canonical id (path compression, no rank: the canonical id is always the one kept) """
+
+    def __init__(self):
+        self.parent={}
+        self._lock=threading.Lock()
+
+    def find(self, key):
+        """ Returns the canonical id of the key (the key itself if it was never replaced) """
+        parent=self.parent
+        root=key
+        while root in parent:
+            root=parent[root]
+        if root!=key:
+            with self._lock:
+                while key in parent and parent[key]!=root:
+                    parent[key],key=root,parent[key]
+        return root
+
+    def replace(self, deprecated, current):
+        """ Replaces deprecated by current: deprecated, and every id resolving to it, resolve to the canonical id of current.
+
+            Raises:
+                ValueError -- If current resolves to deprecated (a cycle)
+
+            Returns:
+                The canonical id of current
+        """
+        root=self.find(current)
+        if root==deprecated:
+            raise ValueError("ERROR: "+str(current)+" already resolves to "+str(deprecated))
+        with self._lock:
+            self.parent[deprecated]=root
+        return root
+
+    def load(self, pairs):
+        """ Replaces the ids with (id, canonical id) pairs """
+        with self._lock:
+            self.parent=dict(pairs)
+
+    def fold(self, counter):
+        """ Returns the counter (id -> count) with the counts of the replaced ids added to their canonical ids """
+        if not self.parent:
+            return Counter(counter)
+        retorno=Counter()
+        for key,count in counter.items():
+            retorno[self.find(key)]+=count
+        return retorno
+
+    def __contains__(self, key):
+        return key in self.parent
+
+    def __len__(self):
+        return len(self.parent)
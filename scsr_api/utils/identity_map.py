@@ -0,0 +1,155 @@
+from contextlib import contextmanager
+import threading
+
+from bson import DBRef, ObjectId
+
+
+class IdentityMap(object):
+    """ Keeps the application objects converted from the database within a request (or a batch), keyed by document class and id.
+        Each document is converted (and, when reached through a reference, fetched) at most once in the scope.
+        The application objects are shared: a change made in one of them is seen by everyone that converted the same document.
+
+        Attributes:
+            hits -- how many conversions were answered by the map
+            misses -- how many conversions had to be done
+    """
+
+    def __init__(self):
+        self.objects={}
+        self.hits=0
+        self.misses=0
+
+    def get(self, kind, key):
+        retorno=self.objects.get((kind,key))
+        if retorno is None:
+            self.misses+=1
+        else:
+            self.hits+=1
+        return retorno
+
+    def peek(self, kind, key):
+        """ Returns the object without accounting a hit or miss """
+        return self.objects.get((kind,key))
+
+    def add(self, kind, key, obj):
+        self.objects[(kind,key)]=obj
+        return obj
+
+    def stats(self):
+        return {"hits":self.hits, "misses":self.misses, "size":len(self.objects)}
+
+
+_local=threading.local()
+
+
+def current():
+    """ Returns the active IdentityMap of the thread, or None if there is no scope open """
+    return getattr(_local,"identity_map",None)
+
+
+@contextmanager
+def identity_scope():
+    """ Opens a scope for the identity map. Nested scopes share the outermost map.
+
+        with identity_scope() as the_map:
+            scsrs=[scsr.to_obj() for scsr in ScsrDB.objects(game=game)]
+        print(the_map.stats())
+    """
+    outer=current()
+    if outer is not None:
+        yield outer
+        return
+    _local.identity_map=IdentityMap()
+    try:
+        yield _local.identity_map
+    finally:
+        _local.identity_map=None
+
+
+def begin_scope():
+    """ Opens the scope of a request. Returns nothing: a value returned by a before_request hook is taken as the response """
+    _local.identity_map=IdentityMap()
+
+
+def end_scope(*args):
+    the_map=current()
+    _local.identity_map=None
+    return the_map
+
+
+def init_app(app):
+    """ Opens an identity map scope for every request of the application """
+    app.before_request(begin_scope)
+    app.teardown_request(end_scope)
+
+
+def cached(db_obj):
+    """ Returns the application object already converted for the document, or None (also when no scope is open) """
+    the_map=current()
+    if the_map is None or db_obj.pk is None:
+        return None
+    return the_map.get(type(db_obj).__name__,db_obj.pk)
+
+
+def register(db_obj, obj):
+    """ Registers the application object converted from the document. Must be called before converting the references
+        of the document, so cyclic references (as reassigned_to/reassigned_from) end in the map.
+    """
+    the_map=current()
+    if the_map is not None and db_obj.pk is not None:
+        the_map.add(type(db_obj).__name__,db_obj.pk,obj)
+    return obj
+
+
+def _raw_id(value):
+    if isinstance(value,DBRef):
+        return value.id
+    if isinstance(value,ObjectId):
+        return value
+    return None
+
+
+def reference(db_obj, field, kind):
+    """ Converts the document referenced by the field, avoiding fetching it when its object is already in the map.
+
+        Arguments:
+            db_obj {Document} -- The document holding the reference
+            field {str} -- The name of the ReferenceField
+            kind {str} -- The class name of the referenced document (ex: 'ElementDB')
+
+        Returns:
+            object -- The application object of the referenced document (None if not referenced)
+    """
+    the_map=current()
+    if the_map is not None:
+        raw_id=_raw_id(db_obj._data.get(field))
+        if raw_id is not None:
+            found=the_map.peek(kind,raw_id)
+            if found is not None:
+                the_map.hits+=1
+                return found
+    referenced=getattr(db_obj,field)
+    return referenced.to_obj() if referenced else None
+
+
+def reference_list(db_obj, field, kind):
+    """ Converts the documents referenced by the list field, avoiding fetching them when they are all in the map.
+
+        Arguments:
+            db_obj {Document} -- The document holding the references
+            field {str} -- The name of the ListField(ReferenceField)
+            kind {str} -- The class name of the referenced documents (ex: 'ElementDB')
+
+        Returns:
+            list -- The application objects of the referenced documents
+    """
+    the_map=current()
+    if the_map is not None:
+        raw=db_obj._data.get(field) or []
+        raw_ids=[_raw_id(value) for value in raw]
+        if raw_ids and None not in raw_ids:
+            found=[the_map.peek(kind,raw_id) for raw_id in raw_ids]
+            if None not in found:
+                the_map.hits+=len(found)
+                return found
+    return [referenced.to_obj() for referenced in getattr(db_obj,field) if referenced]
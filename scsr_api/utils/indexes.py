@@ -0,0 +1,144 @@
+from collections import OrderedDict
+import pymongo
+
+"""Registry of the indexes each model needs and of the queries (probes) that must use them.
+
+    The static indexes are declared, as usual, in the meta of the documents. The localized fields (name, genre,
+    element...) are dicts in the form {lang: value} and are queried by path ("name.en"), so they need one index per
+    language of the system: those are declared here with a {lang} placeholder and created by ensure_indexes.
+    (Wildcard indexes would cover them, but they are not available in the mongo version deployed.)
+
+    The probes are the filters of the seek_* methods. audit_indexes runs explain() on each one and reports the ones
+    resolved by a collection scan.
+"""
+
+
+class IndexRegistry(object):
+    """ Keeps the index declarations and probes, per model
+
+        Attributes:
+            models {OrderedDict} -- model -> {"localized": [key tuples], "probes": [(label, filter)]}
+    """
+
+    def __init__(self):
+        self.models=OrderedDict()
+
+    def declare(self, model, localized=(), probes=()):
+        """ Declares the per language indexes and the probes of a model.
+
+            Arguments:
+                model {Document class} -- The mongoengine document
+
+            Keyword Arguments:
+                localized {list} -- Tuples of db field names. Names with {lang} are expanded for each system language (default: {()})
+                probes {list} -- Tuples (label, raw filter). Keys with {lang} are expanded for each system language (default: {()})
+        """
+        entry=self.models.setdefault(model,{"localized":[],"probes":[]})
+        entry["localized"].extend(tuple(keys) for keys in localized)
+        entry["probes"].extend(probes)
+
+    @staticmethod
+    def expand(keys, languages):
+        """ Returns the key tuple for each language (only once if it is not localized) """
+        if not any("{lang}" in key for key in keys):
+            return [tuple(keys)]
+        return [tuple(key.format(lang=lang) for key in keys) for lang in languages]
+
+    @staticmethod
+    def expand_filter(the_filter, languages):
+        """ Returns the raw filter for each language (only once if it is not localized) """
+        if not any("{lang}" in key for key in the_filter):
+            return [the_filter]
+        return [{key.format(lang=lang):value for key,value in the_filter.items()} for lang in languages]
+
+    def ensure_indexes(self, languages=None):
+        """ Creates the indexes declared in the meta of the registered models and the localized ones.
+
+            Keyword Arguments:
+                languages {list} -- Language codes (default: {the system languages})
+
+            Returns:
+                dict -- model name -> list of the index names created/confirmed
+        """
+        languages=system_languages() if languages is None else languages
+        retorno=OrderedDict()
+        for model,entry in self.models.items():
+            model.ensure_indexes()
+            collection=model._get_collection() # pylint: disable=protected-access
+            names=[]
+            for keys in entry["localized"]:
+                for expanded in self.expand(keys,languages):
+                    names.append(collection.create_index([(key,pymongo.ASCENDING) for key in expanded], background=True))
+            retorno[model.__name__]=names
+        return retorno
+
+    def audit_indexes(self, languages=None):
+        """ Runs explain() on every probe.
+
+            Keyword Arguments:
+                languages {list} -- Language codes (default: {the system languages})
+
+            Returns:
+                list -- dicts {"model", "probe", "filter", "stages", "collscan"}, one per (expanded) probe
+        """
+        languages=system_languages() if languages is None else languages
+        retorno=[]
+        for model,entry in self.models.items():
+            collection=model._get_collection() # pylint: disable=protected-access
+            for label,the_filter in entry["probes"]:
+                for expanded in self.expand_filter(the_filter,languages):
+                    plan=collection.find(expanded).explain()
+                    stages=plan_stages(plan.get("queryPlanner",{}).get("winningPlan",{}))
+                    retorno.append({
+                        "model": model.__name__,
+                        "probe": label,
+                        "filter": expanded,
+                        "stages": stages,
+                        "collscan": "COLLSCAN" in stages
+                    })
+        return retorno
+
+    def compare_indexes(self, languages=None):
+        """ Compares the declared indexes (meta and localized) with the ones in the collections.
+
+            Keyword Arguments:
+                languages {list} -- Language codes (default: {the system languages})
+
+            Returns:
+                dict -- model name -> {"missing": [...], "extra": [...]}, the indexes as lists of (key, direction).
+                    The extra ones are left from previous declarations and can be dropped.
+        """
+        languages=system_languages() if languages is None else languages
+        retorno=OrderedDict()
+        for model,entry in self.models.items():
+            diff=model.compare_indexes()
+            localized=[[(key,pymongo.ASCENDING) for key in expanded] for keys in entry["localized"] for expanded in self.expand(keys,languages)]
+            existing=[list(info["key"]) for info in model._get_collection().index_information().values()] # pylint: disable=protected-access
+            retorno[model.__name__]={
+                "missing": diff["missing"]+[index for index in localized if index not in existing],
+                "extra": [index for index in diff["extra"] if index not in localized]
+            }
+        return retorno
+
+
+def plan_stages(plan):
+    """ Returns the stages of a (winning) query plan, from the root to the leaves """
+    stages=[]
+    pending=[plan]
+    while pending:
+        node=pending.pop(0)
+        if isinstance(node,list):
+            pending.extend(node)
+        elif isinstance(node,dict):
+            if "stage" in node:
+                stages.append(node["stage"])
+            pending.extend(value for value in node.values() if isinstance(value,(dict,list)))
+    return stages
+
+
+def system_languages():
+    from utils.models.lang_code import lang_codeDB
+    return [lang.code for lang in lang_codeDB.objects.filter(in_system=True)] # pylint: disable=no-member
+
+
+index_registry=IndexRegistry()
@@ -0,0 +1,107 @@
+import heapq
+import threading
+import weakref
+from collections import deque
+
+"""Interning of objects to small integer ids, so sets of them can be kept as int bitsets.
+
+    Every distinct object (by its key) receives an id, held by a Slot. A set of objects is an int with the bit of each
+    id set: union, intersection, difference and symmetric difference are the int |, &, &~ and ^, done in C without
+    hashing the objects again.
+    The interner holds the slots weakly: the sets using an id keep its slot (and their own objects). When no set holds
+    the slot any more, the key is forgotten and the id is reused, so the ids (and the bitsets) stay bounded by the
+    objects in use, not by every object ever interned.
+"""
+
+
+class Slot(object):
+    """ The id of a key, while something holds it """
+    __slots__ = ("id", "__weakref__")
+
+    def __init__(self, the_id):
+        self.id=the_id
+
+    def __repr__(self):
+        return f"Slot({self.id})"
+
+
+class Interner(object):
+    """ Registry key <-> id, holding the slots weakly
+
+        Keyword Arguments:
+            key {callable} -- object -> hashable key of the object identity (default: {hash})
+    """
+
+    def __init__(self, key=hash):
+        self.key=key
+        self._slots={}
+        self._free=[]
+        self._next=0
+        # slots collected: released (key forgotten, id reused) by the next intern, not by the gc callback
+        self._collected=deque()
+        self._lock=threading.Lock()
+
+    def slot(self, obj):
+        """ Returns the slot of the object, registering it if new. The id is kept while the slot is held """
+        the_key=self.key(obj)
+        ref=self._slots.get(the_key)
+        the_slot=ref() if ref is not None else None
+        if the_slot is None:
+            with self._lock:
+                self.__release__()
+                ref=self._slots.get(the_key)
+                the_slot=ref() if ref is not None else None
+                if the_slot is None:
+                    if self._free:
+                        the_slot=Slot(heapq.heappop(self._free))
+                    else:
+                        the_slot=Slot(self._next)
+                        self._next+=1
+                    collected=self._collected
+                    self._slots[the_key]=weakref.ref(the_slot, lambda dead, key=the_key, the_id=the_slot.id: collected.append((key, dead, the_id)))
+        return the_slot
+
+    def __release__(self):
+        """ Forgets the keys of the slots collected and frees their ids. Called with the lock held """
+        while self._collected:
+            the_key,dead,the_id=self._collected.popleft()
+            if self._slots.get(the_key) is dead:
+                del self._slots[the_key]
+            heapq.heappush(self._free,the_id)
+
+    def lookup(self, obj):
+        """ Returns the id of the object, or None if no slot of it is held """
+        ref=self._slots.get(self.key(obj))
+        the_slot=ref() if ref is not None else None
+        return None if the_slot is None else the_slot.id
+
+    def bit(self, obj):
+        """ Returns the bit of the object, or 0 if no slot of it is held (then it is in no bitset) """
+        the_id=self.lookup(obj)
+        return 0 if the_id is None else 1<<the_id
+
+    def bits(self, objs):
+        """ Returns the bitset of the objects whose slot is held (the others are in no bitset) """
+        the_bits=0
+        for obj in objs:
+            the_bits|=self.bit(obj)
+        return the_bits
+
+    def __len__(self):
+        """ The number of slots held """
+        return sum(1 for ref in list(self._slots.values()) if ref() is not None)
+
+
+def ids_of(bits):
+    """ Returns the ids (set bits) of a bitset, in increasing order """
+    the_ids=[]
+    while bits:
+        lowest=bits & -bits
+        the_ids.append(lowest.bit_length()-1)
+        bits^=lowest
+    return the_ids
+
+
+def count_of(bits):
+    """ Returns the number of ids in a bitset """
+    return bits.bit_count()
@@ -0,0 +1,90 @@
+from collections import abc
+from bson import DBRef, ObjectId
+
+"""Lazy lists of referenced documents (histories, diffs...): the ids are kept, the documents are loaded and converted
+    a page at a time, on first access. The length is known without loading them.
+"""
+
+PAGE_SIZE = 20
+
+
+def reference_ids(db_obj, field):
+    """ Returns the ids referenced by a ListField(ReferenceField) of a document, without dereferencing them
+
+        Arguments:
+            db_obj {Document} -- The document holding the references
+            field {str} -- The name of the field
+    """
+    the_ids=[]
+    for value in db_obj._data.get(field) or []: # pylint: disable=protected-access
+        if isinstance(value,DBRef):
+            the_ids.append(value.id)
+        elif isinstance(value,ObjectId):
+            the_ids.append(value)
+        elif value is not None:
+            the_ids.append(value.pk)
+    return the_ids
+
+
+class LazyList(abc.Sequence):
+    """ A list of referenced documents, converted on demand
+
+        Arguments:
+            ids {list} -- The ids of the documents, in order
+            loader {callable} -- list of ids -> list of the converted objects, in the same order (None for a missing document)
+
+        Keyword Arguments:
+            page_size {int} -- The documents loaded at once (default: {PAGE_SIZE}, set from the HISTORY_PAGE_SIZE config)
+
+        Objects appended (append, +) are kept after the referenced ones, already converted.
+    """
+
+    def __init__(self, ids, loader, page_size=None):
+        self.ids=list(ids)
+        self.loader=loader
+        self.page_size=page_size or PAGE_SIZE
+        self.pages={}
+        self.appended=[]
+
+    def __len__(self):
+        return len(self.ids)+len(self.appended)
+
+    def page(self, number):
+        """ Returns the objects of a page (number from 0), loading it if needed """
+        if number not in self.pages:
+            self.pages[number]=self.loader(self.ids[number*self.page_size:(number+1)*self.page_size])
+        return self.pages[number]
+
+    def __getitem__(self, index):
+        if isinstance(index,slice):
+            return [self[position] for position in range(*index.indices(len(self)))]
+        if index<0:
+            index+=len(self)
+        if index<0 or index>=len(self):
+            raise IndexError("LazyList index out of range")
+        if index>=len(self.ids):
+            return self.appended[index-len(self.ids)]
+        return self.page(index//self.page_size)[index%self.page_size]
+
+    def __iter__(self):
+        for number in range((len(self.ids)+self.page_size-1)//self.page_size):
+            for obj in self.page(number):
+                yield obj
+        for obj in self.appended:
+            yield obj
+
+    def append(self, obj):
+        self.appended.append(obj)
+
+    def __add__(self, other):
+        retorno=LazyList(self.ids,self.loader,self.page_size)
+        retorno.pages=self.pages
+        retorno.appended=self.appended+list(other)
+        return retorno
+
+    def loaded(self):
+        """ The number of documents already loaded """
+        return sum(len(page) for page in self.pages.values())
+
+    def __repr__(self):
+        return f"<LazyList {len(self)} items, {self.loaded()} loaded>"
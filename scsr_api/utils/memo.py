@@ -0,0 +1,22 @@
+"""Memoization of values derived from the state of an object (hashes, semi hashes...).
+
+    The value is kept in the object with the key it was computed for. The key is cheap to build and changes
+    whenever the value would (a version counter, the bits of a set...): while the key is the same, the value is reused.
+"""
+
+
+def memoized(obj, name, key, compute):
+    """ Returns the value memoized in obj.name for the key, computing (compute()) and keeping it if the key changed
+
+        Arguments:
+            obj {object} -- The object keeping the value
+            name {str} -- The attribute keeping (key, value)
+            key {hashable} -- The state the value depends on
+            compute {callable} -- Computes the value
+    """
+    cached=obj.__dict__.get(name)
+    if cached is not None and cached[0]==key:
+        return cached[1]
+    value=compute()
+    obj.__dict__[name]=(key,value)
+    return value
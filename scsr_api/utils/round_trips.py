@@ -0,0 +1,62 @@
+from collections import Counter
+from threading import Lock
+from mongoengine import connection
+from pymongo import monitoring
+
+
+class RoundTripCounter(monitoring.CommandListener):
+    """ Counts the commands sent to the database server (each command is a round trip).
+        Used to benchmark the persistence methods. Counting only happens inside a 'with' block:
+
+            with round_trips as counted:
+                the_scsr.save()
+            print(counted.total, counted.commands)
+
+        The listener must be registered before the MongoClient is created (pymongo restriction),
+        so the module registers the shared instance 'round_trips' when imported, and reconnect() replaces the clients
+        created before. Import it only where the commands are counted (the benchmarks), not in the application.
+    """
+
+    def __init__(self):
+        self.active=False
+        self.commands=Counter()
+        self._lock=Lock()
+
+    @property
+    def total(self):
+        return sum(self.commands.values())
+
+    def reset(self):
+        with self._lock:
+            self.commands=Counter()
+
+    def __enter__(self):
+        self.reset()
+        self.active=True
+        return self
+
+    def __exit__(self, *args):
+        self.active=False
+        return False
+
+    def started(self, event):
+        if self.active:
+            with self._lock:
+                self.commands[event.command_name]+=1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+round_trips=RoundTripCounter()
+monitoring.register(round_trips)
+
+
+def reconnect(alias=connection.DEFAULT_CONNECTION_NAME):
+    """ Replaces the client of the connection alias with a new one, with the same settings, that has the listener """
+    settings=dict(connection._connection_settings[alias]) # pylint: disable=protected-access
+    connection.disconnect(alias)
+    connection.register_connection(alias, **settings)
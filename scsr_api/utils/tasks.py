@@ -0,0 +1,109 @@
+from datetime import datetime
+import functools
+import logging
+from celery import Celery
+from kombu.exceptions import OperationalError
+from pymongo.errors import DuplicateKeyError
+
+"""Background tasks: the side effects of the saves (counters, references, history...) run in a celery worker,
+    so the request only waits for its primary write.
+
+    The tasks are declared with @background_task next to the code they maintain and enqueued with enqueue(key, *args).
+    The key identifies the work: it is claimed (task_keys collection, unique _id) before the task runs, so a task
+    delivered twice (lost ack, concurrent workers) or retried after a partial run does not repeat its effect. A task
+    failing after its claim is kept as failed and not run again; the retries cover the failures of the claim itself.
+    The keys are kept for TASK_KEYS_TTL seconds.
+    The arguments must be serializable (strings, numbers, lists, dicts): send external ids, not documents.
+
+    Modes:
+        eager -- (tests: TESTING or TASKS_EAGER) the tasks run in the process, when enqueued
+        queued -- the tasks are sent to the broker (CELERY_BROKER_URL). If the broker is unreachable the task
+            runs in the process, so the side effect is not lost.
+
+    Worker: celery -A worker worker (see worker.py)
+"""
+
+celery_app = Celery("scsr_api")
+logger = logging.getLogger(__name__)
+TASK_KEYS_TTL = 7*24*3600
+_task_keys = None
+
+
+def init_app(app):
+    """ Configures the tasks from the flask app config """
+    global TASK_KEYS_TTL
+    TASK_KEYS_TTL=app.config.get("TASK_KEYS_TTL",TASK_KEYS_TTL)
+    eager=bool(app.config.get("TASKS_EAGER") or app.config.get("TESTING"))
+    celery_app.conf.update(
+        broker_url=app.config.get("CELERY_BROKER_URL"),
+        task_always_eager=eager,
+        task_eager_propagates=True,
+        task_acks_late=True,
+        task_serializer="json",
+        accept_content=["json"]
+    )
+
+
+def task_keys():
+    """ The collection of the keys claimed: {_id: key, state: running|done|failed, done: date}, expiring after TASK_KEYS_TTL seconds """
+    global _task_keys
+    if _task_keys is None:
+        from mongoengine.connection import get_db
+        _task_keys=get_db()["task_keys"]
+        _task_keys.create_index("done", expireAfterSeconds=TASK_KEYS_TTL, background=True)
+    return _task_keys
+
+
+def is_done(key):
+    found=task_keys().find_one({"_id":key},{"state":1})
+    return found is not None and found.get("state","done")=="done"
+
+
+def claim(key):
+    """ Claims the key for a run. Returns False if it was already claimed (running, done or failed) """
+    try:
+        task_keys().insert_one({"_id":key, "state":"running", "done":datetime.utcnow()})
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+def finish(key, state="done"):
+    task_keys().update_one({"_id":key},{"$set":{"state":state, "done":datetime.utcnow()}})
+
+
+def background_task(name=None, max_retries=5):
+    """ Declares a function as a background task: run at most once per key, retried with exponential backoff on errors
+        (a retry of a key claimed is not run again, see claim).
+
+        Keyword Arguments:
+            name {str} -- The task name (default: {module.function})
+            max_retries {int} -- Retries before giving up (default: {5})
+
+        Returns:
+            The celery task, with the extra method enqueue(key, *args)
+    """
+    def decorator(function):
+        @celery_app.task(name=name or function.__module__+"."+function.__name__, autoretry_for=(Exception,),
+            retry_backoff=True, retry_jitter=True, max_retries=max_retries)
+        @functools.wraps(function)
+        def the_task(key, *args):
+            if not claim(key):
+                return None
+            try:
+                retorno=function(*args)
+            except Exception:
+                finish(key,"failed")
+                raise
+            finish(key)
+            return retorno
+
+        def enqueue(key, *args):
+            try:
+                return the_task.apply_async((key,)+args)
+            except OperationalError:
+                logger.warning("Broker unreachable, running %s (%s) in the process", the_task.name, key)
+                return the_task.apply((key,)+args)
+        the_task.enqueue=enqueue
+        return the_task
+    return decorator
@@ -0,0 +1,44 @@
+import unittest
+from utils.cache import TTLCache
+
+
+class _Clock(object):
+    def __init__(self):
+        self.now=0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TTLCacheTest(unittest.TestCase):
+
+    def test_expiration(self):
+        """ Entries expire after the ttl (or the given expiration) """
+        clock=_Clock()
+        cache=TTLCache(maxsize=10, ttl=5, clock=clock)
+        cache.set("a",1)
+        cache.set("b",2,expires_at=20)
+        assert cache.get("a")==1
+        clock.now=6
+        assert cache.get("a") is None
+        assert cache.get("b")==2
+        clock.now=21
+        assert cache.get("b") is None
+
+    def test_lru(self):
+        """ The least recently used entry is dropped when the cache is full """
+        cache=TTLCache(maxsize=2, ttl=None)
+        cache.set("a",1)
+        cache.set("b",2)
+        cache.get("a")
+        cache.set("c",3)
+        assert "a" in cache
+        assert "b" not in cache
+        assert "c" in cache
+
+    def test_invalidate(self):
+        cache=TTLCache()
+        cache.set("a",1)
+        cache.invalidate("a")
+        assert cache.get("a") is None
+        assert cache.stats()["misses"]==1
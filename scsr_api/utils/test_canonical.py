@@ -0,0 +1,23 @@
+import unittest
+from utils.canonical import Canonical
+
+
+class CanonicalTest(unittest.TestCase):
+
+    def test_chains(self):
+        """ The replaced ids resolve to the end of the chain, compressed """
+        canonical=Canonical()
+        canonical.replace("a","b")
+        canonical.replace("b","c")
+        canonical.replace("d","a")
+        assert canonical.find("d")=="c" and canonical.find("a")=="c"
+        assert canonical.parent["d"]=="c"
+        assert canonical.find("x")=="x"
+        with self.assertRaises(ValueError):
+            canonical.replace("c","d")
+
+    def test_fold(self):
+        """ The counts of the replaced ids are added to their canonical ids """
+        canonical=Canonical()
+        canonical.replace("a","b")
+        assert canonical.fold({"a":2,"b":1,"c":1})=={"b":3,"c":1}
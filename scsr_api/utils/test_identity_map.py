@@ -0,0 +1,49 @@
+import unittest
+from flask import Flask, jsonify
+from utils import identity_map
+from utils.identity_map import identity_scope
+
+
+class _FakeDB(object):
+    def __init__(self, pk):
+        self.pk=pk
+
+
+class IdentityMapTest(unittest.TestCase):
+
+    def test_no_scope(self):
+        """ Without a scope nothing is cached """
+        the_db=_FakeDB(1)
+        identity_map.register(the_db,"AO")
+        assert identity_map.cached(the_db) is None
+
+    def test_scope(self):
+        """ Within a scope the object is returned and the hits/misses are accounted """
+        the_db=_FakeDB(1)
+        with identity_scope() as the_map:
+            assert identity_map.cached(the_db) is None
+            identity_map.register(the_db,"AO")
+            assert identity_map.cached(the_db)=="AO"
+            assert identity_map.cached(_FakeDB(2)) is None
+            assert the_map.stats()=={"hits":1, "misses":2, "size":1}
+        assert identity_map.current() is None
+
+    def test_nested_scope(self):
+        """ Nested scopes share the outermost map """
+        with identity_scope() as outer:
+            with identity_scope() as inner:
+                assert inner is outer
+            assert identity_map.current() is outer
+        assert identity_map.current() is None
+
+    def test_request_scope(self):
+        """ A request through the application runs within a scope, closed at its end """
+        app=Flask(__name__)
+        identity_map.init_app(app)
+        @app.route("/scope")
+        def scope():
+            return jsonify(open=identity_map.current() is not None)
+        response=app.test_client().get("/scope")
+        assert response.status_code==200
+        assert response.get_json()=={"open":True}
+        assert identity_map.current() is None
@@ -0,0 +1,19 @@
+import unittest
+from utils.indexes import IndexRegistry, plan_stages
+
+
+class IndexRegistryTest(unittest.TestCase):
+
+    def test_expand(self):
+        """ Localized keys/filters are expanded for each language, the others are kept """
+        assert IndexRegistry.expand(("name.{lang}","active"),["en","pt"])==[("name.en","active"),("name.pt","active")]
+        assert IndexRegistry.expand(("studio",),["en","pt"])==[("studio",)]
+        assert IndexRegistry.expand_filter({"name.{lang}":"x"},["en","pt"])==[{"name.en":"x"},{"name.pt":"x"}]
+        assert IndexRegistry.expand_filter({"studio":"x"},["en","pt"])==[{"studio":"x"}]
+
+    def test_plan_stages(self):
+        """ The stages of nested plans are all found """
+        plan={"stage":"FETCH","inputStage":{"stage":"IXSCAN","keyPattern":{"studio":1}}}
+        assert plan_stages(plan)==["FETCH","IXSCAN"]
+        plan={"stage":"SUBPLAN","inputStage":{"stage":"OR","inputStages":[{"stage":"IXSCAN"},{"stage":"COLLSCAN"}]}}
+        assert "COLLSCAN" in plan_stages(plan)
@@ -0,0 +1,37 @@
+import gc
+import unittest
+from utils.interning import Interner, ids_of, count_of
+
+
+class InternerTest(unittest.TestCase):
+
+    def test_intern(self):
+        """ Equal keys share the slot while it is held """
+        interner=Interner(key=str.lower)
+        slot_a=interner.slot("A")
+        assert interner.slot("a") is slot_a and slot_a.id==0
+        slot_b=interner.slot("b")
+        assert slot_b.id==1
+        assert interner.lookup("c") is None and interner.bit("c")==0
+        assert interner.bits(["a","B","c"])==0b11
+        assert len(interner)==2
+
+    def test_reuse(self):
+        """ The ids of the slots no longer held are reused """
+        interner=Interner(key=str.lower)
+        kept=interner.slot("kept")
+        for index in range(100):
+            interner.slot("gone"+str(index))
+        gc.collect()
+        assert interner.lookup("gone0") is None
+        new=interner.slot("new")
+        assert new.id==1
+        assert interner.lookup("kept")==kept.id==0
+        assert len(interner)==2
+
+    def test_bits(self):
+        """ The ids of a bitset are found in order and counted """
+        assert ids_of(0)==[] and count_of(0)==0
+        bits=(1<<0)|(1<<5)|(1<<64)
+        assert ids_of(bits)==[0,5,64]
+        assert count_of(bits)==3
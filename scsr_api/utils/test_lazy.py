@@ -0,0 +1,36 @@
+import unittest
+from utils.lazy import LazyList
+
+
+class LazyListTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loads=[]
+        def loader(ids):
+            self.loads.append(list(ids))
+            return [the_id*10 for the_id in ids]
+        self.lazy=LazyList(range(7),loader,page_size=3)
+
+    def test_length(self):
+        """ The length is known without loading """
+        assert len(self.lazy)==7
+        assert not self.loads
+
+    def test_pages(self):
+        """ Only the page of the item is loaded, once """
+        assert self.lazy[4]==40
+        assert self.lazy[-3]==40
+        assert self.loads==[[3,4,5]]
+        assert self.lazy[1:6:2]==[10,30,50]
+        assert list(self.lazy)==[0,10,20,30,40,50,60]
+        assert self.loads==[[3,4,5],[0,1,2],[6]]
+        with self.assertRaises(IndexError):
+            self.lazy[7] # pylint: disable=pointless-statement
+
+    def test_appended(self):
+        """ The objects appended come after the loaded ones, without loading them """
+        self.lazy.append(70)
+        added=self.lazy+[80]
+        assert len(added)==9 and added[-1]==80 and self.lazy[-1]==70
+        assert not self.loads
+        assert list(added)[6:]==[60,70,80]
@@ -0,0 +1,19 @@
+import unittest
+from utils.memo import memoized
+
+
+class MemoizedTest(unittest.TestCase):
+
+    def test_memoized(self):
+        """ The value is computed once per key """
+        class Holder(object):
+            pass
+        holder=Holder()
+        calls=[]
+        def compute():
+            calls.append(1)
+            return len(calls)
+        assert memoized(holder,"_value",("a",1),compute)==1
+        assert memoized(holder,"_value",("a",1),compute)==1
+        assert memoized(holder,"_value",("a",2),compute)==2
+        assert len(calls)==2
@@ -0,0 +1,99 @@
+import unittest
+from unittest import mock
+from celery.exceptions import Retry
+from flask import Flask
+from kombu.exceptions import OperationalError
+from pymongo.errors import DuplicateKeyError
+from utils import tasks
+from utils.tasks import background_task, celery_app
+
+
+class _FakeKeys(object):
+    """ The task_keys collection, in memory """
+
+    def __init__(self):
+        self.docs={}
+
+    def find_one(self, query, projection=None):
+        return self.docs.get(query["_id"])
+
+    def insert_one(self, doc):
+        if doc["_id"] in self.docs:
+            raise DuplicateKeyError("duplicate key")
+        self.docs[doc["_id"]]=dict(doc)
+
+    def update_one(self, query, update):
+        self.docs[query["_id"]].update(update["$set"])
+
+
+calls=[]
+
+
+@background_task(name="utils.test_tasks.record")
+def record(value):
+    calls.append(value)
+    if value=="fail":
+        raise ValueError("partial run")
+    return value
+
+
+class TasksTest(unittest.TestCase):
+
+    def setUp(self):
+        self.former_keys=tasks._task_keys # pylint: disable=protected-access
+        self.former_conf={key:celery_app.conf.get(key) for key in ("broker_url","task_always_eager","task_eager_propagates")}
+        tasks._task_keys=_FakeKeys() # pylint: disable=protected-access
+        del calls[:]
+
+    def tearDown(self):
+        tasks._task_keys=self.former_keys # pylint: disable=protected-access
+        celery_app.conf.update(self.former_conf)
+
+    @staticmethod
+    def configure(**config):
+        app=Flask(__name__)
+        app.config.update(config)
+        tasks.init_app(app)
+
+    def test_eager(self):
+        """ The tasks run in the process under TESTING or TASKS_EAGER, and are queued otherwise """
+        self.configure(TESTING=True)
+        assert celery_app.conf.task_always_eager
+        self.configure(TASKS_EAGER=True)
+        assert celery_app.conf.task_always_eager
+        record.enqueue("eager:1","a")
+        assert calls==["a"]
+        self.configure(CELERY_BROKER_URL="memory://")
+        assert not celery_app.conf.task_always_eager
+
+    def test_once_per_key(self):
+        """ A key already done is not run again; another key is """
+        self.configure(TESTING=True)
+        assert record.enqueue("once:1","a").get()=="a"
+        assert record.enqueue("once:1","a").get() is None
+        record.enqueue("once:2","b")
+        assert calls==["a","b"]
+        assert tasks.is_done("once:1") and tasks.is_done("once:2") and not tasks.is_done("once:3")
+
+    def test_claimed(self):
+        """ A key claimed by another delivery (running) is not run; a run failing is not repeated by its retries """
+        self.configure(TESTING=True)
+        assert tasks.claim("claimed:1")
+        assert record.enqueue("claimed:1","a").get() is None
+        assert not tasks.is_done("claimed:1")
+        with self.assertRaises(Retry):
+            record.enqueue("claimed:2","fail")
+        #the retry
+        assert record("claimed:2","fail") is None
+        assert calls==["fail"]
+        assert tasks.task_keys().find_one({"_id":"claimed:2"})["state"]=="failed"
+
+    def test_broker_down(self):
+        """ When the broker is unreachable the task runs in the process, once per key """
+        self.configure(CELERY_BROKER_URL="memory://")
+        with mock.patch.object(record,"apply_async",side_effect=OperationalError("broker down")):
+            with self.assertLogs(tasks.logger,"WARNING"):
+                record.enqueue("down:1","a")
+            record.enqueue("down:1","a")
+        assert calls==["a"]
+        assert tasks.is_done("down:1")
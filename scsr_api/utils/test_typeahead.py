@@ -0,0 +1,80 @@
+import unittest
+from utils.typeahead import TypeaheadIndex, MongoBackend, fold, ANY_LANGUAGE
+
+
+class _FakeDoc(object):
+    def __init__(self, external_id, texts, active=True):
+        self.external_id=external_id
+        self.texts=texts
+        self.active=active
+
+
+class _FakeModel(object):
+    objects=[
+        _FakeDoc("1",{"en":"Role Playing","pt":"Jogo de Interpretação"}),
+        _FakeDoc("2",{"en":"Platform","pt":"Plataforma"}),
+        _FakeDoc("3",{"en":"Strategy Role","pt":"Estratégia"}),
+        _FakeDoc("4",{"en":"Roleplay"},active=False)
+    ]
+
+
+class _FakeCollection(object):
+    """ The typeahead collection, in memory, counting the built checks """
+
+    def __init__(self):
+        self.docs={}
+        self.checks=0
+
+    def find_one(self, query, projection=None):
+        self.checks+=1
+        return self.docs.get(query["_id"])
+
+    def replace_one(self, query, doc, upsert=False):
+        self.docs[query["_id"]]=doc
+
+    def delete_many(self, query):
+        self.docs={the_id:doc for the_id,doc in self.docs.items() if any(doc.get(key)!=value for key,value in query.items())}
+
+
+class TypeaheadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index=TypeaheadIndex("test", _FakeModel, lambda doc: doc.texts if doc.active else None)
+
+    def test_fold(self):
+        """ Accents, case and spaces are normalized """
+        assert fold("  Estratégia  em TEMPO ")=="estrategia em tempo"
+
+    def test_suggest(self):
+        """ Substring matches, ranked: prefix, word prefix, others """
+        assert self.index.suggest("role","en")==["1","3"]
+        assert self.index.suggest("at","en")==["2","3"]
+        assert self.index.suggest("ESTRATEG","pt")==["3"]
+        assert self.index.suggest("interpretaçao","pt")==["1"]
+        assert self.index.suggest("role","pt")==[]
+        assert self.index.suggest("","en")==[]
+        assert self.index.suggest("r","en",limit=1)==["1"]
+
+    def test_update(self):
+        """ Saved documents are reindexed, deleted ones removed """
+        self.index.suggest("role","en")
+        self.index.on_save(None,_FakeDoc("4",{"en":"Roleplay"}))
+        assert self.index.suggest("role","en")==["4","1","3"]
+        self.index.on_delete(None,_FakeModel.objects[0])
+        self.index.on_save(None,_FakeDoc("3",{"en":"Strategy"}))
+        assert self.index.suggest("role","en")==["4"]
+        assert self.index.suggest("x",ANY_LANGUAGE)==[]
+
+    def test_built_cached(self):
+        """ The mongo backend asks if it is built until it is: then the saves and deletes do not ask again """
+        collection=_FakeCollection()
+        self.index.use_backend(MongoBackend("test",collection))
+        self.index.on_save(None,_FakeDoc("5",{"en":"Racing"}))
+        assert collection.checks==1
+        self.index.build(force=True)
+        self.index.on_save(None,_FakeDoc("5",{"en":"Racing"}))
+        self.index.on_delete(None,_FakeDoc("5",{"en":"Racing"}))
+        assert collection.checks==1
+        other=MongoBackend("test",collection)
+        assert other.is_built() and other.is_built()
+        assert collection.checks==2
@@ -0,0 +1,300 @@
+from collections import OrderedDict
+import threading
+import unicodedata
+from mongoengine import signals
+
+"""Typeahead (autocomplete) indexes for the partial text searches (elements, genres, games, users).
+
+    The texts are folded (accents removed, case folded, spaces collapsed) and split in n-grams of 1 to MAX_GRAM
+    characters. A search intersects the sets of the n-grams of the typed text and checks the candidates, so it matches
+    the same texts as the former unanchored case insensitive $regex, without scanning the collection.
+    The results are ranked: texts starting with the typed text, then texts with a word starting with it, then the others;
+    shorter texts first.
+
+    The indexes follow the documents through the post_save/post_delete signals and are loaded from the collection
+    on the first search. Two backends:
+        MemoryBackend -- (default) the n-grams are kept in the process
+        MongoBackend -- the n-grams are kept in the typeahead collection (multikey index), shared by all the processes.
+            Use it when the api runs in several processes: the memory of each would only see its own saves.
+"""
+
+MAX_GRAM = 3
+ANY_LANGUAGE = "*"
+
+
+def fold(text):
+    """ Returns the text without accents, case folded and with single spaces """
+    if not text:
+        return ""
+    decomposed=unicodedata.normalize("NFKD",str(text))
+    stripped="".join(char for char in decomposed if not unicodedata.combining(char))
+    return " ".join(stripped.casefold().split())
+
+
+def grams(folded, max_gram=MAX_GRAM):
+    """ Returns the set of n-grams (1 to max_gram characters) of a folded text """
+    return {folded[start:start+size] for size in range(1,max_gram+1) for start in range(len(folded)-size+1)}
+
+
+def query_grams(folded, max_gram=MAX_GRAM):
+    """ Returns the n-grams a text must have to contain the folded query """
+    if len(folded)<=max_gram:
+        return {folded}
+    return {folded[start:start+max_gram] for start in range(len(folded)-max_gram+1)}
+
+
+def rank(folded_query, folded_text):
+    if folded_text.startswith(folded_query):
+        position=0
+    elif (" "+folded_query) in folded_text:
+        position=1
+    else:
+        position=2
+    return (position, len(folded_text), folded_text)
+
+
+class MemoryBackend(object):
+    """ Keeps the n-grams of an index in the process """
+
+    def __init__(self):
+        self.texts={}
+        self.langs={}
+        self.grams={}
+        self.built=False
+        self._lock=threading.RLock()
+
+    def put(self, lang, key, folded):
+        with self._lock:
+            self.delete(key,lang)
+            self.texts[(lang,key)]=folded
+            self.langs.setdefault(key,set()).add(lang)
+            the_grams=self.grams.setdefault(lang,{})
+            for gram in grams(folded):
+                the_grams.setdefault(gram,set()).add(key)
+
+    def delete(self, key, lang=None):
+        with self._lock:
+            langs=self.langs.get(key,set())
+            for the_lang in ([lang] if lang is not None else list(langs)):
+                folded=self.texts.pop((the_lang,key),None)
+                if folded is None:
+                    continue
+                langs.discard(the_lang)
+                if not langs:
+                    self.langs.pop(key,None)
+                the_grams=self.grams.get(the_lang,{})
+                for gram in grams(folded):
+                    keys=the_grams.get(gram)
+                    if keys is not None:
+                        keys.discard(key)
+                        if not keys:
+                            del the_grams[gram]
+
+    def candidates(self, lang, needed):
+        """ Returns {key: folded text} of the texts having all the needed n-grams """
+        with self._lock:
+            the_grams=self.grams.get(lang,{})
+            sets=sorted((the_grams.get(gram,set()) for gram in needed),key=len)
+            if not sets or not sets[0]:
+                return {}
+            keys=set(sets[0]).intersection(*sets[1:])
+            return {key:self.texts[(lang,key)] for key in keys}
+
+    def clear(self):
+        with self._lock:
+            self.texts={}
+            self.langs={}
+            self.grams={}
+            self.built=False
+
+    def mark_built(self):
+        self.built=True
+
+    def is_built(self):
+        return self.built
+
+
+class MongoBackend(object):
+    """ Keeps the n-grams of an index in a collection: one document per (index, lang, key) with the list of its n-grams
+
+        Arguments:
+            name {str} -- The index name
+            collection {pymongo Collection} -- The collection (default: {the typeahead collection of the database})
+    """
+
+    def __init__(self, name, collection=None):
+        self.name=name
+        self._collection=collection
+        #once built, it stays built (only clear undoes it): the saves and deletes do not ask again
+        self.built=False
+
+    @property
+    def collection(self):
+        if self._collection is None:
+            from mongoengine.connection import get_db
+            self._collection=get_db()["typeahead"]
+            self._collection.create_index([("index",1),("lang",1),("grams",1)], background=True)
+            self._collection.create_index([("index",1),("key",1)], background=True)
+        return self._collection
+
+    def put(self, lang, key, folded):
+        self.collection.replace_one(
+            {"_id": self.name+":"+lang+":"+key},
+            {"index": self.name, "lang": lang, "key": key, "text": folded, "grams": sorted(grams(folded))},
+            upsert=True)
+
+    def delete(self, key, lang=None):
+        the_filter={"index": self.name, "key": key}
+        if lang is not None:
+            the_filter["lang"]=lang
+        self.collection.delete_many(the_filter)
+
+    def candidates(self, lang, needed):
+        cursor=self.collection.find({"index": self.name, "lang": lang, "grams": {"$all": sorted(needed)}}, {"key": 1, "text": 1})
+        return {doc["key"]:doc["text"] for doc in cursor}
+
+    def clear(self):
+        self.collection.delete_many({"index": self.name})
+        self.built=False
+
+    def mark_built(self):
+        self.collection.replace_one({"_id": self.name+":built"}, {"index": self.name, "built": True}, upsert=True)
+        self.built=True
+
+    def is_built(self):
+        if not self.built:
+            self.built=self.collection.find_one({"_id": self.name+":built"}, {"_id": 1}) is not None
+        return self.built
+
+
+class TypeaheadIndex(object):
+    """ Autocomplete index of one text of a document
+
+        Arguments:
+            name {str} -- Unique name of the index
+            model {Document class} -- The document indexed
+            texts {callable} -- document -> {lang: text} to index, or None if the document must not be suggested (inactive...).
+                Texts not localized use the ANY_LANGUAGE key.
+
+        Keyword Arguments:
+            key {str} -- The field identifying the documents (default: {"external_id"})
+            fields {list} -- The fields texts needs, loaded from the collection when the index is built (default: {all})
+    """
+
+    def __init__(self, name, model, texts, key="external_id", fields=None):
+        self.name=name
+        self.model=model
+        self.texts=texts
+        self.key=key
+        self.fields=fields
+        self.backend=MemoryBackend()
+        self.loaded=False
+        self._lock=threading.Lock()
+        signals.post_save.connect(self.on_save, sender=model)
+        signals.post_delete.connect(self.on_delete, sender=model)
+
+    def use_backend(self, backend):
+        self.backend=backend
+        self.loaded=False
+
+    def add(self, document):
+        """ Indexes (or reindexes) the document """
+        key=getattr(document,self.key)
+        if not key:
+            return
+        self.backend.delete(key)
+        texts=self.texts(document)
+        for lang,text in (texts or {}).items():
+            folded=fold(text)
+            if folded:
+                self.backend.put(lang,key,folded)
+
+    def remove(self, document):
+        key=getattr(document,self.key)
+        if key:
+            self.backend.delete(key)
+
+    def on_save(self, sender, document, **kwargs):
+        #an index not built yet will read the document when built
+        if self.loaded or self.backend.is_built():
+            self.add(document)
+
+    def on_bulk_save(self, documents):
+        """ Indexes the documents written in bulk, without the signals (as on_save) """
+        if self.loaded or self.backend.is_built():
+            for document in documents:
+                self.add(document)
+
+    def on_delete(self, sender, document, **kwargs):
+        if self.loaded or self.backend.is_built():
+            self.remove(document)
+
+    def build(self, force=False):
+        """ Loads the index from the model collection. A persisted (mongo) index is only rebuilt if forced """
+        with self._lock:
+            if self.loaded and not force:
+                return
+            if force or not self.backend.is_built():
+                self.backend.clear()
+                documents=self.model.objects.only(self.key,*self.fields) if self.fields else self.model.objects # pylint: disable=no-member
+                for document in documents:
+                    self.add(document)
+                self.backend.mark_built()
+            self.loaded=True
+
+    def suggest(self, text, lang=ANY_LANGUAGE, limit=None):
+        """ Returns the keys of the documents whose text (in the language) contains the typed text, best ranked first
+
+            Arguments:
+                text {str} -- The typed text
+
+            Keyword Arguments:
+                lang {str} -- The language code (default: {ANY_LANGUAGE})
+                limit {int} -- Maximum number of keys (default: {None}: all)
+        """
+        folded=fold(text)
+        if not folded:
+            return []
+        if not self.loaded:
+            self.build()
+        lang=lang.lower() if lang!=ANY_LANGUAGE else lang
+        found=[(rank(folded,candidate),key) for key,candidate in self.backend.candidates(lang,query_grams(folded)).items() if folded in candidate]
+        found.sort()
+        keys=[key for _,key in found]
+        return keys[:limit] if limit else keys
+
+    def seek(self, text, lang=ANY_LANGUAGE, limit=None):
+        """ Returns the documents suggested (suggest), in their rank, fetched in one query """
+        keys=self.suggest(text,lang,limit)
+        if not keys:
+            return []
+        documents={getattr(document,self.key):document for document in self.model.objects(**{self.key+"__in":keys})} # pylint: disable=no-member
+        return [documents[key] for key in keys if key in documents]
+
+
+indexes=OrderedDict()
+
+
+def typeahead_index(name, model, texts, key="external_id", fields=None):
+    """ Creates and registers a typeahead index (see TypeaheadIndex) """
+    indexes[name]=TypeaheadIndex(name,model,texts,key=key,fields=fields)
+    return indexes[name]
+
+
+def configure(backend="memory", collection=None):
+    """ Sets the backend of all the registered indexes
+
+        Keyword Arguments:
+            backend {str} -- "memory" or "mongo" (default: {"memory"})
+            collection {pymongo Collection} -- The collection of the mongo backend (default: {typeahead})
+    """
+    if backend not in ("memory","mongo"):
+        raise ValueError("ERROR: Unknown typeahead backend: "+str(backend))
+    for name,index in indexes.items():
+        index.use_backend(MongoBackend(name,collection) if backend=="mongo" else MemoryBackend())
+
+
+def rebuild_all():
+    """ Rebuilds every registered index from its collection """
+    for index in indexes.values():
+        index.build(force=True)
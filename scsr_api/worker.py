@@ -0,0 +1,12 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from application import ScsrAPP
+from utils.tasks import celery_app
+
+"""Celery worker of the background tasks: celery -A worker worker --loglevel=info
+    The application is created so the tasks run with its configuration and database connection.
+"""
+
+scsr_app = ScsrAPP()
+celery = celery_app